@@ -0,0 +1,70 @@
+import json
+import os
+import threading
+from typing import Dict, List, Optional
+
+
+class AnalysisJournal:
+    """分析が終わった行を1行1JSONで追記するジャーナル (JSONL)
+
+    シートへの書き込み前にプロセスが落ちても、次回の起動時に replay() で
+    分析結果を取り出し、APIを呼ばずにシートへ書き込める。
+    全件の書き込みが終わったら reset() で空にする。
+    """
+
+    def __init__(self, path: str, fsync: bool = False):
+        self.path = path
+        self.fsync = fsync
+        self.appended = 0
+        self._lock = threading.Lock()
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        # 追記モードで開いたままにする (1件ごとにflushするため、プロセスが落ちても書いた分は残る)
+        self._file = open(path, "a", encoding="utf-8")
+
+    def append(self, sheet_row_number: int, video_id: str, write_data: List[str], write_range: Optional[str] = None) -> None:
+        """1行分の分析結果を記録する (write_range は書き込み先の列範囲。例: 'M:X')"""
+        entry = {"row": sheet_row_number, "video_id": video_id, "write_data": write_data}
+        if write_range is not None:
+            entry["range"] = write_range
+        line = json.dumps(entry, ensure_ascii=False)
+        with self._lock:
+            self._file.write(line + "\n")
+            self._file.flush()
+            if self.fsync:
+                os.fsync(self._file.fileno())
+            self.appended += 1
+
+    def replay(self) -> Dict[int, Dict]:
+        """記録済みの分析結果を 行番号→{video_id, write_data, range} で返す (同じ行は後の記録を優先)
+
+        range は記録時の列範囲 (範囲を記録していなかった古い行ではNone)。
+        書き込み途中で落ちた最後の1行など、壊れた行は読み飛ばす。
+        """
+        entries: Dict[int, Dict] = {}
+        with self._lock:
+            self._file.flush()
+            with open(self.path, encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                        entries[int(entry["row"])] = {
+                            "video_id": entry["video_id"], "write_data": entry["write_data"], "range": entry.get("range"),
+                        }
+                    except (ValueError, KeyError, TypeError):
+                        continue
+        return entries
+
+    def reset(self) -> None:
+        """全件がシートへ書き込まれた後にジャーナルを空にする"""
+        with self._lock:
+            self._file.seek(0)
+            self._file.truncate()
+            self._file.flush()
+            self.appended = 0
+
+    def close(self) -> None:
+        with self._lock:
+            self._file.close()
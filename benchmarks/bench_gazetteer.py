@@ -0,0 +1,86 @@
+"""経由地の正規化 (gazetteer_index) のマイクロベンチマーク
+
+Geminiが返しがちな表記 (「〇〇IC入口通過」「〇〇インター」「東名〇〇SA」、誤記、辞書にない地名、
+ICやSAの名前の一部になっている地名だけのもの) を混ぜた経由地の列に対して、1件あたりの照合時間
+(キャッシュなし / あり) と照合方法ごとの件数を出力する。
+
+    python benchmarks/bench_gazetteer.py [--waypoints 200000]
+"""
+import argparse
+import os
+import random
+import sys
+import time
+from collections import Counter
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from gazetteer_index import GazetteerIndex  # noqa: E402
+
+GAZETTEER_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "gazetteer.tsv")
+
+# 辞書の地点に対応付けてはいけない名前 (辞書にない場所と、ICやSAの名前の一部になっている地名・川の名前)
+NOT_IN_GAZETTEER = [
+    "ハンガーナイン", "トヨタモビリティ東京", "宮ヶ瀬湖畔", "道の駅どうし",
+    "東京", "川崎", "横浜", "海老名", "厚木", "秦野", "中井", "大井", "松田", "御殿場", "沼津", "富士", "富士川",
+    "豊田", "伊勢原", "調布", "府中", "八王子", "相模湖", "大月", "河口湖", "相模原", "青梅", "練馬", "所沢",
+    "三芳", "浦和", "蓮田", "佐野", "宇都宮", "足柄", "大黒ふ頭", "辰巳",
+]
+
+# (表記の作り方, 辞書の地点に対応付くべきか)
+VARIANTS = [
+    (lambda name: name, True),
+    (lambda name: name + "入口通過", True),
+    (lambda name: name + "を通過", True),
+    (lambda name: name.replace("IC", "インター").replace("JCT", "ジャンクション").replace("SA", "サービスエリア"), True),
+    (lambda name: "東名" + name, True),
+    (lambda name: name.replace("JCT", "JTC").replace("IC", "I.C"), True),
+    (lambda name: f"国道{random.randint(1, 507)}号線を走行", True),
+    (lambda name: random.choice(NOT_IN_GAZETTEER), False),
+]
+
+
+def build_waypoints(index, count, seed=0):
+    random.seed(seed)
+    names = [place.name for place in index.places.values()]
+    waypoints, expected = [], []
+    for _ in range(count):
+        variant, resolvable = random.choice(VARIANTS)
+        waypoints.append(variant(random.choice(names)))
+        expected.append(resolvable)
+    return waypoints, expected
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--waypoints", type=int, default=200_000)
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    index = GazetteerIndex.load(GAZETTEER_PATH)
+    print(f"index: {len(index.places)} places, built in {(time.perf_counter() - started) * 1000:.2f}ms")
+
+    waypoints, expected = build_waypoints(index, args.waypoints)
+    distinct = list(dict.fromkeys(waypoints))
+
+    started = time.perf_counter()
+    for text in distinct:
+        index._resolve(text)
+    uncached = (time.perf_counter() - started) / len(distinct)
+
+    started = time.perf_counter()
+    results = [index.resolve(text) for text in waypoints]
+    cached = (time.perf_counter() - started) / len(waypoints)
+
+    methods = Counter(match.method if match else "unresolved" for match in results)
+    missed = sum(1 for match, resolvable in zip(results, expected) if resolvable and match is None)
+    false_hits = sum(1 for match, resolvable in zip(results, expected) if not resolvable and match is not None)
+
+    print(f"{len(waypoints)} waypoints ({len(distinct)} distinct)")
+    print(f"uncached: {uncached * 1e6:7.2f}us/waypoint   with cache: {cached * 1e6:7.2f}us/waypoint")
+    print("methods: " + ", ".join(f"{method}={count}" for method, count in methods.most_common()))
+    print(f"missed (should resolve): {missed}   false hits (should not resolve): {false_hits}")
+
+
+if __name__ == "__main__":
+    main()
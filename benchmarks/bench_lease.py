@@ -0,0 +1,119 @@
+"""作業リース (lease_store) の動作確認とベンチマーク
+
+1つのSQLiteファイルを2つの SQLiteLeaseStore (別々の実行に相当) で共有し、次のシナリオを確かめる。
+- 取り合い: 両方のストアが同じ動画IDを並行に claim しても、各IDはどちらか一方だけが取得する (全IDが取得される)
+- 延長: 自分が持っているリースは claim し直せる (相手は取れない)
+- 期限切れ: TTLを過ぎたリースは相手が取り直せ、元の所有者は取れなくなる
+- 解放: release() したリースは相手がすぐに取れる。相手のリースは release() しても消えない
+取り合いの claim 数/秒も出力する。期待どおりでないシナリオがあれば終了コード1で終わる。
+
+    python benchmarks/bench_lease.py [--keys 2000] [--batch 20] [--work 0.001] [--ttl 0.5]
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from lease_store import SQLiteLeaseStore  # noqa: E402
+
+LONG_TTL = 3600.0
+
+
+def contention(path, keys, batch, work_seconds, threads_per_store=2):
+    """2つのストアで同じIDの列を別々の順に claim し、(所有者ごとの取得ID, 経過秒, claim 回数) を返す
+
+    claim の間に work_seconds 待つ (動画の分析に相当)。待たないと一方の実行が書き込みロックを取り続け、
+    取り合いにならない。
+    """
+    stores = {"run-a": SQLiteLeaseStore(path), "run-b": SQLiteLeaseStore(path)}
+    claimed = {owner: [] for owner in stores}
+    calls = [0]
+    lock = threading.Lock()
+    barrier = threading.Barrier(len(stores) * threads_per_store)
+
+    def worker(owner, seed):
+        order = list(keys)
+        random.Random(seed).shuffle(order)
+        barrier.wait()
+        for offset in range(0, len(order), batch):
+            got = stores[owner].claim(order[offset:offset + batch], owner, LONG_TTL)
+            with lock:
+                claimed[owner].extend(got)
+                calls[0] += 1
+            time.sleep(work_seconds)
+
+    threads = [
+        threading.Thread(target=worker, args=(owner, seed))
+        for seed, owner in enumerate(owner for owner in stores for _ in range(threads_per_store))
+    ]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    for store in stores.values():
+        store.close()
+    return claimed, elapsed, calls[0]
+
+
+def check(results, name, ok, detail=""):
+    results.append(ok)
+    print(f"{'ok  ' if ok else 'FAIL'} {name}{f'  ({detail})' if detail else ''}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--keys", type=int, default=2000, help="取り合う動画IDの数")
+    parser.add_argument("--batch", type=int, default=20, help="1回の claim に渡すIDの数")
+    parser.add_argument("--work", type=float, default=0.001, help="claim の間の待ち時間 (秒)")
+    parser.add_argument("--ttl", type=float, default=0.5, help="期限切れシナリオのTTL (秒)")
+    args = parser.parse_args()
+
+    results = []
+    with tempfile.TemporaryDirectory(prefix="route-lease-") as directory:
+        # 取り合い
+        keys = [f"video{index:06d}" for index in range(args.keys)]
+        claimed, elapsed, calls = contention(os.path.join(directory, "contention.sqlite3"), keys, args.batch, args.work)
+        a, b = set(claimed["run-a"]), set(claimed["run-b"])
+        print(
+            f"contention: {len(keys)} keys, {calls} claims in {elapsed:.3f}s ({calls / elapsed:,.0f} claims/s), "
+            f"run-a={len(a)} run-b={len(b)}"
+        )
+        check(results, "no key is held by both runs", not a & b, f"{len(a & b)} shared")
+        check(results, "every key is claimed by some run", a | b == set(keys), f"{len(set(keys) - (a | b))} unclaimed")
+
+        path = os.path.join(directory, "lifecycle.sqlite3")
+        run_a, run_b = SQLiteLeaseStore(path), SQLiteLeaseStore(path)
+
+        # 延長
+        check(results, "run-a claims a free key", run_a.claim(["v1"], "run-a", args.ttl) == ["v1"])
+        check(results, "run-b cannot claim a live lease", run_b.claim(["v1"], "run-b", LONG_TTL) == [])
+        check(results, "run-a can renew its own lease", run_a.claim(["v1"], "run-a", args.ttl) == ["v1"])
+
+        # 期限切れ
+        time.sleep(args.ttl * 1.2)
+        check(results, "run-b re-claims an expired lease", run_b.claim(["v1"], "run-b", LONG_TTL) == ["v1"])
+        check(results, "run-a loses the expired lease", run_a.claim(["v1"], "run-a", LONG_TTL) == [])
+
+        # 解放
+        run_a.release(["v1"], "run-a")
+        check(results, "releasing someone else's lease is a no-op", run_a.claim(["v1"], "run-a", LONG_TTL) == [])
+        run_b.release(["v1"], "run-b")
+        check(results, "run-a claims a released lease immediately", run_a.claim(["v1"], "run-a", LONG_TTL) == ["v1"])
+
+        run_a.close()
+        run_b.close()
+
+    failures = results.count(False)
+    print(f"\n{len(results) - failures}/{len(results)} checks passed")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,231 @@
+"""route_analyzer.main() のオフラインベンチマーク
+
+Sheets / YouTubeトランスクリプト / Gemini をローカルの偽実装 (benchmarks/fakes.py) に差し替えて
+main() を実行し、行数/秒・ステージごとの p50/p99 レイテンシ・ピークRSS を出力する。
+各シナリオは別プロセスで実行するため、ピークRSSはシナリオごとの値になる。
+
+    python benchmarks/bench_pipeline.py                          # 全シナリオ (100 / 10k / 100k 行 / 分割分析)
+    python benchmarks/bench_pipeline.py --scenario 100 --mode async
+    python benchmarks/bench_pipeline.py --scenario 10k --mode distance_backfill --analyzed-ratio 1.0
+    python benchmarks/bench_pipeline.py --save baseline.json     # 結果を保存
+    python benchmarks/bench_pipeline.py --baseline baseline.json # 保存した結果と比較
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# シナリオごとの既定値 (遅延は秒)。行数が多いほど遅延を小さくし、実行時間を現実的な範囲に収める
+SCENARIOS = {
+    "100": {"rows": 100, "segments": 300, "transcript_latency": 0.05, "gemini_latency": 0.2, "sheet_latency": 0.1},
+    "10k": {"rows": 10_000, "segments": 100, "transcript_latency": 0.002, "gemini_latency": 0.005, "sheet_latency": 0.01},
+    "100k": {"rows": 100_000, "segments": 50, "transcript_latency": 0.0, "gemini_latency": 0.0, "sheet_latency": 0.0},
+    # 長いトランスクリプトを区間に分けて分析する (map-reduce)。1動画あたり約9千トークンを2千トークンの区間に分ける
+    "chunked": {"rows": 30, "segments": 600, "transcript_latency": 0.0, "gemini_latency": 0.01, "sheet_latency": 0.0,
+                "env": {"GEMINI_CHUNK_MODE": "auto", "GEMINI_CHUNK_TOKENS": "2000", "GEMINI_CHUNK_OVERLAP_TOKENS": "200"}},
+}
+
+
+def run_scenario(config):
+    """1シナリオを現在のプロセスで実行し、結果の辞書を返す"""
+    cache_dir = tempfile.mkdtemp(prefix="route-bench-")
+    # route_analyzer は import 時に環境変数を読むため、import より前に設定する
+    os.environ.update({
+        "CACHE_DIR": cache_dir,
+        "GEMINI_CACHE": "off",
+        "PIPELINE_MODE": config["mode"] if config["mode"] in ("async", "distance_backfill") else "sequential",
+        "GEMINI_BATCH_MODE": "on" if config["mode"] == "batch" else "off",
+        "YOUTUBE_RPM": "1e9",
+        "GEMINI_RPM": "1e9",
+        "GEMINI_TPM": "1e12",
+        "SHEET_WRITE_RPM": "1e9",
+        "SHEET_FLUSH_EVERY": str(config["flush_every"]),
+        "RUN_REPORT_PATH": os.path.join(cache_dir, "run_report.json"),
+    })
+    os.environ.update(config.get("env", {}))
+
+    import route_analyzer
+    from benchmarks.fakes import (
+        FakeGeminiModel, FakeGspreadClient, FakePushgateway, FakeTranscriptApi, FakeWorksheet, StageRecorder,
+        build_sheet_values,
+    )
+
+    recorder = StageRecorder()
+    worksheet = FakeWorksheet(
+        build_sheet_values(config["rows"], analyzed_ratio=config["analyzed_ratio"]),
+        recorder, latency=config["sheet_latency"], error_rate=config["error_rate"],
+    )
+    transcript_api = FakeTranscriptApi(
+        recorder, segments_per_video=config["segments"],
+        latency=config["transcript_latency"], jitter=config["transcript_latency"] / 2, error_rate=config["error_rate"],
+        freeform_rate=config.get("freeform_rate", 0.0),
+    )
+    gemini_models = []
+
+    def create_gemini_model(kind, model_name):
+        # route_analyzer.create_gemini_model と同じく、指示文は用途ごとのモデル側に持たせる
+        # 最上位以外のティアは sparse_rate の割合で不十分な結果を返す
+        instruction = route_analyzer.GEMINI_TASKS[kind][0] if route_analyzer.GEMINI_SYSTEM_INSTRUCTION != "off" else None
+        model = FakeGeminiModel(
+            recorder, latency=config["gemini_latency"], jitter=config["gemini_latency"] / 2, error_rate=config["error_rate"],
+            system_instruction=instruction,
+            input_latency_per_1k=config.get("gemini_input_latency", 0.0), model_name=model_name,
+            sparse_rate=config.get("gemini_sparse_rate", 0.0) if model_name != route_analyzer.GEMINI_MODEL_TIERS[-1] else 0.0,
+            kind=kind,
+        )
+        gemini_models.append(model)
+        return model
+
+    route_analyzer.get_gspread_client = lambda: FakeGspreadClient(worksheet)
+    route_analyzer.create_gemini_model = create_gemini_model
+    route_analyzer.yta = transcript_api.as_module()
+
+    log = io.StringIO()
+    with FakePushgateway() as gateway, contextlib.redirect_stdout(log):
+        # メトリクスの送信も計測に含める (ローカルの代替Pushgatewayへ送る)
+        if config.get("pushgateway"):
+            route_analyzer.METRICS_PUSHGATEWAY_URL = gateway.url
+        started = time.perf_counter()
+        route_analyzer.main()
+        elapsed = time.perf_counter() - started
+    metrics = gateway.samples()
+
+    rows_written = sum(len(update["values"]) for update in worksheet.updates)
+    # 出発地点 (M列) も終着地点 (X列) も空のまま書き込まれた行 (分析が失敗した行)
+    start_column = route_analyzer.column_letter(route_analyzer.START_COLUMN_INDEX)
+    end_offset = route_analyzer.END_COLUMN_INDEX - route_analyzer.START_COLUMN_INDEX
+    blank_rows = sum(
+        1 for update in worksheet.updates if update["range"].startswith(start_column)
+        for row in update["values"] if not row[0] and not row[end_offset]
+    )
+    return {
+        "scenario": config["name"],
+        "mode": config["mode"],
+        "rows": config["rows"],
+        "rows_written": rows_written,
+        "blank_rows": blank_rows,
+        "elapsed_s": round(elapsed, 3),
+        "rows_per_s": round(config["rows"] / elapsed, 1),
+        "written_per_s": round(rows_written / elapsed, 1),
+        "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        "gemini_prompt_tokens": sum(model.prompt_tokens for model in gemini_models),
+        "sheet_bytes": worksheet.bytes_transferred,
+        "tiers": route_analyzer.run_report.tier_summary(),
+        "agreement": route_analyzer.run_report.agreement_summary(),
+        "distance": route_analyzer.run_report.distance_summary(),
+        "stages": recorder.summary(),
+        "metric_samples": len(metrics),
+    }
+
+
+def run_in_subprocess(config):
+    """シナリオを別プロセスで実行する (ピークRSSとimport状態をシナリオごとに分けるため)"""
+    completed = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), "--run-one", json.dumps(config)],
+        capture_output=True, text=True, cwd=ROOT,
+    )
+    if completed.returncode != 0:
+        raise RuntimeError(f"scenario {config['name']} failed:\n{completed.stderr}")
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+
+def print_result(result, baseline=None):
+    line = (
+        f"[{result['scenario']:>5} / {result['mode']:<10}] rows={result['rows']:>7} written={result['rows_written']:>7} "
+        f"elapsed={result['elapsed_s']:8.2f}s  rows/s={result['rows_per_s']:>9.1f}  peak_rss={result['peak_rss_mb']:7.1f}MB"
+    )
+    if baseline:
+        line += f"  (rows/s x{result['rows_per_s'] / baseline['rows_per_s']:.2f} vs baseline)"
+    print(line)
+    if result["blank_rows"]:
+        print(f"    blank rows={result['blank_rows']} (start and end both empty)")
+    if result["gemini_prompt_tokens"]:
+        print(f"    gemini input tokens={result['gemini_prompt_tokens']}")
+    for tier, stats in result.get("tiers", {}).items():
+        print(
+            f"    tier {tier:<20} videos={stats['videos']:>7}  accepted={stats['accepted']:>7}  "
+            f"escalated={sum(stats['escalated'].values()):>7}  p50={stats['p50_ms']:9.2f}ms  p90={stats['p90_ms']:9.2f}ms"
+        )
+    for name, fields in result.get("agreement", {}).items():
+        print(f"    agreement {name}: " + "  ".join(f"{field}={stats['mean']:.3f}" for field, stats in fields.items())
+              + f"  (n={next(iter(fields.values()))['count']})")
+    if result.get("distance"):
+        print(f"    distance {result['distance']}")
+    for stage, stats in sorted(result["stages"].items()):
+        print(
+            f"    {stage:<12} count={stats['count']:>7}  total={stats['total_s']:9.3f}s  "
+            f"p50={stats['p50_ms']:9.2f}ms  p99={stats['p99_ms']:9.2f}ms"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--scenario", action="append", choices=sorted(SCENARIOS), help="実行するシナリオ (複数指定可)")
+    parser.add_argument("--mode", default="sequential", choices=["sequential", "async", "batch", "distance_backfill"])
+    parser.add_argument("--rows", type=int, help="行数を上書き")
+    parser.add_argument("--segments", type=int, help="1動画あたりのセグメント数を上書き")
+    parser.add_argument("--transcript-latency", type=float)
+    parser.add_argument("--gemini-latency", type=float)
+    parser.add_argument("--sheet-latency", type=float)
+    parser.add_argument("--gemini-input-latency", type=float, default=0.0,
+                        help="Gemini入力1000トークンごとの追加遅延 (秒)")
+    parser.add_argument("--freeform-rate", type=float, default=0.0,
+                        help="定型表現を使わない (ルールベース抽出で確定できない) 動画の割合")
+    parser.add_argument("--gemini-sparse-rate", type=float, default=0.0,
+                        help="最上位以外のティアが不十分な結果を返す割合 (GEMINI_MODEL_TIERS と併用)")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="各偽サービスのエラー率")
+    parser.add_argument("--analyzed-ratio", type=float, default=0.0, help="分析済み(M列記入済み)の行の割合")
+    parser.add_argument("--flush-every", type=int, default=500)
+    parser.add_argument("--env", action="append", default=[], help="route_analyzerに渡す追加の環境変数 (KEY=VALUE)")
+    parser.add_argument("--pushgateway", action="store_true", help="ローカルの代替Pushgatewayへメトリクスを送る")
+    parser.add_argument("--save", help="結果をJSONで保存するパス")
+    parser.add_argument("--baseline", help="比較対象の結果JSON")
+    parser.add_argument("--run-one", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_one:
+        print(json.dumps(run_scenario(json.loads(args.run_one)), ensure_ascii=False))
+        return
+
+    baseline = {}
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = {(r["scenario"], r["mode"]): r for r in json.load(f)}
+
+    results = []
+    for name in args.scenario or list(SCENARIOS):
+        config = dict(SCENARIOS[name], name=name, mode=args.mode, error_rate=args.error_rate,
+                      analyzed_ratio=args.analyzed_ratio, flush_every=args.flush_every,
+                      pushgateway=args.pushgateway, gemini_input_latency=args.gemini_input_latency,
+                      gemini_sparse_rate=args.gemini_sparse_rate, freeform_rate=args.freeform_rate,
+                      env=dict(SCENARIOS[name].get("env", {}), **dict(item.split("=", 1) for item in args.env)))
+        for key in ("rows", "segments", "transcript_latency", "gemini_latency", "sheet_latency"):
+            if getattr(args, key) is not None:
+                config[key] = getattr(args, key)
+
+        result = run_in_subprocess(config)
+        results.append(result)
+        print_result(result, baseline.get((result["scenario"], result["mode"])))
+
+    if args.save:
+        with open(args.save, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+        print(f"\nSaved results to {args.save}")
+
+    # エラーを注入していないのに空の行を書き込んだシナリオは失敗とする (分析経路が壊れている)
+    if not args.error_rate and any(result["blank_rows"] for result in results):
+        print("\nFAIL: blank rows were written without injected errors")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
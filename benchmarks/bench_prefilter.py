@@ -0,0 +1,102 @@
+"""トランスクリプト事前絞り込み (route_prefilter) の回帰テスト用ハーネス
+
+固定のサンプル集 (benchmarks/data/prefilter_samples.json) に対して、
+- トークン削減率
+- 正解ルート (start/end/waypoints) の地名が絞り込み後のテキストに残っている割合 (根拠の再現率)
+を出力する。再現率が全文の場合より下がったら終了コード1で終わる。
+
+--live を付けると、実際にGeminiで全文/絞り込み後の両方を分析し、正解との一致率を比較する
+(GEMINI_API_KEY 等の認証情報が必要)。
+
+    python benchmarks/bench_prefilter.py [--window 2] [--live]
+"""
+import argparse
+import json
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from route_prefilter import filter_segments  # noqa: E402
+from transcript_chunker import join_segments  # noqa: E402
+
+SAMPLES_PATH = os.path.join(ROOT, "benchmarks", "data", "prefilter_samples.json")
+
+
+def load_samples(path=SAMPLES_PATH):
+    """サンプル集を読み込み、セグメント一覧 (5秒刻みの仮タイムスタンプ付き) に変換する"""
+    with open(path, encoding="utf-8") as f:
+        samples = json.load(f)
+    for sample in samples:
+        sample["segments"] = [
+            {"text": text, "start": i * 5.0, "duration": 5.0} for i, text in enumerate(sample["texts"])
+        ]
+    return samples
+
+
+def expected_places(expected):
+    return [expected["start"], expected["end"], *expected["waypoints"]]
+
+
+def evidence_recall(text, expected):
+    """正解の地名のうち、テキスト中に現れるものの割合"""
+    places = expected_places(expected)
+    return sum(1 for place in places if place in text) / len(places)
+
+
+def route_agreement(result, expected):
+    """分析結果と正解の一致率 (正解の地名が結果のいずれかの項目に含まれる割合)"""
+    values = [result.get("start", ""), result.get("end", ""), *result.get("waypoints", [])]
+    places = expected_places(expected)
+    return sum(1 for place in places if any(place in value for value in values)) / len(places)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--window", type=int, default=2)
+    parser.add_argument("--live", action="store_true", help="Geminiで実際に分析して比較する")
+    args = parser.parse_args()
+
+    samples = load_samples()
+    analyze = None
+    if args.live:
+        import route_analyzer
+        analyze = route_analyzer.analyze_route_with_gemini
+
+    regressions = 0
+    total_before = total_after = 0
+    for sample in samples:
+        kept, stats = filter_segments(sample["segments"], window=args.window)
+        full_text = join_segments(sample["segments"])
+        filtered_text = join_segments(kept)
+        recall_full = evidence_recall(full_text, sample["expected"])
+        recall_filtered = evidence_recall(filtered_text, sample["expected"])
+        total_before += stats["tokens_before"]
+        total_after += stats["tokens_after"]
+
+        line = (
+            f"{sample['video_id']}: segments {stats['segments_before']:>3}->{stats['segments_after']:<3} "
+            f"tokens {stats['tokens_before']:>5}->{stats['tokens_after']:<5} "
+            f"reduction={stats['reduction']:5.1%}  evidence recall {recall_full:.2f}->{recall_filtered:.2f}"
+        )
+        if recall_filtered < recall_full:
+            regressions += 1
+            line += "  << REGRESSION"
+
+        if analyze is not None:
+            agreement_full = route_agreement(analyze(full_text), sample["expected"])
+            agreement_filtered = route_agreement(analyze(filtered_text), sample["expected"])
+            line += f"  gemini agreement {agreement_full:.2f}->{agreement_filtered:.2f}"
+            if agreement_filtered < agreement_full:
+                regressions += 1
+                line += "  << REGRESSION"
+
+        print(line)
+
+    print(f"\ntotal tokens {total_before}->{total_after} ({1 - total_after / total_before:.1%} reduction), regressions={regressions}")
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
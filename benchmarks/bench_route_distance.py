@@ -0,0 +1,72 @@
+"""走行距離の推定 (route_geometry) のマイクロベンチマーク
+
+地名辞書の地点 (高速道路網上のIC/JCT/SA/PA、網につながっていない地点) と座標のない地点 (国道等) を
+混ぜたルートに対して、全ルートを1回の estimate でまとめて推定した場合と、1ルートずつ推定した場合の
+ルート数/秒と、区間の推定方法ごとの件数を出力する。
+
+    python benchmarks/bench_route_distance.py [--routes 100000]
+"""
+import argparse
+import os
+import random
+import sys
+import time
+from collections import Counter
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from gazetteer_index import GazetteerIndex  # noqa: E402
+from route_geometry import RouteGraph  # noqa: E402
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def build_routes(index, count, seed=0):
+    """2〜12地点のルートを作る (1割は座標のない地点)"""
+    random.seed(seed)
+    places = list(index.places.values())
+    routes = []
+    for _ in range(count):
+        route = []
+        for _ in range(random.randint(2, 12)):
+            if random.random() < 0.1:
+                route.append((f"national_route:{random.randint(1, 507)}", None, None))
+            else:
+                place = random.choice(places)
+                route.append((place.id, place.lat, place.lon))
+        routes.append(route)
+    return routes
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--routes", type=int, default=100_000)
+    args = parser.parse_args()
+
+    index = GazetteerIndex.load(os.path.join(ROOT, "gazetteer.tsv"))
+    started = time.perf_counter()
+    graph = RouteGraph.load(os.path.join(ROOT, "expressway_graph.tsv"), index.places)
+    print(f"graph: {len(graph.nodes)} nodes, {len(graph.neighbors) // 2} edges, built in {(time.perf_counter() - started) * 1000:.2f}ms")
+
+    routes = build_routes(index, args.routes)
+
+    started = time.perf_counter()
+    results = graph.estimate(routes)
+    batched = time.perf_counter() - started
+
+    graph._shortest_from.cache_clear()
+    sample = routes[:min(len(routes), 10_000)]
+    started = time.perf_counter()
+    for route in sample:
+        graph.estimate([route])
+    one_by_one = (time.perf_counter() - started) / len(sample) * len(routes)
+
+    methods = Counter(leg["method"] for result in results for leg in result["legs"])
+    estimated = sum(1 for result in results if result["total_km"] is not None)
+    print(f"{len(routes)} routes ({estimated} with a distance)")
+    print(f"batched: {len(routes) / batched:10.0f} routes/s   one by one: {len(routes) / one_by_one:10.0f} routes/s")
+    print("legs: " + ", ".join(f"{method}={count}" for method, count in methods.most_common()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+"""シート読み込みのベンチマーク: get_all_values() と列指定の batch_get を比較する
+
+ローカルの偽ワークシートを使うため、認証情報やネットワークは不要。
+ペイロードはAPIレスポンス相当のJSONにシリアライズ/デシリアライズしてサイズを測る。
+
+    python benchmarks/bench_sheet_read.py --rows 2000 --columns 40
+"""
+import argparse
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.fakes import FakeWorksheet  # noqa: E402
+from sheet_io import read_url_and_start_columns, rows_from_all_values  # noqa: E402
+
+URL_COLUMN_INDEX = 4    # E列
+START_COLUMN_INDEX = 12 # M列
+
+
+def build_sheet(rows: int, columns: int):
+    """テスト用の幅広いシートを作る (半分は分析済み)"""
+    header = [f"col{c}" for c in range(columns)]
+    values = [header]
+    for r in range(rows):
+        row = [f"セル{r}-{c} サンプルテキスト" for c in range(columns)]
+        row[URL_COLUMN_INDEX] = f"https://www.youtube.com/watch?v={r:011d}"
+        row[START_COLUMN_INDEX] = "東京スバル三鷹店" if r % 2 else ""
+        values.append(row)
+    return values
+
+
+def measure(name, sheet, read):
+    sheet.bytes_transferred = 0
+    tracemalloc.start()
+    started = time.perf_counter()
+    rows = read(sheet)
+    elapsed = time.perf_counter() - started
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(
+        f"{name:<10} rows={len(rows):>7}  time={elapsed * 1000:8.1f} ms  "
+        f"payload={sheet.bytes_transferred / 1024:9.1f} KiB  peak_mem={peak / 1024:9.1f} KiB"
+    )
+    return rows, elapsed, sheet.bytes_transferred, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=2000)
+    parser.add_argument("--columns", type=int, default=40)
+    args = parser.parse_args()
+
+    sheet = FakeWorksheet(build_sheet(args.rows, args.columns))
+
+    full_rows, full_time, full_bytes, full_peak = measure(
+        "full", sheet, lambda s: rows_from_all_values(s.get_all_values(), URL_COLUMN_INDEX, START_COLUMN_INDEX)
+    )
+    projected_rows, projected_time, projected_bytes, projected_peak = measure(
+        "projected", sheet, lambda s: read_url_and_start_columns(s, URL_COLUMN_INDEX, START_COLUMN_INDEX)
+    )
+
+    assert full_rows == projected_rows, "projected read returned different rows"
+    print(
+        f"\nprojected vs full: time x{full_time / projected_time:.1f}, "
+        f"payload x{full_bytes / projected_bytes:.1f}, memory x{full_peak / projected_peak:.1f}"
+    )
+
+
+if __name__ == "__main__":
+    main()
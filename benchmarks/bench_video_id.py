@@ -0,0 +1,82 @@
+"""動画ID抽出のマイクロベンチマーク (旧 split() 実装 vs youtube_url)
+
+様々な形のURLを混ぜた列に対して、1件ずつの parse_video_id、列まとめての
+parse_video_ids、旧実装の処理時間と、旧実装が正しいIDを返せなかった件数を出力する。
+
+    python benchmarks/bench_video_id.py [--urls 1000000]
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from youtube_url import parse_video_id, parse_video_ids  # noqa: E402
+
+ID_ALPHABET = "ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789-_"
+
+# (URLテンプレート, 正しい動画IDが取れるべきか)
+URL_SHAPES = [
+    ("https://www.youtube.com/watch?v={id}", True),
+    ("https://www.youtube.com/watch?v={id}&t=120s", True),
+    ("https://youtu.be/{id}", True),
+    ("https://youtu.be/{id}?si=AbCdEfGh", True),
+    ("https://youtu.be/{id}#t=30", True),
+    ("https://m.youtube.com/watch?feature=share&v={id}", True),
+    ("https://music.youtube.com/watch?v={id}&list=RDAMVM", True),
+    ("https://www.youtube.com/shorts/{id}", True),
+    ("https://www.youtube.com/embed/{id}?start=10", True),
+    ("https://www.youtube.com/live/{id}?si=xyz", True),
+    ("https://www.youtube.com/watch?v={id}#comments", True),
+    ("https://example.com/page?v={id}", False),
+]
+
+
+def legacy_get_video_id(url):
+    """変更前の route_analyzer.get_video_id (現在は parse_video_ids に置き換え済み)"""
+    if "youtu.be" in url:
+        return url.split("/")[-1].split("?")[0]
+    elif "v=" in url:
+        return url.split("v=")[-1].split("&")[0]
+    return None
+
+
+def build_urls(count, seed=0):
+    rng = random.Random(seed)
+    urls, expected = [], []
+    for _ in range(count):
+        video_id = "".join(rng.choice(ID_ALPHABET) for _ in range(11))
+        template, valid = URL_SHAPES[rng.randrange(len(URL_SHAPES))]
+        urls.append(template.format(id=video_id))
+        expected.append(video_id if valid else None)
+    return urls, expected
+
+
+def timed(label, func, urls, expected):
+    started = time.perf_counter()
+    results = func(urls)
+    elapsed = time.perf_counter() - started
+    wrong = sum(1 for got, want in zip(results, expected) if got != want)
+    print(f"{label:<26} {elapsed:7.3f}s  {len(urls) / elapsed / 1e6:6.2f}M urls/s  wrong={wrong}")
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--urls", type=int, default=1_000_000)
+    args = parser.parse_args()
+
+    urls, expected = build_urls(args.urls)
+    print(f"{len(urls)} URLs, {len(URL_SHAPES)} shapes\n")
+
+    legacy = timed("legacy split()", lambda items: [legacy_get_video_id(url) for url in items], urls, expected)
+    single = timed("parse_video_id (per URL)", lambda items: [parse_video_id(url) for url in items], urls, expected)
+    bulk = timed("parse_video_ids (column)", parse_video_ids, urls, expected)
+
+    print(f"\nper URL: x{legacy / single:.2f} vs legacy, column: x{legacy / bulk:.2f} vs legacy")
+
+
+if __name__ == "__main__":
+    main()
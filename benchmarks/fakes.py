@@ -0,0 +1,416 @@
+"""ベンチマーク用のローカル代替実装 (Google Sheets / YouTubeトランスクリプト / Gemini / Pushgateway)
+
+どれも認証情報やネットワークなしで動き、遅延・エラー率・トランスクリプトの大きさを設定できる。
+各呼び出しの所要時間は StageRecorder にステージ名ごとに記録される。
+"""
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from types import SimpleNamespace
+
+from youtube_transcript_api import TranscriptsDisabled
+
+from run_report import percentile
+from sheet_io import column_letter
+from transcript_chunker import estimate_tokens
+
+
+class StageRecorder:
+    """ステージごとの所要時間 (秒) を記録する (スレッドセーフ)"""
+
+    def __init__(self):
+        self.samples = {}
+        self._lock = threading.Lock()
+
+    def record(self, stage, seconds):
+        with self._lock:
+            self.samples.setdefault(stage, []).append(seconds)
+
+    def summary(self):
+        """ステージごとの件数・合計・p50・p99 (ミリ秒)"""
+        result = {}
+        for stage, values in self.samples.items():
+            ordered = sorted(values)
+            result[stage] = {
+                "count": len(ordered),
+                "total_s": round(sum(ordered), 3),
+                "p50_ms": round(percentile(ordered, 50) * 1000, 2),
+                "p99_ms": round(percentile(ordered, 99) * 1000, 2),
+            }
+        return result
+
+
+class FakeService:
+    """遅延とエラー率を持つ偽サービスの共通部分"""
+
+    def __init__(self, stage, recorder, latency=0.0, jitter=0.0, error_rate=0.0, seed=0):
+        self.stage = stage
+        self.recorder = recorder
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.calls = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def _begin(self):
+        """呼び出し1回分の遅延を決め、エラーにするかどうかを返す"""
+        with self._lock:
+            self.calls += 1
+            delay = max(0.0, self.latency + self._random.uniform(-self.jitter, self.jitter))
+            fail = self._random.random() < self.error_rate
+        return delay, fail
+
+    def _wait(self, started, delay, stage=None):
+        """呼び出し開始から delay 秒経つまで待ち、所要時間を記録する"""
+        remaining = delay - (time.perf_counter() - started)
+        if remaining > 0:
+            time.sleep(remaining)
+        self.recorder.record(stage or self.stage, time.perf_counter() - started)
+
+
+class FakeRateLimitError(Exception):
+    """429相当のエラー (rate_limit.is_rate_limit_error が code で判定する)"""
+
+    code = 429
+
+
+# --- Google Sheets ---
+
+class FakeWorksheet(FakeService):
+    """get_all_values / batch_get / batch_update を持つ偽ワークシート
+
+    レスポンスは一度JSON文字列に変換してから返し、転送量を bytes_transferred に記録する。
+    """
+
+    def __init__(self, values, recorder=None, latency=0.0, jitter=0.0, error_rate=0.0, seed=0):
+        super().__init__("sheet", recorder or StageRecorder(), latency, jitter, error_rate, seed)
+        self._values = values
+        self.bytes_transferred = 0
+        self.updates = []
+
+    def _transfer(self, payload):
+        body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.bytes_transferred += len(body)
+        return json.loads(body)
+
+    def _read(self, stage, build):
+        """読み込み系APIの共通処理 (遅延を入れてペイロードを返す)"""
+        started = time.perf_counter()
+        delay, _fail = self._begin()
+        payload = self._transfer(build())
+        self._wait(started, delay, stage)
+        return payload
+
+    def get_all_values(self):
+        return self._read("sheet_read", lambda: self._values)
+
+    def batch_get(self, ranges, major_dimension=None):
+        def build():
+            results = []
+            for a1_range in ranges:
+                match = re.fullmatch(r"([A-Z]+)(\d+):([A-Z]+)", a1_range)
+                column_name, first_row = match.group(1), int(match.group(2))
+                column_index = next(i for i in range(702) if column_letter(i) == column_name)
+                if match.group(3) != column_name:
+                    # 複数列の範囲 (行ごと)。Sheets APIと同様に行末の空セルと末尾の空行を落とす
+                    last_index = next(i for i in range(702) if column_letter(i) == match.group(3))
+                    rows = [row[column_index:last_index + 1] for row in self._values[first_row - 1:]]
+                    rows = [row[:max((i + 1 for i, cell in enumerate(row) if cell != ""), default=0)] for row in rows]
+                    while rows and not rows[-1]:
+                        rows.pop()
+                    results.append(rows)
+                    continue
+                column = [
+                    row[column_index] if len(row) > column_index else ""
+                    for row in self._values[first_row - 1:]
+                ]
+                # Sheets APIと同様に末尾の空セルを落とす
+                while column and column[-1] == "":
+                    column.pop()
+                if major_dimension == "COLUMNS":
+                    results.append([column] if column else [])
+                else:
+                    results.append([[value] for value in column])
+            return results
+        return self._read("sheet_read", build)
+
+    def batch_update(self, updates):
+        started = time.perf_counter()
+        delay, fail = self._begin()
+        if fail:
+            self._wait(started, delay, "sheet_write")
+            raise FakeRateLimitError("429 Too Many Requests (fake sheets)")
+        self.updates.extend(self._transfer(updates))
+        self._wait(started, delay, "sheet_write")
+
+
+class FakeGspreadClient:
+    """open_by_key(...).sheet1 で FakeWorksheet を返すクライアント"""
+
+    def __init__(self, worksheet):
+        self.worksheet = worksheet
+
+    def open_by_key(self, key):
+        return SimpleNamespace(sheet1=self.worksheet)
+
+
+# 分析済みの行に入れておくルート (出発地点, 経由地..., 終着地点)
+ANALYZED_ROUTES = [
+    ["東京スバル三鷹店", "調布IC", "中央道", "八王子JCT", "相模原IC", "宮ヶ瀬湖", "ハンガーエイト"],
+    ["東京IC", "東名高速", "海老名SA", "秦野中井インター", "足柄SA", "御殿場IC"],
+    ["練馬IC", "三芳PA", "鶴ヶ島JCT", "圏央道", "青梅IC", "あきる野IC"],
+    ["浦和IC", "蓮田SA", "国道4号線", "佐野SA", "宇都宮IC"],
+    ["高井戸IC", "石川PA", "談合坂SA", "大月JCT", "河口湖IC"],
+]
+
+
+# 走行距離の列 (Y列・Z列) の見出し (route_analyzer.DISTANCE_COLUMN_HEADERS と同じ)
+DISTANCE_HEADERS = ["走行距離(km)", "区間距離(km)"]
+
+
+def build_sheet_values(rows, columns=26, analyzed_ratio=0.0, seed=0,
+                       url_column_index=4, start_column_index=12):
+    """テスト用のシートを作る (1行目はヘッダー、analyzed_ratio の割合はM列〜X列に記入済みで、Y列〜Z列は空)
+
+    Y列・Z列は走行距離の列として見出しを付けておく (ROUTE_DISTANCE=on の起動時の確認を通るように)。
+    """
+    rng = random.Random(seed)
+    values = [[f"col{c}" for c in range(columns)]]
+    distance_columns = range(start_column_index + 12, min(columns, start_column_index + 14))
+    for c, header in zip(distance_columns, DISTANCE_HEADERS):
+        values[0][c] = header
+    for r in range(rows):
+        row = [f"セル{r}-{c}" for c in range(columns)]
+        row[url_column_index] = f"https://www.youtube.com/watch?v={fake_video_id(r)}"
+        route = ANALYZED_ROUTES[r % len(ANALYZED_ROUTES)] if rng.random() < analyzed_ratio else None
+        for c in range(start_column_index, min(columns, start_column_index + 14)):
+            row[c] = ""
+        if route:
+            start, *waypoints, end = route
+            row[start_column_index] = start
+            row[start_column_index + 1:start_column_index + 1 + len(waypoints)] = waypoints
+            row[start_column_index + 11] = end
+        values.append(row)
+    return values
+
+
+def fake_video_id(number):
+    """連番から11文字の動画IDを作る"""
+    return f"v{number:010d}"
+
+
+# --- YouTube トランスクリプト ---
+
+FILLER_PHRASES = [
+    "今日は新型車の試乗をしていきます", "内装の質感がかなり上がっていますね", "シートの座り心地もいいです",
+    "エンジンは静かでスムーズです", "価格は400万円ちょっとからです", "燃費はリッター15キロくらいです",
+]
+ROUTE_PHRASES = [
+    "東京スバル三鷹店をスタートします", "調布インターから中央道に乗っていきます", "八王子JCTを通過します",
+    "相模原インターで降ります", "宮ヶ瀬湖の方へ向かいます", "ハンガーエイトに到着しました",
+]
+# 定型表現を使わない語り (ルールベース抽出では確定できず、Geminiへ回る動画)
+FREEFORM_ROUTE_PHRASES = [
+    "三鷹のディーラーさんをお借りして出てきました", "ここから高速で西の方へ", "ジャンクションを抜けて山の方へ",
+    "インターを降りて下道です", "湖が見えてきました", "目的地の格納庫の近くまで来ました",
+]
+
+
+class FakeTranscript:
+    def __init__(self, api, video_id):
+        self._api = api
+        self.video_id = video_id
+        self.language_code = "ja"
+
+    def fetch(self):
+        started = time.perf_counter()
+        delay, fail = self._api._begin()
+        if fail:
+            self._api._wait(started, delay)
+            raise TranscriptsDisabled(self.video_id)
+        freeform = random.Random(self.video_id).random() < self._api.freeform_rate
+        route_phrases = FREEFORM_ROUTE_PHRASES if freeform else ROUTE_PHRASES
+        segments = [
+            {
+                "text": route_phrases[(i // 5) % len(route_phrases)] if i % 5 == 0 else FILLER_PHRASES[i % len(FILLER_PHRASES)],
+                "start": i * 4.0,
+                "duration": 4.0,
+            }
+            for i in range(self._api.segments_per_video)
+        ]
+        self._api._wait(started, delay)
+        return segments
+
+
+class FakeTranscriptApi(FakeService):
+    """youtube_transcript_api v1.x の YouTubeTranscriptApi().list(video_id) 相当"""
+
+    def __init__(self, recorder, segments_per_video=200, latency=0.0, jitter=0.0, error_rate=0.0, seed=0,
+                 freeform_rate=0.0):
+        super().__init__("transcript", recorder, latency, jitter, error_rate, seed)
+        self.segments_per_video = segments_per_video
+        self.freeform_rate = freeform_rate  # 定型表現を使わない動画の割合 (動画IDで決まる)
+
+    def list(self, video_id):
+        return SimpleNamespace(find_transcript=lambda languages: FakeTranscript(self, video_id))
+
+    def as_module(self):
+        """route_analyzer.yta と差し替えられるモジュール相当のオブジェクト"""
+        return SimpleNamespace(YouTubeTranscriptApi=lambda: self, TranscriptsDisabled=TranscriptsDisabled)
+
+
+# --- Gemini ---
+
+class FakeGeminiModel(FakeService):
+    """generate_content() に固定のルートJSONを返す偽Geminiモデル
+
+    kind は route_analyzer.GEMINI_TASKS のキーで、用途ごとのスキーマに合うJSONを返す。
+    バッチ用プロンプト (video_id: ... を含む) には、動画ごとの配列を返す。
+    分割分析の 'candidate' には区間ごとの候補 (出発候補は最初の区間、終着候補は最後の区間だけ) を、
+    'reduce' にはプロンプト中の候補を統合したルートを返す。
+    system_instruction は実APIと同様に毎回の入力トークンに数える。
+    input_latency_per_1k は入力1000トークンごとの追加遅延 (最初のトークンまでの時間を模す)。
+    sparse_rate の割合で、出発地点が空で経由地が1つだけの不十分な結果を返す (安いモデルのティアを模す)。
+    """
+
+    def __init__(self, recorder, latency=0.0, jitter=0.0, error_rate=0.0, seed=0,
+                 model_name="gemini-1.5-flash", system_instruction=None,
+                 input_latency_per_1k=0.0, sparse_rate=0.0, kind="route"):
+        super().__init__("gemini", recorder, latency, jitter, error_rate, seed)
+        self.model_name = model_name
+        self.kind = kind
+        self.system_instruction = system_instruction
+        self.input_latency_per_1k = input_latency_per_1k
+        self.sparse_rate = sparse_rate
+        self.prompt_tokens = 0
+
+    def generate_content(self, prompt, generation_config=None, **kwargs):
+        started = time.perf_counter()
+        delay, fail = self._begin()
+        if fail:
+            self._wait(started, delay)
+            raise FakeRateLimitError("429 Too Many Requests (fake gemini)")
+
+        if self.kind == "candidate":
+            payload = self._candidates(prompt)
+        elif self.kind == "reduce":
+            payload = self._reduce(prompt)
+        else:
+            payload = self._routes(prompt)
+
+        text = json.dumps(payload, ensure_ascii=False)
+        prompt_tokens = estimate_tokens(prompt)
+        if self.system_instruction:
+            prompt_tokens += estimate_tokens(self.system_instruction)
+        delay += self.input_latency_per_1k * prompt_tokens / 1000
+        with self._lock:
+            self.prompt_tokens += prompt_tokens
+        self._wait(started, delay)
+        return SimpleNamespace(
+            text=text,
+            usage_metadata=SimpleNamespace(
+                prompt_token_count=prompt_tokens,
+                candidates_token_count=estimate_tokens(text),
+            ),
+        )
+
+    def _sparse(self):
+        with self._lock:
+            return self._random.random() < self.sparse_rate
+
+    def _routes(self, prompt):
+        route = {"start": "東京スバル三鷹店", "end": "ハンガーエイト", "waypoints": ["中央道", "八王子JCT", "宮ヶ瀬湖"]}
+        sparse = {"start": "", "end": "ハンガーエイト", "waypoints": ["中央道"]}
+        video_ids = re.findall(r"\(video_id: ([^)\s]+)\)", prompt)
+        routes = [sparse if self._sparse() else route for _ in video_ids or [None]]
+        return [dict(r, video_id=video_id) for r, video_id in zip(routes, video_ids)] if video_ids else routes[0]
+
+    def _candidates(self, prompt):
+        # 区間の位置は build_candidate_prompt の「全N区間中のK区間目」から読む
+        match = re.search(r"全(\d+)区間中の(\d+)区間目", prompt)
+        total, index = (int(match.group(1)), int(match.group(2))) if match else (1, 1)
+        sparse = self._sparse()
+        return {
+            "start_candidates": ["東京スバル三鷹店"] if index == 1 and not sparse else [],
+            "places": ["中央道"] if sparse else ["中央道", "八王子JCT", "宮ヶ瀬湖"],
+            "end_candidates": ["ハンガーエイト"] if index == total else [],
+        }
+
+    def _reduce(self, prompt):
+        # build_reduce_prompt が埋め込んだ区間ごとの候補 (JSON配列) を統合する
+        match = re.search(r"^\s*(\[.*\])\s*$", prompt, re.MULTILINE)
+        candidates = json.loads(match.group(1)) if match else []
+        starts = [name for window in candidates for name in window.get("start_candidates", [])]
+        ends = [name for window in candidates for name in window.get("end_candidates", [])]
+        waypoints = list(dict.fromkeys(name for window in candidates for name in window.get("places", [])))
+        return {"start": starts[0] if starts else "", "end": ends[-1] if ends else "", "waypoints": waypoints[:10]}
+
+
+# --- Prometheus Pushgateway ---
+
+class FakePushgateway:
+    """PUT/POST /metrics/job/<job> を受け付けるだけのローカルPushgateway代替
+
+    受け取った本文はグループ (job とラベル) ごとに pushes に残る (PUTは上書き、POSTは追記)。
+    GET /metrics で最後に受け取った内容をまとめて返す。
+        with FakePushgateway() as gateway:
+            os.environ["METRICS_PUSHGATEWAY_URL"] = gateway.url
+    """
+
+    def __init__(self, host="127.0.0.1", port=0):
+        gateway = self
+        self.pushes = {}
+
+        class Handler(BaseHTTPRequestHandler):
+            def _store(self, replace):
+                # グルーピングラベル付き (job/<job>/shard/0 等) はグループごとに別に保持する
+                job = self.path.split("/metrics/job/", 1)[-1]
+                body = self.rfile.read(int(self.headers.get("Content-Length", 0))).decode("utf-8")
+                if replace or job not in gateway.pushes:
+                    gateway.pushes[job] = body
+                else:
+                    gateway.pushes[job] += body
+                self.send_response(200)
+                self.end_headers()
+
+            def do_PUT(self):
+                self._store(replace=True)
+
+            def do_POST(self):
+                self._store(replace=False)
+
+            def do_GET(self):
+                body = "".join(gateway.pushes.values()).encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = ThreadingHTTPServer((host, port), Handler)
+        self.url = f"http://{host}:{self._server.server_address[1]}"
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    def samples(self, job="route_analyzer"):
+        """受け取ったメトリクスを {サンプル名{ラベル}: 値} にする"""
+        result = {}
+        for line in self.pushes.get(job, "").splitlines():
+            if line and not line.startswith("#"):
+                name, value = line.rsplit(" ", 1)
+                result[name] = float(value)
+        return result
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._server.shutdown()
+        self._server.server_close()
@@ -0,0 +1,162 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+import zlib
+from typing import Any, Dict, Optional
+
+
+class SQLiteCache:
+    """SQLiteを使った永続キャッシュ (TTL・サイズ上限付きLRU)
+
+    値はJSONをzlib圧縮して保存する。GitHub Actionsではファイルごと
+    actions/cache で次回の実行へ引き継ぐ想定。
+    """
+
+    def __init__(
+        self,
+        path: str,
+        table: str = "cache",
+        ttl_seconds: Optional[float] = None,
+        max_bytes: Optional[int] = None,
+    ):
+        self.path = path
+        self.table = table
+        self.ttl_seconds = ttl_seconds
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        # asyncモードではワーカースレッドから呼ばれるため、接続を共有してロックで保護する
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            f"""CREATE TABLE IF NOT EXISTS {table} (
+                key TEXT PRIMARY KEY,
+                value BLOB NOT NULL,
+                size INTEGER NOT NULL,
+                created_at REAL NOT NULL,
+                expires_at REAL,
+                last_access REAL NOT NULL
+            )"""
+        )
+        self._conn.execute(f"CREATE INDEX IF NOT EXISTS {table}_lru ON {table} (last_access)")
+        self._conn.execute(f"CREATE INDEX IF NOT EXISTS {table}_expiry ON {table} (expires_at)")
+        self._conn.commit()
+
+        # 合計サイズはメモリ上で追跡し、set()のたびに全件集計しないようにする
+        self._total_bytes = self._conn.execute(f"SELECT COALESCE(SUM(size), 0) FROM {table}").fetchone()[0]
+
+    def get(self, key: str) -> Optional[Any]:
+        """キーに対応する値を返す。期限切れ・未登録の場合はNone"""
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                f"SELECT value, expires_at FROM {self.table} WHERE key = ?", (key,)
+            ).fetchone()
+
+            if row is None:
+                self.misses += 1
+                return None
+
+            value, expires_at = row
+            if expires_at is not None and expires_at <= now:
+                self._delete_locked(key)
+                self._conn.commit()
+                self.misses += 1
+                return None
+
+            self._conn.execute(
+                f"UPDATE {self.table} SET last_access = ? WHERE key = ?", (now, key)
+            )
+            self._conn.commit()
+            self.hits += 1
+
+        return json.loads(zlib.decompress(value).decode("utf-8"))
+
+    def set(self, key: str, value: Any, ttl_seconds: Optional[float] = None) -> None:
+        """値を保存する。ttl_secondsを省略した場合はキャッシュ既定のTTLを使う"""
+        now = time.time()
+        ttl = self.ttl_seconds if ttl_seconds is None else ttl_seconds
+        expires_at = now + ttl if ttl is not None else None
+        blob = zlib.compress(json.dumps(value, ensure_ascii=False).encode("utf-8"))
+
+        with self._lock:
+            self._delete_locked(key)
+            self._conn.execute(
+                f"""INSERT OR REPLACE INTO {self.table}
+                    (key, value, size, created_at, expires_at, last_access)
+                    VALUES (?, ?, ?, ?, ?, ?)""",
+                (key, blob, len(blob), now, expires_at, now),
+            )
+            self._total_bytes += len(blob)
+            self._evict_locked(now)
+            self._conn.commit()
+
+    def delete(self, key: str) -> None:
+        """指定したキーを削除する (未登録なら何もしない)"""
+        with self._lock:
+            if self._delete_locked(key):
+                self._conn.commit()
+
+    def _delete_locked(self, key: str) -> bool:
+        row = self._conn.execute(f"SELECT size FROM {self.table} WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return False
+        self._conn.execute(f"DELETE FROM {self.table} WHERE key = ?", (key,))
+        self._total_bytes -= row[0]
+        return True
+
+    def clear(self) -> None:
+        """全エントリを削除する"""
+        with self._lock:
+            self._conn.execute(f"DELETE FROM {self.table}")
+            self._conn.commit()
+            self._total_bytes = 0
+
+    def _evict_locked(self, now: float) -> None:
+        """期限切れを削除し、サイズ上限を超えた分を古い順(LRU)に削除する"""
+        expired = self._conn.execute(
+            f"SELECT COALESCE(SUM(size), 0), COUNT(*) FROM {self.table} WHERE expires_at IS NOT NULL AND expires_at <= ?",
+            (now,),
+        ).fetchone()
+        if expired[1]:
+            self._conn.execute(
+                f"DELETE FROM {self.table} WHERE expires_at IS NOT NULL AND expires_at <= ?", (now,)
+            )
+            self._total_bytes -= expired[0]
+
+        if self.max_bytes is None or self._total_bytes <= self.max_bytes:
+            return
+
+        # 古いものから少しずつ取り出して削除する (読み出し中のカーソルでは削除しない)
+        while self._total_bytes > self.max_bytes:
+            oldest = self._conn.execute(
+                f"SELECT key, size FROM {self.table} ORDER BY last_access ASC LIMIT 64"
+            ).fetchall()
+            if not oldest:
+                break
+            for key, size in oldest:
+                self._conn.execute(f"DELETE FROM {self.table} WHERE key = ?", (key,))
+                self._total_bytes -= size
+                if self._total_bytes <= self.max_bytes:
+                    break
+
+    def stats(self) -> Dict[str, int]:
+        """ヒット数・ミス数・件数・合計サイズを返す"""
+        with self._lock:
+            entries, total = self._conn.execute(
+                f"SELECT COUNT(*), COALESCE(SUM(size), 0) FROM {self.table}"
+            ).fetchone()
+        return {"hits": self.hits, "misses": self.misses, "entries": entries, "bytes": total}
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
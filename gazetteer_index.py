@@ -0,0 +1,166 @@
+import os
+import re
+from bisect import bisect_left
+from functools import lru_cache
+from typing import Dict, Iterator, List, NamedTuple, Optional, Tuple
+
+from route_prefilter import AhoCorasick
+from route_rules import normalize_place
+
+# 表記ゆれの置き換え (長いものを先に適用する)
+_SPELLING_VARIANTS = (
+    ("インターチェンジ", "IC"), ("スマートインター", "スマートIC"), ("インター", "IC"),
+    ("ジャンクション", "JCT"), ("サービスエリア", "SA"), ("パーキングエリア", "PA"),
+    ("JTC", "JCT"), ("ケ", "ヶ"), ("ヵ", "ヶ"),
+)
+# 先頭部分の補完とあいまい一致は、施設の接尾辞で終わる文字列にだけ使う
+# (「東京」「厚木」「富士川」のような地名・川の名前を東京IC・厚木IC・富士川SAにしない)
+FACILITY_SUFFIXES = ("IC", "JCT", "SA", "PA")
+_ABBREVIATION_DOTS = re.compile(r"(?<=[A-Z])\.(?=[A-Z]|$)")
+_NATIONAL_ROUTE = re.compile(r"国道(\d{1,3})号")
+
+
+class Place(NamedTuple):
+    id: str
+    name: str
+    kind: str
+    lat: Optional[float]
+    lon: Optional[float]
+
+
+class PlaceMatch(NamedTuple):
+    place: Place
+    score: float   # 0〜1 (完全一致は1)
+    method: str    # "exact" / "national_route" / "contains" / "prefix" / "fuzzy"
+
+
+def canonical_key(name: str) -> str:
+    """照合用のキー (全角/空白・動作の表現・「インター」等の表記ゆれ・英字の大小を揃える)"""
+    key = normalize_place(name)
+    for variant, canonical in _SPELLING_VARIANTS:
+        key = key.replace(variant, canonical)
+    # 「I.C」「J.C.T」のような略記の点を除く
+    return _ABBREVIATION_DOTS.sub("", key.upper())
+
+
+def _bigrams(key: str) -> List[str]:
+    return [key[i:i + 2] for i in range(len(key) - 1)] or [key]
+
+
+def read_places(path: str) -> Iterator[Tuple[Place, List[str]]]:
+    """地名辞書 (ID, 名前, 種別, 緯度, 経度, 別名) を (Place, 別名の一覧) で返す (# で始まる行は無視)"""
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            line = line.rstrip("\n")
+            if not line.strip() or line.startswith("#"):
+                continue
+            fields = line.split("\t")
+            place_id, name, kind = fields[0], fields[1], fields[2] if len(fields) > 2 else "place"
+            lat = float(fields[3]) if len(fields) > 3 and fields[3] else None
+            lon = float(fields[4]) if len(fields) > 4 and fields[4] else None
+            aliases = [alias.strip() for alias in fields[5].split(",") if alias.strip()] if len(fields) > 5 else []
+            yield Place(place_id, name, kind, lat, lon), aliases
+
+
+class GazetteerIndex:
+    """経由地の文字列を地名辞書のID・座標に対応付ける索引 (ネットワーク呼び出しなし)
+
+    照合の順序:
+      1. 完全一致 (名前・別名の照合キー)
+      2. 国道 (国道N号) は辞書になくても national_route:N とする
+      3. 辞書の地名を含む (「東名海老名SA」→ 海老名SA)。トライ (Aho-Corasick) で最長のものを選び、
+         文字列に占める割合が min_contains_score 以上の場合だけ対応付ける (長い文の一部に地名があるだけなら使わない)
+      4. 辞書の地名の先頭部分 (「秦野IC」→ 秦野中井IC)。ソート済みキーの二分探索で、1か所に絞れる場合のみ
+         (複数の地点に当てはまる場合は対応付けない)
+      5. 文字bigramのDice係数が min_fuzzy_score 以上で最も近いもの
+    4と5は施設の接尾辞 (FACILITY_SUFFIXES) で終わる文字列にだけ使う。地名だけの「東京」「沼津」等は対応付けない。
+    結果は文字列ごとにキャッシュする (同じ経由地は多くの動画で繰り返し現れる)。
+    """
+
+    def __init__(
+        self,
+        places: List[Tuple[Place, List[str]]],
+        min_fuzzy_score: float = 0.6,
+        min_contains_score: float = 0.5,
+        cache_size: int = 65536,
+    ):
+        self.min_fuzzy_score = min_fuzzy_score
+        self.min_contains_score = min_contains_score
+        self.places: Dict[str, Place] = {}
+        self._keys: Dict[str, str] = {}  # 照合キー → ID
+        for place, aliases in places:
+            self.places[place.id] = place
+            for name in [place.name, *aliases]:
+                self._keys.setdefault(canonical_key(name), place.id)
+
+        self._sorted_keys = sorted(self._keys)
+        self._trie = AhoCorasick(self._sorted_keys) if self._sorted_keys else None
+        self._grams: Dict[str, List[str]] = {}  # bigram → そのbigramを含む照合キー
+        for key in self._sorted_keys:
+            for gram in set(_bigrams(key)):
+                self._grams.setdefault(gram, []).append(key)
+
+        self.resolve = lru_cache(maxsize=cache_size)(self._resolve)
+
+    @classmethod
+    def load(cls, path: str, **kwargs) -> "GazetteerIndex":
+        """地名辞書ファイルから索引を作る (ファイルがなければ空の索引)"""
+        return cls(list(read_places(path)) if os.path.exists(path) else [], **kwargs)
+
+    def names(self) -> Iterator[Tuple[str, str]]:
+        """辞書の全ての名前と別名を (名前, 種別) で返す"""
+        for key, place_id in self._keys.items():
+            yield key, self.places[place_id].kind
+
+    def _resolve(self, text: str) -> Optional[PlaceMatch]:
+        key = canonical_key(text)
+        if not key:
+            return None
+
+        place_id = self._keys.get(key)
+        if place_id is not None:
+            return PlaceMatch(self.places[place_id], 1.0, "exact")
+
+        route = _NATIONAL_ROUTE.search(key)
+        if route:
+            number = int(route[1])
+            return PlaceMatch(Place(f"national_route:{number}", f"国道{number}号", "national_route", None, None), 1.0, "national_route")
+
+        if self._trie is not None:
+            contained = max((name for _end, name in self._trie.iter_matches(key)), key=len, default=None)
+            if contained is not None and len(contained) >= 3 and len(contained) / len(key) >= self.min_contains_score:
+                return PlaceMatch(self.places[self._keys[contained]], round(len(contained) / len(key), 3), "contains")
+
+        if not key.endswith(FACILITY_SUFFIXES):
+            return None
+
+        # key の接尾辞を除いた部分で始まり、同じ接尾辞で終わる照合キーが1か所だけなら補完する
+        suffix = next(suffix for suffix in FACILITY_SUFFIXES if key.endswith(suffix))
+        stem = key[:-len(suffix)]
+        completions = set()
+        if len(stem) >= 2:
+            index = bisect_left(self._sorted_keys, stem)
+            while index < len(self._sorted_keys) and self._sorted_keys[index].startswith(stem) and len(completions) < 2:
+                if self._sorted_keys[index].endswith(suffix):
+                    completions.add(self._keys[self._sorted_keys[index]])
+                index += 1
+        if len(completions) == 1:
+            place_id = completions.pop()
+            return PlaceMatch(self.places[place_id], round(len(key) / len(self.places[place_id].name), 3), "prefix")
+        if completions:
+            # 複数の地点に当てはまる場合 (「横浜IC」→ 横浜青葉IC / 横浜町田IC) は、どれとも決めない
+            return None
+
+        query = _bigrams(key)
+        shared: Dict[str, int] = {}
+        for gram in set(query):
+            for candidate in self._grams.get(gram, ()):
+                shared[candidate] = shared.get(candidate, 0) + 1
+        best_score, best_key = 0.0, None
+        for candidate, count in shared.items():
+            score = 2 * count / (len(set(query)) + len(set(_bigrams(candidate))))
+            if score > best_score:
+                best_score, best_key = score, candidate
+        if best_key is not None and best_score >= self.min_fuzzy_score:
+            return PlaceMatch(self.places[self._keys[best_key]], round(best_score, 3), "fuzzy")
+        return None
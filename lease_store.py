@@ -0,0 +1,129 @@
+import os
+import sqlite3
+import threading
+import time
+from typing import List, Optional
+
+
+class SQLiteLeaseStore:
+    """SQLiteを使ったリース (期限付きの作業権) の管理
+
+    同じファイルを共有するプロセス間で、同じキーを同時に1人だけが持てるようにする。
+    期限切れのリースは次の claim() で他の所有者が取り直せる (再キュー)。
+    """
+
+    def __init__(self, path: str, table: str = "leases"):
+        self.path = path
+        self.table = table
+        self._lock = threading.Lock()
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        # 別プロセスが書き込み中なら待つ (timeout)。ワーカースレッドからも呼ばれるため接続を共有する
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            f"""CREATE TABLE IF NOT EXISTS {table} (
+                key TEXT PRIMARY KEY,
+                owner TEXT NOT NULL,
+                expires_at REAL NOT NULL
+            )"""
+        )
+        self._conn.commit()
+
+    def claim(self, keys: List[str], owner: str, ttl_seconds: float) -> List[str]:
+        """keys のうち、空いているか期限切れか自分が持っているものを取得して返す (期限は延長される)"""
+        if not keys:
+            return []
+        now = time.time()
+        with self._lock:
+            # BEGIN IMMEDIATE で書き込みロックを取り、確認と取得の間に他プロセスが割り込まないようにする
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._conn.execute(f"DELETE FROM {self.table} WHERE expires_at <= ?", (now,))
+                claimed = []
+                for key in keys:
+                    cursor = self._conn.execute(
+                        f"""INSERT INTO {self.table} (key, owner, expires_at) VALUES (?, ?, ?)
+                            ON CONFLICT(key) DO UPDATE SET expires_at = excluded.expires_at
+                            WHERE {self.table}.owner = excluded.owner""",
+                        (key, owner, now + ttl_seconds),
+                    )
+                    if cursor.rowcount:
+                        claimed.append(key)
+                self._conn.commit()
+            except BaseException:
+                self._conn.rollback()
+                raise
+        return claimed
+
+    def release(self, keys: List[str], owner: str) -> None:
+        """自分が持っているリースを手放す"""
+        with self._lock:
+            self._conn.executemany(
+                f"DELETE FROM {self.table} WHERE key = ? AND owner = ?", [(key, owner) for key in keys]
+            )
+            self._conn.commit()
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+# 自分が持っている場合だけ削除する (GET と DEL の間に他の所有者へ移っていても消さない)
+_REDIS_RELEASE_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+
+class RedisLeaseStore:
+    """Redisを使ったリース管理 (別々のマシンで動く実行どうしで共有する場合)
+
+    SET NX PX で取得し、期限切れはRedisが自動で消す。redis パッケージが必要。
+    """
+
+    def __init__(self, url: str, prefix: str = "route_analyzer:lease:"):
+        import redis
+
+        self.prefix = prefix
+        self._client = redis.Redis.from_url(url, decode_responses=True)
+        self._release = self._client.register_script(_REDIS_RELEASE_SCRIPT)
+
+    def claim(self, keys: List[str], owner: str, ttl_seconds: float) -> List[str]:
+        """keys のうち、空いているか自分が持っているものを取得して返す"""
+        ttl_ms = int(ttl_seconds * 1000)
+        claimed = []
+        for key in keys:
+            name = self.prefix + key
+            if self._client.set(name, owner, nx=True, px=ttl_ms):
+                claimed.append(key)
+            elif self._client.get(name) == owner:
+                # 自分のリースなら期限を延長する
+                self._client.pexpire(name, ttl_ms)
+                claimed.append(key)
+        return claimed
+
+    def release(self, keys: List[str], owner: str) -> None:
+        for key in keys:
+            self._release(keys=[self.prefix + key], args=[owner])
+
+    def close(self) -> None:
+        self._client.close()
+
+
+def open_lease_store(backend: str, path: str, redis_url: Optional[str] = None):
+    """LEASE_BACKEND に応じたリースストアを返す ("off" ならNone)"""
+    if backend == "off":
+        return None
+    if backend == "sqlite":
+        return SQLiteLeaseStore(path)
+    if backend == "redis":
+        if not redis_url:
+            raise ValueError("LEASE_REDIS_URL is required when LEASE_BACKEND=redis.")
+        return RedisLeaseStore(redis_url)
+    raise ValueError(f"Unknown LEASE_BACKEND: {backend}")
@@ -0,0 +1,164 @@
+import os
+import urllib.parse
+import urllib.request
+from bisect import bisect_right
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from run_report import RunReport
+
+METRIC_PREFIX = "route_analyzer"
+
+# ステージ所要時間ヒストグラムのバケット境界 (秒)
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+Labels = Dict[str, str]
+
+
+def _escape_label_value(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(labels: Labels) -> str:
+    if not labels:
+        return ""
+    body = ",".join(f'{name}="{_escape_label_value(str(value))}"' for name, value in labels.items())
+    return "{" + body + "}"
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class MetricFamily:
+    """1つのメトリクス (HELP/TYPE と複数のサンプル行)"""
+
+    def __init__(self, name: str, metric_type: str, help_text: str):
+        self.name = name
+        self.metric_type = metric_type
+        self.help_text = help_text
+        self.samples: List[Tuple[str, Labels, float]] = []
+
+    def add(self, value: float, labels: Optional[Labels] = None, suffix: str = "") -> None:
+        self.samples.append((self.name + suffix, labels or {}, value))
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} {self.metric_type}"]
+        for sample_name, labels, value in self.samples:
+            lines.append(f"{sample_name}{_format_labels(labels)} {_format_value(value)}")
+        return "\n".join(lines)
+
+
+def add_histogram(family: MetricFamily, values: Sequence[float], labels: Labels,
+                  buckets: Sequence[float] = DURATION_BUCKETS) -> None:
+    """観測値の一覧を累積バケット (_bucket / _sum / _count) としてfamilyに追加する"""
+    ordered = sorted(values)
+    for bound in buckets:
+        # le は「以下」なので bisect_right で数える
+        family.add(bisect_right(ordered, bound), dict(labels, le=_format_value(bound)), "_bucket")
+    family.add(len(ordered), dict(labels, le="+Inf"), "_bucket")
+    family.add(sum(ordered), labels, "_sum")
+    family.add(len(ordered), labels, "_count")
+
+
+def build_metric_families(report: RunReport, rows: Dict[str, int]) -> List[MetricFamily]:
+    """実行レポートから、実行1回分のメトリクスを組み立てる
+
+    件数は実行1回分の値で、Pushgateway / textfile では実行ごとに上書きされるため gauge として出す。
+    """
+    rows_scanned = MetricFamily(f"{METRIC_PREFIX}_rows_scanned", "gauge", "Data rows read from the sheet in the last run.")
+    rows_scanned.add(rows.get('rows_read', 0))
+
+    rows_analyzed = MetricFamily(f"{METRIC_PREFIX}_rows_analyzed", "gauge", "Rows analyzed and queued for writing in the last run.")
+    rows_analyzed.add(rows.get('rows_analyzed', 0))
+
+    duplicate_rows = MetricFamily(
+        f"{METRIC_PREFIX}_duplicate_rows", "gauge", "Rows that shared a video ID with an earlier row (fetch/analysis calls saved)."
+    )
+    duplicate_rows.add(rows.get('duplicate_rows', 0))
+
+    rows_rules = MetricFamily(
+        f"{METRIC_PREFIX}_rows_resolved_by_rules", "gauge", "Rows whose route came from the local rules-based extractor (no Gemini call)."
+    )
+    rows_rules.add(rows.get('rows_rules', 0))
+
+    rows_skipped = MetricFamily(f"{METRIC_PREFIX}_rows_skipped", "gauge", "Rows skipped in the last run, by reason.")
+    for reason, count in sorted(report.skip_counts().items()):
+        rows_skipped.add(count, {'reason': reason})
+
+    durations = MetricFamily(f"{METRIC_PREFIX}_stage_duration_seconds", "histogram", "Latency of each pipeline stage call.")
+    errors = MetricFamily(f"{METRIC_PREFIX}_stage_errors", "gauge", "Stage calls that raised an error in the last run.")
+    tokens = MetricFamily(f"{METRIC_PREFIX}_gemini_tokens", "gauge", "Gemini tokens used in the last run.")
+    summary = report.stage_summary()
+    for stage, values in sorted(report.stage_durations().items()):
+        add_histogram(durations, values, {'stage': stage})
+        errors.add(summary[stage]['errors'], {'stage': stage})
+    gemini = summary.get('gemini', {})
+    tokens.add(gemini.get('prompt_tokens', 0), {'direction': 'prompt'})
+    tokens.add(gemini.get('output_tokens', 0), {'direction': 'output'})
+    tokens.add(gemini.get('cached_tokens', 0), {'direction': 'cached'})
+
+    tier_videos = MetricFamily(
+        f"{METRIC_PREFIX}_tier_videos", "gauge", "Videos analyzed by each model tier in the last run, by outcome."
+    )
+    for tier, stats in sorted(report.tier_summary().items()):
+        tier_videos.add(stats['accepted'], {'tier': tier, 'outcome': 'accepted'})
+        tier_videos.add(sum(stats['escalated'].values()), {'tier': tier, 'outcome': 'escalated'})
+        tier_videos.add(stats['final'], {'tier': tier, 'outcome': 'final'})
+
+    agreement = MetricFamily(
+        f"{METRIC_PREFIX}_agreement_ratio", "gauge", "Mean agreement between two analysis methods in the last run (0-1)."
+    )
+    for name, fields in sorted(report.agreement_summary().items()):
+        for field, stats in sorted(fields.items()):
+            agreement.add(stats['mean'], {'name': name, 'field': field})
+
+    route_legs = MetricFamily(
+        f"{METRIC_PREFIX}_route_legs", "gauge", "Route legs whose distance was estimated in the last run, by method (graph / haversine)."
+    )
+    for method, count in sorted(report.distance_summary().get('legs', {}).items()):
+        route_legs.add(count, {'method': method})
+
+    run_duration = MetricFamily(f"{METRIC_PREFIX}_run_duration_seconds", "gauge", "Wall-clock duration of the last run.")
+    run_duration.add(round(report.elapsed_seconds(), 3))
+
+    last_run = MetricFamily(f"{METRIC_PREFIX}_last_run_timestamp_seconds", "gauge", "Unix time the last run started.")
+    last_run.add(round(report.started_at, 3))
+
+    return [rows_scanned, rows_analyzed, duplicate_rows, rows_rules, rows_skipped, durations, errors, tokens, tier_videos,
+            agreement, route_legs, run_duration, last_run]
+
+
+def render_metrics(families: Sequence[MetricFamily]) -> str:
+    """Prometheusテキスト形式 (0.0.4) の文字列にする"""
+    return "\n".join(family.render() for family in families) + "\n"
+
+
+def write_textfile(path: str, body: str) -> None:
+    """node-exporter の textfile collector 用に書き出す (読みかけを拾われないよう一時ファイル経由で置き換える)"""
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(body)
+    os.replace(tmp_path, path)
+
+
+def push_to_gateway(url: str, body: str, job: str = METRIC_PREFIX, grouping: Optional[Labels] = None,
+                    timeout: float = 10.0) -> int:
+    """Pushgateway の /metrics/job/<job>[/<label>/<value>...] へ PUT する (同じグループの前回分を置き換える)
+
+    HTTPステータスを返す。
+    """
+    path = f"/metrics/job/{urllib.parse.quote(job, safe='')}"
+    for name, value in (grouping or {}).items():
+        path += f"/{name}/{urllib.parse.quote(value, safe='')}"
+    request = urllib.request.Request(
+        f"{url.rstrip('/')}{path}",
+        data=body.encode("utf-8"),
+        method="PUT",
+        headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"},
+    )
+    with urllib.request.urlopen(request, timeout=timeout) as response:
+        return response.status
@@ -0,0 +1,208 @@
+import random
+import re
+import threading
+import time
+from typing import Callable, Optional, TypeVar
+
+T = TypeVar("T")
+
+
+class TokenBucket:
+    """トークンバケット方式のレート制限 (スレッドセーフ)
+
+    rate_per_second の速度でトークンが補充され、capacity まで貯められる。
+    acquire() はトークンが足りるまでブロックする。
+    """
+
+    def __init__(self, rate_per_second: float, capacity: float):
+        self.rate_per_second = rate_per_second
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def set_rate(self, rate_per_second: float) -> None:
+        """補充速度を変更する (それまでに貯まった分は維持)"""
+        with self._lock:
+            self._refill_locked()
+            self.rate_per_second = rate_per_second
+
+    def _refill_locked(self) -> None:
+        now = time.monotonic()
+        elapsed = now - self._updated_at
+        self._updated_at = now
+        self._tokens = min(self.capacity, self._tokens + elapsed * self.rate_per_second)
+
+    def acquire(self, tokens: float = 1.0) -> float:
+        """トークンを消費する。待機した秒数を返す"""
+        waited = 0.0
+        while True:
+            with self._lock:
+                self._refill_locked()
+                # バケット容量を超える要求は、容量いっぱいまで貯まった時点で通す
+                needed = min(tokens, self.capacity)
+                if self._tokens >= needed:
+                    self._tokens -= tokens
+                    return waited
+                wait = (needed - self._tokens) / self.rate_per_second
+            time.sleep(wait)
+            waited += wait
+
+
+class AdaptiveRateLimiter:
+    """サービスごとのレート制限 (RPM/TPM) と 429 に応じた速度調整
+
+    429 を受けるたびに速度を半分に落とし (下限 min_fraction)、成功が続くと
+    設定値まで少しずつ戻す (AIMD)。スレッド間で共有して使う。
+    """
+
+    def __init__(
+        self,
+        name: str,
+        requests_per_minute: float,
+        tokens_per_minute: Optional[float] = None,
+        min_fraction: float = 0.1,
+        recovery_step: float = 0.05,
+    ):
+        self.name = name
+        self.max_rpm = requests_per_minute
+        self.current_rpm = requests_per_minute
+        self.min_rpm = requests_per_minute * min_fraction
+        self.recovery_step = recovery_step
+        self.throttled = 0
+        self.retries = 0
+        self._lock = threading.Lock()
+        # バーストは1秒分程度に抑え、並列ワーカーが一斉に叩かないようにする
+        self._requests = TokenBucket(requests_per_minute / 60.0, max(1.0, requests_per_minute / 60.0))
+        self._tokens = (
+            TokenBucket(tokens_per_minute / 60.0, tokens_per_minute)
+            if tokens_per_minute else None
+        )
+
+    def acquire(self, tokens: float = 0) -> float:
+        """リクエスト1回分(とトークン数分)の枠を確保する。待機した秒数を返す"""
+        waited = self._requests.acquire()
+        if self._tokens is not None and tokens:
+            waited += self._tokens.acquire(tokens)
+        return waited
+
+    def on_success(self) -> None:
+        """成功時: 速度を設定値に向けて少し戻す"""
+        with self._lock:
+            if self.current_rpm >= self.max_rpm:
+                return
+            self.current_rpm = min(self.max_rpm, self.current_rpm + self.max_rpm * self.recovery_step)
+            self._requests.set_rate(self.current_rpm / 60.0)
+
+    def on_retry(self) -> None:
+        """再試行時: 再試行回数を数える (ワーカースレッド間で取りこぼさないようロック内で更新する)"""
+        with self._lock:
+            self.retries += 1
+
+    def on_throttle(self) -> None:
+        """429受信時: 速度を半分に落とす"""
+        with self._lock:
+            self.throttled += 1
+            self.current_rpm = max(self.min_rpm, self.current_rpm / 2)
+            self._requests.set_rate(self.current_rpm / 60.0)
+
+    def stats(self) -> dict:
+        return {
+            "current_rpm": round(self.current_rpm, 1),
+            "throttled": self.throttled,
+            "retries": self.retries,
+        }
+
+
+# 例外クラス名から判定するもの (ライブラリを直接importせずに済むようにする)
+_RATE_LIMIT_ERROR_NAMES = {"ResourceExhausted", "TooManyRequests", "RequestBlocked", "IpBlocked"}
+_TRANSIENT_ERROR_NAMES = {"ServiceUnavailable", "InternalServerError", "DeadlineExceeded", "ConnectionError", "Timeout"}
+_TRANSIENT_STATUS_CODES = {500, 502, 503, 504}
+
+
+def _status_code(exc: Exception) -> Optional[int]:
+    """例外からHTTPステータスコードを取り出す (google.api_core / requests / gspread)"""
+    code = getattr(exc, "code", None)
+    if isinstance(code, int):
+        return code
+    response = getattr(exc, "response", None)
+    status = getattr(response, "status_code", None)
+    return status if isinstance(status, int) else None
+
+
+def is_rate_limit_error(exc: Exception) -> bool:
+    """429 (レート制限) を示す例外かどうか"""
+    if _status_code(exc) == 429 or type(exc).__name__ in _RATE_LIMIT_ERROR_NAMES:
+        return True
+    # メッセージ中の動画ID等に"429"が含まれても誤判定しないよう、定型文言で判定する
+    message = str(exc)
+    return "Too Many Requests" in message or "RESOURCE_EXHAUSTED" in message
+
+
+def is_transient_error(exc: Exception) -> bool:
+    """再試行で回復し得る一時的なエラーかどうか"""
+    if is_rate_limit_error(exc):
+        return True
+    return _status_code(exc) in _TRANSIENT_STATUS_CODES or type(exc).__name__ in _TRANSIENT_ERROR_NAMES
+
+
+def retry_after_seconds(exc: Exception) -> Optional[float]:
+    """Retry-After ヘッダーまたは RetryInfo の retry_delay から待機秒数を取り出す"""
+    response = getattr(exc, "response", None)
+    headers = getattr(response, "headers", None)
+    if headers:
+        value = headers.get("Retry-After")
+        if value:
+            try:
+                return float(value)
+            except ValueError:
+                pass
+
+    match = re.search(r"retry_delay\s*\{\s*seconds:\s*(\d+)", str(exc))
+    if match:
+        return float(match.group(1))
+    return None
+
+
+def call_with_backoff(
+    func: Callable[[], T],
+    limiter: Optional[AdaptiveRateLimiter] = None,
+    tokens: float = 0,
+    max_retries: int = 5,
+    base_delay: float = 1.0,
+    max_delay: float = 60.0,
+) -> T:
+    """レート制限をかけて func を呼び、一時的なエラーはジッター付き指数バックオフで再試行する
+
+    Retry-After が返された場合はその秒数以上待つ。再試行しても失敗した場合や、
+    一時的でないエラーはそのまま送出する。
+    """
+    attempt = 0
+    while True:
+        if limiter is not None:
+            limiter.acquire(tokens)
+        try:
+            result = func()
+        except Exception as e:
+            if not is_transient_error(e) or attempt >= max_retries:
+                raise
+            if limiter is not None:
+                limiter.on_retry()
+                if is_rate_limit_error(e):
+                    limiter.on_throttle()
+
+            # Full Jitter: 0〜上限の一様乱数で待つ (Retry-Afterがあればそれ以上)
+            delay = random.uniform(0, min(max_delay, base_delay * (2 ** attempt)))
+            retry_after = retry_after_seconds(e)
+            if retry_after is not None:
+                delay = max(delay, retry_after)
+
+            name = limiter.name if limiter is not None else "call"
+            print(f"  > Retry: {name} failed ({type(e).__name__}), retrying in {delay:.1f}s ({attempt + 1}/{max_retries})")
+            time.sleep(delay)
+            attempt += 1
+            continue
+
+        if limiter is not None:
+            limiter.on_success()
+        return result
@@ -1,11 +1,31 @@
+import time
+_IMPORT_STARTED = time.perf_counter()
+
 import os
 import json
-import gspread
-from google.oauth2.service_account import Credentials
-import google.generativeai as genai
+import asyncio
+import glob
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+# gspread / google.generativeai は重いため、実際に使うときに読み込む (get_gspread_client / get_gemini_model)
 # 修正: YouTubeTranscriptApiのインポート方法を変更し、モジュール全体をロード
 import youtube_transcript_api as yta 
-from typing import List, Dict, Optional
+from typing import Any, List, Dict, Optional, Tuple, Union
+from analysis_journal import AnalysisJournal
+from cache_store import SQLiteCache
+from lease_store import open_lease_store
+from rate_limit import AdaptiveRateLimiter, call_with_backoff
+from transcript_chunker import CompactTranscript, chunk_transcript, estimate_tokens
+from route_prefilter import filter_transcript
+from route_rules import PLACE_ACTION_SUFFIX, Gazetteer, endpoints_verified, extract_route, route_agreement
+from gazetteer_index import GazetteerIndex
+from run_report import RunReport
+from metrics_export import build_metric_families, push_to_gateway, render_metrics, write_textfile
+from youtube_url import parse_video_ids
+from sheet_io import (
+    SheetWriter, column_index, column_letter, read_row_block, read_url_and_start_columns, rows_from_all_values,
+)
 
 # --- 設定値 ---
 SPREADSHEET_ID = "1tCXNUuwiIPFLWi1H3Pz4FI81oz4DCvHn5EDlkCTQ3Uk"
@@ -14,106 +34,519 @@ START_COLUMN_INDEX = 12 # M列
 END_COLUMN_INDEX = 23   # X列
 WAYPOINT_COLUMNS_INDICES = list(range(13, 23)) # N列(13)からW列(22)まで
 
+# パイプライン設定 ("sequential": 1行ずつ / "async": ステージ並行実行 /
+#   "distance_backfill": 分析済みの行の走行距離 (ROUTE_DISTANCE_COLUMNS) だけを経由地から埋める)
+PIPELINE_MODE = os.environ.get('PIPELINE_MODE', 'sequential')
+TRANSCRIPT_CONCURRENCY = int(os.environ.get('TRANSCRIPT_CONCURRENCY', '8'))  # トランスクリプト取得の同時実行数
+GEMINI_CONCURRENCY = int(os.environ.get('GEMINI_CONCURRENCY', '4'))          # Gemini分析の同時実行数
+
+# シャード設定 (GitHub Actionsのmatrixで複数ジョブに分けて実行する場合)。動画IDのハッシュで振り分ける
+SHARD_COUNT = int(os.environ.get('SHARD_COUNT', '1'))
+SHARD_INDEX = int(os.environ.get('SHARD_INDEX', '0'))  # 0 から SHARD_COUNT-1
+if not 0 <= SHARD_INDEX < SHARD_COUNT:
+    raise ValueError(f"SHARD_INDEX must be in [0, {SHARD_COUNT}), got {SHARD_INDEX}")
+
+# 分析結果のジャーナル (書き込み前に落ちても、次回は分析し直さずに書き込む)
+ANALYSIS_JOURNAL = os.environ.get('ANALYSIS_JOURNAL', 'on')  # "on" / "off"
+
+# 作業リース (重なって動いた実行どうしが同じ動画を二重に分析しないようにする)
+LEASE_BACKEND = os.environ.get('LEASE_BACKEND', 'off')  # "off" / "sqlite" (同じディスクを共有する場合) / "redis"
+LEASE_REDIS_URL = os.environ.get('LEASE_REDIS_URL', '')
+LEASE_TTL_SECONDS = float(os.environ.get('LEASE_TTL_SECONDS', '1800'))  # 分析と書き込みが終わるまで十分な長さ
+LEASE_OWNER = os.environ.get(
+    'LEASE_OWNER',
+    f"{os.environ.get('GITHUB_RUN_ID') or os.uname().nodename}-{os.getpid()}-shard{SHARD_INDEX}",
+)
+
+# キャッシュ設定 (CACHE_DIRはGitHub Actionsのactions/cacheで次回実行へ引き継ぐ)
+CACHE_DIR = os.environ.get('CACHE_DIR', '.cache')
+TRANSCRIPT_LANGUAGES = ['ja', 'en']
+TRANSCRIPT_CACHE_TTL_DAYS = float(os.environ.get('TRANSCRIPT_CACHE_TTL_DAYS', '30'))
+TRANSCRIPT_CACHE_MAX_MB = float(os.environ.get('TRANSCRIPT_CACHE_MAX_MB', '200'))
+
+# トランスクリプト取得に失敗した動画の記録 (ネガティブキャッシュ)。再確認までの間隔は失敗のたびに倍になる
+TRANSCRIPT_NEGATIVE_CACHE = os.environ.get('TRANSCRIPT_NEGATIVE_CACHE', 'on')  # "on" / "off" / "clear"
+NEGATIVE_PERMANENT_BASE_HOURS = float(os.environ.get('NEGATIVE_PERMANENT_BASE_HOURS', '168'))  # 字幕無効など: 7日から
+NEGATIVE_PERMANENT_MAX_HOURS = float(os.environ.get('NEGATIVE_PERMANENT_MAX_HOURS', '4320'))   # 最長180日
+NEGATIVE_TRANSIENT_BASE_HOURS = float(os.environ.get('NEGATIVE_TRANSIENT_BASE_HOURS', '1'))    # 通信エラーなど: 1時間から
+NEGATIVE_TRANSIENT_MAX_HOURS = float(os.environ.get('NEGATIVE_TRANSIENT_MAX_HOURS', '48'))     # 最長2日
+
+# Geminiレスポンスキャッシュ ("on": 利用 / "off": 無効 / "refresh": 読まずに上書き / "clear": 全削除してから利用)
+GEMINI_CACHE_MODE = os.environ.get('GEMINI_CACHE', 'on')
+GEMINI_CACHE_TTL_DAYS = float(os.environ.get('GEMINI_CACHE_TTL_DAYS', '90'))
+GEMINI_CACHE_MAX_MB = float(os.environ.get('GEMINI_CACHE_MAX_MB', '100'))
+
+GEMINI_MODEL_NAME = 'gemini-1.5-flash'
+
+# モデルの段階 (ティア)。安い順にカンマ区切りで並べ、結果が不十分な動画だけ次のモデルへ上げる
+# 例: "gemini-1.5-flash-8b,gemini-1.5-flash,gemini-1.5-pro" (既定は GEMINI_MODEL_NAME の1段のみ)
+GEMINI_MODEL_TIERS = [name.strip() for name in os.environ.get('GEMINI_MODEL_TIERS', GEMINI_MODEL_NAME).split(',') if name.strip()]
+if not GEMINI_MODEL_TIERS:
+    raise ValueError("GEMINI_MODEL_TIERS must name at least one model.")
+ESCALATE_REQUIRE_START = os.environ.get('ESCALATE_REQUIRE_START', 'on')      # "on": 出発地点が空なら次のティアへ
+ESCALATE_MIN_WAYPOINTS = int(os.environ.get('ESCALATE_MIN_WAYPOINTS', '2'))  # 経由地がこれ未満なら次のティアへ
+
+# 固定の指示文とスキーマの扱い ("on": モデル生成時に system_instruction として1回だけ設定 / "off": 毎回プロンプトに埋め込む)
+GEMINI_SYSTEM_INSTRUCTION = os.environ.get('GEMINI_SYSTEM_INSTRUCTION', 'on')
+
+# ルールベースの抽出 ("on": 定型表現と地名辞書で抽出し、確信度が高い動画ではGeminiを呼ばない)
+ROUTE_RULES = os.environ.get('ROUTE_RULES', 'off')
+ROUTE_RULES_MIN_CONFIDENCE = float(os.environ.get('ROUTE_RULES_MIN_CONFIDENCE', '0.75'))
+ROUTE_RULES_AUDIT_RATE = float(os.environ.get('ROUTE_RULES_AUDIT_RATE', '0.05'))  # 確信度が高い動画のうち、Geminiでも分析して一致率を測る割合
+
+# 地名辞書 (IC/JCT/SA/PA・ディーラー・施設のID・座標)。ルールベース抽出と経由地の正規化で使う
+ROUTE_GAZETTEER_PATH = os.environ.get(
+    'ROUTE_GAZETTEER_PATH', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'gazetteer.tsv')
+)
+# 経由地の正規化 ("on": 「秦野中井IC入口通過」等を辞書の名前に揃え、同じ地点の重複を除いてから書き込む)
+GAZETTEER_NORMALIZE = os.environ.get('GAZETTEER_NORMALIZE', 'off')
+GAZETTEER_FUZZY_MIN_SCORE = float(os.environ.get('GAZETTEER_FUZZY_MIN_SCORE', '0.6'))  # あいまい一致で対応付ける最低の類似度
+GAZETTEER_CONTAINS_MIN_SCORE = float(os.environ.get('GAZETTEER_CONTAINS_MIN_SCORE', '0.5'))  # 辞書の地名が文字列に占める最低の割合
+
+# 走行距離の推定 ("on": 正規化した経由地を高速道路網の最短経路で結び、総距離と区間距離を ROUTE_DISTANCE_COLUMNS に書き込む)
+ROUTE_DISTANCE = os.environ.get('ROUTE_DISTANCE', 'off')
+ROUTE_GRAPH_PATH = os.environ.get(
+    'ROUTE_GRAPH_PATH', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'expressway_graph.tsv')
+)
+ROUTE_DETOUR_FACTOR = float(os.environ.get('ROUTE_DETOUR_FACTOR', '1.3'))  # 高速道路網で結べない区間は直線距離にこの係数を掛ける
+# 走行距離を書き込む隣り合った2列 (総距離km, 区間距離km)。X列より右の、他の用途に使っていない列を指定する
+# (距離を書き込む実行だけ、起動時に指定と見出しを確かめ、空いていれば DISTANCE_COLUMN_HEADERS を書き込んで確保する。
+#  check_distance_columns)
+ROUTE_DISTANCE_COLUMNS = os.environ.get('ROUTE_DISTANCE_COLUMNS', 'Y:Z')
+DISTANCE_COLUMN_HEADERS = ['走行距離(km)', '区間距離(km)']
+DISTANCE_COLUMN_INDICES = [column_index(column.strip()) for column in ROUTE_DISTANCE_COLUMNS.split(':')]
+
+# 長いトランスクリプトの分割分析 ("off": 常に単一プロンプト / "auto": 上限を超えたら区間に分割)
+GEMINI_CHUNK_MODE = os.environ.get('GEMINI_CHUNK_MODE', 'off')
+GEMINI_CHUNK_TOKENS = int(os.environ.get('GEMINI_CHUNK_TOKENS', '8000'))              # 1区間あたりの目安トークン数
+GEMINI_CHUNK_OVERLAP_TOKENS = int(os.environ.get('GEMINI_CHUNK_OVERLAP_TOKENS', '400')) # 区間どうしの重なり
+GEMINI_CHUNK_CONCURRENCY = int(os.environ.get('GEMINI_CHUNK_CONCURRENCY', '4'))       # 1動画内の並列数
+
+# 複数動画のまとめて分析 ("on": 短いトランスクリプトを1リクエストにまとめる)
+GEMINI_BATCH_MODE = os.environ.get('GEMINI_BATCH_MODE', 'off')
+GEMINI_BATCH_SHORT_TOKENS = int(os.environ.get('GEMINI_BATCH_SHORT_TOKENS', '3000'))  # これ以下を「短い」とみなす
+GEMINI_BATCH_MAX_TOKENS = int(os.environ.get('GEMINI_BATCH_MAX_TOKENS', '15000'))     # 1リクエストのトークン上限
+GEMINI_BATCH_MAX_VIDEOS = int(os.environ.get('GEMINI_BATCH_MAX_VIDEOS', '8'))         # 1リクエストの動画数上限
+BATCH_PLANNING_ROWS = int(os.environ.get('BATCH_PLANNING_ROWS', '200'))               # まとめて計画する行数
+
+# スプレッドシート書き込み設定 (N件またはT秒ごとに書き込み、書き込みAPIはRPMで制限)
+SHEET_FLUSH_EVERY = int(os.environ.get('SHEET_FLUSH_EVERY', '25'))
+SHEET_FLUSH_SECONDS = float(os.environ.get('SHEET_FLUSH_SECONDS', '60'))
+SHEET_WRITE_RPM = float(os.environ.get('SHEET_WRITE_RPM', '60'))
+
+# トランスクリプトの事前絞り込み ("on": ルート語彙の周辺セグメントだけをGeminiに送る)
+TRANSCRIPT_PREFILTER = os.environ.get('TRANSCRIPT_PREFILTER', 'off')
+PREFILTER_WINDOW = int(os.environ.get('PREFILTER_WINDOW', '2'))  # ヒットしたセグメントの前後に残す件数
+
+# 外部APIのレート制限 (429を受けると自動で速度を落とし、成功が続くと設定値まで戻す)。全シャードの合計値
+YOUTUBE_RPM = float(os.environ.get('YOUTUBE_RPM', '60'))
+GEMINI_RPM = float(os.environ.get('GEMINI_RPM', '60'))
+GEMINI_TPM = float(os.environ.get('GEMINI_TPM', '1000000'))
+API_MAX_RETRIES = int(os.environ.get('API_MAX_RETRIES', '5'))
+
+# スプレッドシート読み込み方式 ("projected": E列とM列のみ取得 / "full": get_all_values()で全列取得)
+SHEET_READ_MODE = os.environ.get('SHEET_READ_MODE', 'projected')
+
+# 実行レポート (ステージごとの所要時間・入出力量・トークン数)。空文字ならファイルに書き出さない
+RUN_REPORT_PATH = os.environ.get('RUN_REPORT_PATH', 'run_report.json')
+RUN_REPORT_SLOWEST = int(os.environ.get('RUN_REPORT_SLOWEST', '10'))  # レポートに載せる遅い動画の件数
+
+# Prometheusメトリクスの出力先 (どちらも空なら出力しない)
+METRICS_TEXTFILE = os.environ.get('METRICS_TEXTFILE', '')          # node-exporter textfile collector 用の .prom ファイル
+METRICS_PUSHGATEWAY_URL = os.environ.get('METRICS_PUSHGATEWAY_URL', '')  # 例: http://pushgateway:9091
+METRICS_JOB = os.environ.get('METRICS_JOB', 'route_analyzer')
+
+# サービスごとのレートリミッター (asyncモードの全ワーカーで共有)
+# 各設定値はAPIキー・サービスアカウント全体の上限なので、シャードで分けて実行する場合は
+# 1シャードあたり SHARD_COUNT 分の1にする (全シャードの合計が上限を超えないように)
+youtube_limiter = AdaptiveRateLimiter('youtube', YOUTUBE_RPM / SHARD_COUNT)
+gemini_limiter = AdaptiveRateLimiter('gemini', GEMINI_RPM / SHARD_COUNT, tokens_per_minute=GEMINI_TPM / SHARD_COUNT)
+sheets_limiter = AdaptiveRateLimiter('sheets', SHEET_WRITE_RPM / SHARD_COUNT)
+
+# 実行中のGemini呼び出しの枠 (GEMINI_CONCURRENCY 個)。分割分析の区間ごとの呼び出しもこの枠を使うため、
+# 並列に分析する動画数 × 区間の並列数にはならない
+gemini_slots = threading.BoundedSemaphore(max(1, GEMINI_CONCURRENCY))
+
+# ステージごとの計測 (全ワーカーで共有)
+run_report = RunReport(slowest_n=RUN_REPORT_SLOWEST)
+
 # TranscriptsDisabledエラーをモジュールから取得
 TranscriptsDisabled = yta.TranscriptsDisabled
 
-# --- APIクライアント初期化 ---
-try:
-    # 1. Google Sheets 認証設定 (サービスアカウント)
-    sa_key_json_string = os.environ.get('GCP_SERVICE_ACCOUNT_KEY')
-    if not sa_key_json_string:
-        raise ValueError("GCP_SERVICE_ACCOUNT_KEY not found in environment variables.")
+# --- APIクライアント初期化 (初回利用時に生成) ---
+SHEETS_SCOPES = [
+    "https://www.googleapis.com/auth/spreadsheets",
+    "https://www.googleapis.com/auth/drive"
+]
+
+_gspread_client = None
+_gemini_models: Dict[Tuple[str, str], Any] = {}  # (用途 (GEMINI_TASKS のキー), モデル名) → モデル
+_client_lock = threading.Lock()
+
+# 起動時間の内訳 (秒)。終了時に出力する
+startup_timings: Dict[str, float] = {}
+
+def get_gspread_client():
+    """Google Sheetsクライアントを初回利用時に生成して返す"""
+    global _gspread_client
+    with _client_lock:
+        if _gspread_client is None:
+            started = time.perf_counter()
+            import gspread
+            from google.oauth2.service_account import Credentials
+
+            # 1. Google Sheets 認証設定 (サービスアカウント)
+            sa_key_json_string = os.environ.get('GCP_SERVICE_ACCOUNT_KEY')
+            if not sa_key_json_string:
+                raise ValueError("GCP_SERVICE_ACCOUNT_KEY not found in environment variables.")
+
+            # JSON文字列をパースし、ファイルを経由せずに認証情報を作る
+            creds = Credentials.from_service_account_info(json.loads(sa_key_json_string), scopes=SHEETS_SCOPES)
+            # gspreadクライアントを認証
+            _gspread_client = gspread.authorize(creds)
+            startup_timings['sheets_client'] = time.perf_counter() - started
+    return _gspread_client
+
+def create_gemini_model(kind: str, model_name: str):
+    """用途 (kind) とモデル名ごとのGeminiモデルを生成する
+
+    固定の指示文とレスポンススキーマはモデル側に1回だけ設定し、リクエストごとには
+    可変部分 (トランスクリプト等) だけを送る。指示文は100〜200トークン程度で、APIのコンテキストキャッシュの
+    最小トークン数 (gemini-1.5系は32768) に遠く及ばないため、CachedContent は作らない。
+    """
+    import google.generativeai as genai
 
-    # JSON文字列を一度パースし、整形して一時ファイルに書き出す (改行/パース問題の解消)
-    sa_key_data = json.loads(sa_key_json_string)
-    
-    # 一時ファイルに書き出し
-    with open('service_account_key.json', 'w') as f:
-        # indent=2で書き出すことで、可読性と安全性を高める
-        json.dump(sa_key_data, f, indent=2) 
-
-    # 認証情報をファイルから読み込み
-    creds = Credentials.from_service_account_file('service_account_key.json', scopes=[
-        "https://www.googleapis.com/auth/spreadsheets",
-        "https://www.googleapis.com/auth/drive"
-    ])
-    # gspreadクライアントを認証
-    gc = gspread.authorize(creds)
-    
     # 2. Gemini API クライアント初期化
     genai.configure(api_key=os.environ.get('GEMINI_API_KEY'))
-    # モデルのインスタンスを生成
-    gemini_model = genai.GenerativeModel('gemini-1.5-flash')
 
-except Exception as e:
-    print(f"API Client Initialization Error: {e}")
-    exit(1)
+    instruction, response_schema = GEMINI_TASKS[kind]
+    # 構造化されたJSON出力を要求する設定 (google.generativeai は辞書形式の GenerationConfig を受け付ける)
+    generation_config = {
+        "response_mime_type": "application/json",
+        "response_schema": response_schema
+    }
+
+    if GEMINI_SYSTEM_INSTRUCTION == 'off':
+        return genai.GenerativeModel(model_name, generation_config=generation_config)
+
+    return genai.GenerativeModel(model_name, system_instruction=instruction, generation_config=generation_config)
+
+def get_gemini_model(kind: str = 'route', model_name: str = GEMINI_MODEL_NAME):
+    """用途・モデル名ごとのGeminiモデルを初回利用時に生成して返す (分析対象がなければ生成されない)"""
+    key = (kind, model_name)
+    with _client_lock:
+        if key not in _gemini_models:
+            started = time.perf_counter()
+            # モデルのインスタンスを生成 (実行中は同じインスタンスを使い回す)
+            _gemini_models[key] = create_gemini_model(kind, model_name)
+            startup_timings[f'gemini_model_{kind}_{model_name}'] = time.perf_counter() - started
+    return _gemini_models[key]
+
+def format_startup_timings() -> str:
+    """起動時間の内訳を1行の文字列にする"""
+    return ", ".join(f"{name}={seconds:.3f}s" for name, seconds in startup_timings.items())
 
 
 # --- 関数定義 ---
 
-def get_video_id(url: str) -> Optional[str]:
-    """YouTube URLから動画IDを抽出する"""
-    if "youtu.be" in url:
-        return url.split("/")[-1].split("?")[0]
-    elif "v=" in url:
-        return url.split("v=")[-1].split("&")[0]
-    return None
+_transcript_cache: Optional[SQLiteCache] = None
+
+def get_transcript_cache() -> SQLiteCache:
+    """トランスクリプトキャッシュを初回利用時に生成して返す (並行するワーカーで1つだけ開く)"""
+    global _transcript_cache
+    if _transcript_cache is None:
+        with _client_lock:
+            if _transcript_cache is None:
+                _transcript_cache = SQLiteCache(
+                    os.path.join(CACHE_DIR, 'transcripts.sqlite3'),
+                    table='transcripts',
+                    ttl_seconds=TRANSCRIPT_CACHE_TTL_DAYS * 86400,
+                    max_bytes=int(TRANSCRIPT_CACHE_MAX_MB * 1024 * 1024),
+                )
+    return _transcript_cache
+
+def transcript_cache_key(video_id: str) -> str:
+    """動画IDと言語指定からキャッシュキー(SHA-256)を作る"""
+    material = f"{video_id}|{','.join(TRANSCRIPT_LANGUAGES)}"
+    return hashlib.sha256(material.encode('utf-8')).hexdigest()
+
+# 再試行しても結果が変わらない失敗 (youtube_transcript_api の例外クラス名で判定する)
+PERMANENT_TRANSCRIPT_ERRORS = {
+    'TranscriptsDisabled', 'NoTranscriptFound', 'NoTranscriptAvailable', 'VideoUnavailable',
+    'VideoUnplayable', 'InvalidVideoId', 'AgeRestricted', 'NotTranslatable',
+}
+
+_negative_cache: Optional[SQLiteCache] = None
+
+def get_negative_cache() -> Optional[SQLiteCache]:
+    """トランスクリプト取得失敗の記録を返す (TRANSCRIPT_NEGATIVE_CACHE=off の場合はNone)"""
+    global _negative_cache
+    if TRANSCRIPT_NEGATIVE_CACHE == 'off':
+        return None
+    if _negative_cache is None:
+        # 成功するまで失敗回数を引き継ぐため、TTLは付けない (成功時に削除する)
+        _negative_cache = SQLiteCache(os.path.join(CACHE_DIR, 'transcript_failures.sqlite3'), table='transcript_failures')
+        if TRANSCRIPT_NEGATIVE_CACHE == 'clear':
+            _negative_cache.clear()
+    return _negative_cache
+
+def negative_recheck_interval(permanent: bool, failures: int) -> float:
+    """失敗回数に応じた再確認までの秒数 (指数的に延ばし、上限で頭打ち)"""
+    if permanent:
+        base, limit = NEGATIVE_PERMANENT_BASE_HOURS, NEGATIVE_PERMANENT_MAX_HOURS
+    else:
+        base, limit = NEGATIVE_TRANSIENT_BASE_HOURS, NEGATIVE_TRANSIENT_MAX_HOURS
+    return min(limit, base * (2 ** (failures - 1))) * 3600
+
+def record_transcript_failure(video_id: str, error: Exception) -> None:
+    """取得失敗を記録し、次に確認してよい時刻を決める"""
+    cache = get_negative_cache()
+    if cache is None:
+        return
+
+    key = transcript_cache_key(video_id)
+    previous = cache.get(key) or {}
+    now = time.time()
+    failure = type(error).__name__
+    permanent = failure in PERMANENT_TRANSCRIPT_ERRORS
+    # 失敗の種類が変わったら (一時的→恒久的など) 間隔を最初からやり直す
+    failures = previous.get('failures', 0) + 1 if previous.get('permanent') == permanent else 1
+    cache.set(key, {
+        'video_id': video_id,
+        'failure': failure,
+        'permanent': permanent,
+        'failures': failures,
+        'failed_at': now,
+        'recheck_after': now + negative_recheck_interval(permanent, failures),
+    })
 
-def get_transcript(video_id: str) -> Optional[str]:
-    """YouTube動画のトランスクリプトを取得する"""
+def known_transcript_failure(video_id: str) -> Optional[Dict]:
+    """再確認の時刻に達していない失敗記録があれば返す (ネットワークにはアクセスしない)"""
+    cache = get_negative_cache()
+    if cache is None:
+        return None
+    entry = cache.get(transcript_cache_key(video_id))
+    if entry is None or entry['recheck_after'] <= time.time():
+        return None
+    return entry
+
+def fetch_transcript_segments(video_id: str) -> Tuple[List[Dict], str]:
+    """トランスクリプトのセグメント一覧と言語コードを返す (キャッシュ優先)"""
+    cache = get_transcript_cache()
+    cache_key = transcript_cache_key(video_id)
+
+    cached = cache.get(cache_key)
+    if cached is not None:
+        return cached['segments'], cached['language']
+
+    # get_transcript()と同じ言語優先順で取得し、実際に使われた言語も記録する
+    def download():
+        api = yta.YouTubeTranscriptApi()
+        # v1.x はインスタンスの list()、v0.6.x はクラスメソッドの list_transcripts()
+        if hasattr(api, 'list'):
+            transcript_list = api.list(video_id)
+        else:
+            transcript_list = yta.YouTubeTranscriptApi.list_transcripts(video_id)
+        transcript = transcript_list.find_transcript(TRANSCRIPT_LANGUAGES)
+        fetched = transcript.fetch()
+        # v1.x の FetchedTranscript は to_raw_data() で従来の辞書リストに変換できる
+        if hasattr(fetched, 'to_raw_data'):
+            fetched = fetched.to_raw_data()
+        return fetched, transcript.language_code
+
+    # スロットリングはバックオフして再試行 (TranscriptsDisabled等は即座に送出)
+    fetched, language = call_with_backoff(download, youtube_limiter, max_retries=API_MAX_RETRIES)
+    segments = [
+        {'text': item['text'], 'start': item['start'], 'duration': item['duration']}
+        for item in fetched
+    ]
+
+    cache.set(cache_key, {'video_id': video_id, 'language': language, 'segments': segments})
+    return segments, language
+
+def get_transcript_segments(video_id: str) -> Optional[List[Dict]]:
+    """YouTube動画のトランスクリプトをセグメント一覧 (text/start/duration) で取得する"""
     try:
-        # YouTubeTranscriptApiを新しいインポート名(yta)で参照
-        transcript_list = yta.YouTubeTranscriptApi.get_transcript(video_id, languages=['ja', 'en']) 
-        
-        # 結果はリストで返ってくるため、そのまま結合する
-        full_transcript = " ".join([item['text'] for item in transcript_list])
-        return full_transcript
+        with run_report.span('transcript', video_id) as span:
+            segments, _language = fetch_transcript_segments(video_id)
+            span.chars_out = sum(len(item['text']) for item in segments)
         
-    except TranscriptsDisabled:
+    except TranscriptsDisabled as e:
         print(f"  > Error: Transcripts are disabled for video {video_id}.")
+        record_transcript_failure(video_id, e)
         return None
     except Exception as e:
         print(f"  > Error: Failed to get transcript for {video_id}. {e}")
+        record_transcript_failure(video_id, e)
         return None
 
-def analyze_route_with_gemini(transcript: str) -> Dict[str, List[str]]:
-    """Gemini APIを使用してトランスクリプトからルート情報を分析する"""
-    
-    prompt = f"""
-    あなたは、自動車レビューと地理に精通した**プロのテストドライバー**です。
+    # 以前失敗していた動画が取得できたら、失敗記録を消す
+    negative_cache = get_negative_cache()
+    if negative_cache is not None:
+        negative_cache.delete(transcript_cache_key(video_id))
+    return segments
+
+def prefilter_transcript(video_id: str, transcript: CompactTranscript) -> CompactTranscript:
+    """ルート語彙を含む部分だけを残し、削減率を出力する (TRANSCRIPT_PREFILTER=off なら素通し)"""
+    if TRANSCRIPT_PREFILTER != 'on':
+        return transcript
+
+    kept, stats = filter_transcript(transcript, window=PREFILTER_WINDOW)
+    print(
+        f"  > Prefilter [{video_id}]: segments {stats['segments_before']}->{stats['segments_after']}, "
+        f"tokens {stats['tokens_before']}->{stats['tokens_after']} ({stats['reduction']:.0%} reduction)"
+    )
+    return kept
+
+def get_transcript(video_id: str) -> Optional[CompactTranscript]:
+    """YouTube動画のトランスクリプトを取得する (本文は .text、各セグメントの位置と時刻は並列配列)
+
+    取得できなければNone。以降のステージ (事前絞り込み・分割・ルールベース抽出・Gemini・時刻の注記) は
+    ここで作った1つの CompactTranscript を使い、セグメントの辞書から作り直さない。
+    """
+    segments = get_transcript_segments(video_id)
+    if not segments:
+        return None
+
+    return CompactTranscript.from_segments(segments)
+
+# 構造化されたJSON出力のスキーマ
+ROUTE_RESPONSE_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "start": {"type": "string", "description": "走行の開始地点。例: 東京スバル三鷹店"},
+        "end": {"type": "string", "description": "走行の終着地点。例: ハンガーエイト"},
+        "waypoints": {
+            "type": "array",
+            "items": {"type": "string"},
+            "description": "経由した場所や道路情報（最大10個）。例: 国道4号線を走行、秦野中井IC入口通過、豊田JCT通過"
+        }
+    }
+}
+
+# 全用途で共通の役割設定
+GEMINI_PERSONA = "あなたは、自動車レビューと地理に精通した**プロのテストドライバー**です。"
+
+# ルート分析の固定の指示文 (system_instruction としてモデル側に1回だけ設定する)
+ROUTE_INSTRUCTION = f"""
+    {GEMINI_PERSONA}
     提供されたトランスクリプトを分析し、車両のレビュー目的で走行した具体的な**スタート地点、経由地、終着地点**を特定してください。
     特に、**具体的な道路名、IC/JCT名、およびランドマーク**を抽出することに重点を置いてください。
-    
+    """
+
+def build_route_prompt(transcript: str) -> str:
+    """ルート分析用のプロンプト (リクエストごとに変わる部分) を組み立てる"""
+    return f"""
     --- トランスクリプト ---
     {transcript}
     """
+
+_gemini_cache: Optional[SQLiteCache] = None
+
+def get_gemini_cache() -> Optional[SQLiteCache]:
+    """Geminiレスポンスキャッシュを返す (GEMINI_CACHE=off の場合はNone。clear は最初の1回だけ消す)"""
+    global _gemini_cache
+    if GEMINI_CACHE_MODE == 'off':
+        return None
+    if _gemini_cache is None:
+        with _client_lock:
+            if _gemini_cache is None:
+                cache = SQLiteCache(
+                    os.path.join(CACHE_DIR, 'gemini_responses.sqlite3'),
+                    table='gemini_responses',
+                    ttl_seconds=GEMINI_CACHE_TTL_DAYS * 86400,
+                    max_bytes=int(GEMINI_CACHE_MAX_MB * 1024 * 1024),
+                )
+                if GEMINI_CACHE_MODE == 'clear':
+                    cache.clear()
+                # 消し終えてから公開する (他のスレッドが消す前のキャッシュを読まないように)
+                _gemini_cache = cache
+    return _gemini_cache
+
+def gemini_cache_key(model_name: str, prompt: str, response_schema: Dict) -> str:
+    """(モデル名, プロンプトのSHA-256, スキーマ) からキャッシュキーを作る"""
+    prompt_hash = hashlib.sha256(prompt.encode('utf-8')).hexdigest()
+    material = json.dumps([model_name, prompt_hash, response_schema], ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(material.encode('utf-8')).hexdigest()
+
+def generate_json(
+    prompt: str,
+    kind: str,
+    required_keys: Tuple[str, ...],
+    video_id: Union[None, str, List[str]] = None,
+    model_name: str = GEMINI_MODEL_NAME,
+) -> Tuple[Optional[Any], Dict[str, int]]:
+    """GeminiにJSON出力を要求し、(パース結果, トークン使用量) を返す
+
+    prompt はリクエストごとに変わる部分だけで、固定の指示文とスキーマは kind
+    (GEMINI_TASKS のキー) と model_name のモデルに設定済みのものを使う。
+    キャッシュ済みなら呼び出しを省略する (使用量は0)。必須キーが欠けた結果はNone。
+    API呼び出しの失敗は例外として呼び出し元へ送出する。
+    API呼び出しは video_id の 'gemini' ステージとして実行レポートに記録する。
+    """
+    usage = {'prompt_tokens': 0, 'output_tokens': 0, 'cached_tokens': 0}
+    instruction, response_schema = GEMINI_TASKS[kind]
+    # 指示文を毎回埋め込む場合 (比較用) のリクエスト本文
+    contents = prompt if GEMINI_SYSTEM_INSTRUCTION != 'off' else instruction + prompt
+
+    # 同じプロンプトの結果が既にあれば、API呼び出しをせずに再利用する
+    # (指示文の変更で古い結果を使わないよう、キーには指示文も含める。送り方には依存しない)
+    cache = get_gemini_cache()
+    cache_key = gemini_cache_key(model_name, instruction + prompt, response_schema)
+    if cache is not None and GEMINI_CACHE_MODE != 'refresh':
+        cached = cache.get(cache_key)
+        if cached is not None:
+            return cached, usage
+
+    gemini_model = get_gemini_model(kind, model_name)
+
+    with run_report.span('gemini', video_id) as span:
+        span.chars_in = len(contents)
+        # 429はRetry-Afterを尊重してバックオフ再試行し、行を取りこぼさないようにする
+        # (system_instruction もTPMの対象になるため、トークン数の見積もりには指示文を含める)
+        with gemini_slots:
+            response = call_with_backoff(
+                lambda: gemini_model.generate_content(contents),
+                gemini_limiter,
+                tokens=estimate_tokens(instruction + prompt),
+                max_retries=API_MAX_RETRIES,
+            )
+
+        usage_metadata = getattr(response, 'usage_metadata', None)
+        if usage_metadata is not None:
+            usage['prompt_tokens'] = getattr(usage_metadata, 'prompt_token_count', 0) or 0
+            usage['output_tokens'] = getattr(usage_metadata, 'candidates_token_count', 0) or 0
+            usage['cached_tokens'] = getattr(usage_metadata, 'cached_content_token_count', 0) or 0
+        span.chars_out = len(response.text)
+        span.prompt_tokens = usage['prompt_tokens']
+        span.output_tokens = usage['output_tokens']
+        span.cached_tokens = usage['cached_tokens']
+
+    # レスポンスのテキスト（JSON文字列）をパース
+    result = json.loads(response.text)
+
+    # データ構造をチェック (配列スキーマの場合は required_keys を空にする)
+    if not isinstance(result, (dict, list)) or not all(key in result for key in required_keys):
+        return None, usage
+
+    # 正常な結果のみキャッシュする (失敗は次回再試行させる)
+    if cache is not None:
+        cache.set(cache_key, result)
+    return result, usage
+
+def analyze_route_with_gemini(
+    transcript: str,
+    video_id: Optional[str] = None,
+    model_name: str = GEMINI_MODEL_NAME,
+) -> Dict[str, List[str]]:
+    """Gemini APIを使用してトランスクリプトからルート情報を分析する"""
+    
+    prompt = build_route_prompt(transcript)
     
     try:
-        # 構造化されたJSON出力を要求する設定を直接定義
-        config = genai.types.GenerateContentConfig(
-            response_mime_type="application/json",
-            response_schema={
-                "type": "object",
-                "properties": {
-                    "start": {"type": "string", "description": "走行の開始地点。例: 東京スバル三鷹店"},
-                    "end": {"type": "string", "description": "走行の終着地点。例: ハンガーエイト"},
-                    "waypoints": {
-                        "type": "array",
-                        "items": {"type": "string"},
-                        "description": "経由した場所や道路情報（最大10個）。例: 国道4号線を走行、秦野中井IC入口通過、豊田JCT通過"
-                    }
-                }
-            }
-        )
-        
-        response = gemini_model.generate_content(prompt, config=config)
+        analysis_result, _usage = generate_json(prompt, 'route', ('start', 'end', 'waypoints'), video_id, model_name)
         
-        # レスポンスのテキスト（JSON文字列）をパース
-        analysis_result = json.loads(response.text)
-        
-        # データ構造をチェック
-        if 'start' in analysis_result and 'end' in analysis_result and 'waypoints' in analysis_result:
+        if analysis_result is not None:
             return analysis_result
         else:
             print("  > Warning: Gemini analysis returned invalid JSON structure.")
@@ -124,91 +557,1153 @@ def analyze_route_with_gemini(transcript: str) -> Dict[str, List[str]]:
         return {'start': '', 'end': '', 'waypoints': []}
 
 
+# --- 長いトランスクリプトの分割分析 (map-reduce) ---
+
+# map段階: ウィンドウごとに場所の候補だけを抜き出す
+ROUTE_CANDIDATE_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "start_candidates": {"type": "array", "items": {"type": "string"}, "description": "出発地点と思われる場所"},
+        "places": {"type": "array", "items": {"type": "string"}, "description": "言及順の経由地や道路情報"},
+        "end_candidates": {"type": "array", "items": {"type": "string"}, "description": "終着地点と思われる場所"}
+    }
+}
+
+def format_timestamp(seconds: float) -> str:
+    """秒数を mm:ss 形式にする"""
+    minutes, secs = divmod(int(seconds), 60)
+    return f"{minutes:02d}:{secs:02d}"
+
+CANDIDATE_INSTRUCTION = f"""
+    {GEMINI_PERSONA}
+    試乗動画の長いトランスクリプトの一部 (区間) が与えられます。
+    この区間で言及された、走行ルートに関係する**具体的な道路名、IC/JCT名、およびランドマーク**を抽出してください。
+    出発・到着を示す表現があれば、それぞれ出発地点・終着地点の候補として挙げてください。
+    """
+
+def build_candidate_prompt(window: Dict, index: int, total: int) -> str:
+    """ウィンドウ1つ分の候補抽出プロンプト (リクエストごとに変わる部分) を組み立てる"""
+    return f"""
+    --- トランスクリプト (部分: 全{total}区間中の{index + 1}区間目、{format_timestamp(window['start'])}〜{format_timestamp(window['end'])}) ---
+    {window['text']}
+    """
+
+REDUCE_INSTRUCTION = f"""
+    {GEMINI_PERSONA}
+    試乗動画のトランスクリプトを時間順の区間に分け、区間ごとに抽出した場所の候補が与えられます。
+    区間は一部重なっているため、重複した候補は1つにまとめてください。
+    これらを統合し、走行の**スタート地点、経由地(走行順、最大10個)、終着地点**を決定してください。
+    """
+
+def build_reduce_prompt(candidates: List[Dict]) -> str:
+    """区間ごとの候補をまとめて最終ルートを決めるプロンプト (リクエストごとに変わる部分) を組み立てる"""
+    return f"""
+    --- 区間ごとの候補 (JSON) ---
+    {json.dumps(candidates, ensure_ascii=False)}
+    """
+
+def analyze_route_chunked(
+    transcript: CompactTranscript,
+    video_id: Optional[str] = None,
+    model_name: str = GEMINI_MODEL_NAME,
+) -> Dict[str, List[str]]:
+    """長いトランスクリプトを区間に分けて並列に候補抽出し、1回の統合呼び出しでルートを決める"""
+    started = time.perf_counter()
+    windows = chunk_transcript(transcript, GEMINI_CHUNK_TOKENS, GEMINI_CHUNK_OVERLAP_TOKENS)
+
+    def extract(indexed_window):
+        index, window = indexed_window
+        try:
+            return generate_json(
+                build_candidate_prompt(window, index, len(windows)),
+                'candidate',
+                ('places',),
+                video_id,
+                model_name,
+            )
+        except Exception as e:
+            print(f"  > Error: Gemini candidate extraction failed for window {index + 1}. {e}")
+            return None, {'prompt_tokens': 0, 'output_tokens': 0}
+
+    # map: 各区間を並列に処理する (同時に送る数は generate_json の gemini_slots で全体の GEMINI_CONCURRENCY に収まる)
+    with ThreadPoolExecutor(max_workers=max(1, min(GEMINI_CHUNK_CONCURRENCY, len(windows)))) as pool:
+        extracted = list(pool.map(extract, enumerate(windows)))
+
+    usage = {'prompt_tokens': 0, 'output_tokens': 0}
+    candidates = []
+    for index, (window, (result, window_usage)) in enumerate(zip(windows, extracted)):
+        usage['prompt_tokens'] += window_usage['prompt_tokens']
+        usage['output_tokens'] += window_usage['output_tokens']
+        if result is None:
+            continue
+        candidates.append({
+            'window': index + 1,
+            'from': format_timestamp(window['start']),
+            'to': format_timestamp(window['end']),
+            'start_candidates': result.get('start_candidates', []),
+            'places': result.get('places', []),
+            'end_candidates': result.get('end_candidates', []),
+        })
+
+    analysis_result = {'start': '', 'end': '', 'waypoints': []}
+    if candidates:
+        # reduce: 候補だけを渡すため、元のトランスクリプトより大幅に小さいプロンプトになる
+        try:
+            reduced, reduce_usage = generate_json(
+                build_reduce_prompt(candidates), 'reduce', ('start', 'end', 'waypoints'), video_id, model_name
+            )
+            usage['prompt_tokens'] += reduce_usage['prompt_tokens']
+            usage['output_tokens'] += reduce_usage['output_tokens']
+            if reduced is not None:
+                analysis_result = reduced
+            else:
+                print("  > Warning: Gemini reduce step returned invalid JSON structure.")
+        except Exception as e:
+            print(f"  > Error: Gemini reduce step failed. {e}")
+    else:
+        print("  > Warning: No route candidates were extracted from any window.")
+
+    # 単一プロンプトの場合と比較できるよう、所要時間とトークン数を出力する
+    single_prompt_tokens = estimate_tokens(ROUTE_INSTRUCTION + build_route_prompt(transcript.text))
+    elapsed = time.perf_counter() - started
+    print(
+        f"  > Chunked analysis: windows={len(windows)}, latency={elapsed:.1f}s, "
+        f"tokens(in/out)={usage['prompt_tokens']}/{usage['output_tokens']}, "
+        f"single-prompt input estimate={single_prompt_tokens}"
+    )
+    return analysis_result
+
+def escalation_reason(analysis_result: Dict[str, List[str]]) -> Optional[str]:
+    """結果が不十分で次のティアへ上げるべき理由を返す (十分ならNone)"""
+    if ESCALATE_REQUIRE_START == 'on' and not analysis_result.get('start'):
+        return 'no_start'
+    if len([w for w in analysis_result.get('waypoints', []) if w]) < ESCALATE_MIN_WAYPOINTS:
+        return 'few_waypoints'
+    return None
+
+def tier_entry(model_name: str, seconds: float, analysis_result: Dict[str, List[str]]) -> Dict:
+    """1ティア分の記録 {'tier', 'seconds', 'reason'} を作る (reason がNoneなら採用)"""
+    return {'tier': model_name, 'seconds': round(seconds, 3), 'reason': escalation_reason(analysis_result)}
+
+_gazetteer_index: Optional[GazetteerIndex] = None
+_gazetteer: Optional[Gazetteer] = None
+
+def get_gazetteer_index() -> GazetteerIndex:
+    """地名辞書の索引を初回利用時に構築して返す"""
+    global _gazetteer_index
+    with _client_lock:
+        if _gazetteer_index is None:
+            started = time.perf_counter()
+            _gazetteer_index = GazetteerIndex.load(
+                ROUTE_GAZETTEER_PATH,
+                min_fuzzy_score=GAZETTEER_FUZZY_MIN_SCORE,
+                min_contains_score=GAZETTEER_CONTAINS_MIN_SCORE,
+            )
+            startup_timings['gazetteer_index'] = time.perf_counter() - started
+    return _gazetteer_index
+
+def get_gazetteer() -> Gazetteer:
+    """ルールベース抽出用の地名辞書を初回利用時に読み込んで返す"""
+    global _gazetteer
+    index = get_gazetteer_index()
+    with _client_lock:
+        if _gazetteer is None:
+            _gazetteer = Gazetteer(dict(index.names()))
+    return _gazetteer
+
+def analyze_route_rules(transcript: CompactTranscript, video_id: Optional[str] = None) -> Tuple[Dict[str, List[str]], Dict]:
+    """定型表現と地名辞書でルートを抽出し、(結果, 'rules' ティアの記録) を返す (ネットワーク呼び出しなし)
+
+    確信度が ROUTE_RULES_MIN_CONFIDENCE 未満か、出発・終着地点が名前だけで裏付けがないか、
+    Geminiの結果と同じ基準 (escalation_reason) で不十分なら、記録の reason に理由が入る (呼び出し側でGeminiへ回す)。
+    """
+    started = time.perf_counter()
+    with run_report.span('rules', video_id) as span:
+        span.chars_in = len(transcript.text)
+        analysis_result, confidence = extract_route(transcript.text, get_gazetteer(), ESCALATE_MIN_WAYPOINTS)
+    entry = tier_entry('rules', time.perf_counter() - started, analysis_result)
+    if entry['reason'] is None and confidence < ROUTE_RULES_MIN_CONFIDENCE:
+        entry['reason'] = 'low_confidence'
+    if entry['reason'] is None and not endpoints_verified(analysis_result, get_gazetteer()):
+        entry['reason'] = 'unverified_place'
+    entry['confidence'] = confidence
+    return analysis_result, entry
+
+def rules_audit_sampled(video_id: str) -> bool:
+    """ルールで確定できた動画のうち、Geminiでも分析して一致率を測る動画か (動画IDで決まるため再実行でも同じ)"""
+    if ROUTE_RULES_AUDIT_RATE <= 0:
+        return False
+    digest = hashlib.sha256(f"rules-audit:{video_id}".encode('utf-8')).digest()
+    return int.from_bytes(digest[:8], 'big') / 2 ** 64 < ROUTE_RULES_AUDIT_RATE
+
+def record_rules_audit(video_id: str, rules_result: Dict[str, List[str]], gemini_result: Dict[str, List[str]]) -> None:
+    """ルールベースの結果とGeminiの結果の一致度を実行レポートに記録する
+
+    監査は出力を変えない (シートにはルールベースの結果を書く)。Geminiが失敗したか結果が不十分なら
+    (最後のティアの reason がNoneでなければ) 比べる相手にならないため記録しない。
+    """
+    if gemini_result['tiers'][-1]['reason'] is not None:
+        print(f"  > [video {video_id}] Rules audit skipped: Gemini result unusable ({gemini_result['tiers'][-1]['reason']}).")
+        return
+    agreement = route_agreement(rules_result, gemini_result)
+    run_report.record_agreement('rules_vs_gemini', agreement)
+    print(f"  > [video {video_id}] Rules audit: agreement {agreement}")
+
+def analyze_route(
+    transcript: CompactTranscript,
+    video_id: Optional[str] = None,
+    tiers: Optional[List[str]] = None,
+    rules: Optional[bool] = None,
+) -> Dict[str, List[str]]:
+    """トランスクリプトの長さに応じて、単一プロンプトか分割分析かを選んでルートを分析する
+
+    rules (既定は ROUTE_RULES=on のとき) ならまずルールベースで抽出し、確信度が高ければGeminiを呼ばない。
+    監査に選ばれた動画 (rules_audit_sampled) はGeminiでも分析して一致度を記録するが、返すのはルールベースの結果。
+    tiers (既定は GEMINI_MODEL_TIERS) の安いモデルから順に試し、結果が不十分なときだけ
+    次のモデルへ上げる。試したティアごとの所要時間と判定を 'tiers' として付け加える。
+    """
+    tiers = tiers or GEMINI_MODEL_TIERS
+    chunked = GEMINI_CHUNK_MODE == 'auto' and estimate_tokens(transcript.text) > GEMINI_CHUNK_TOKENS
+
+    if rules is None:
+        rules = ROUTE_RULES == 'on'
+
+    history = []
+    if rules:
+        rules_result, entry = analyze_route_rules(transcript, video_id)
+        history.append(entry)
+        if entry['reason'] is None:
+            if rules_audit_sampled(video_id):
+                record_rules_audit(video_id, rules_result, analyze_route(transcript, video_id, tiers, rules=False))
+            return annotate_mentions(transcript, dict(rules_result, tiers=history), video_id)
+
+    for model_name in tiers:
+        started = time.perf_counter()
+        if chunked:
+            analysis_result = analyze_route_chunked(transcript, video_id, model_name)
+        else:
+            analysis_result = analyze_route_with_gemini(transcript.text, video_id, model_name)
+        history.append(tier_entry(model_name, time.perf_counter() - started, analysis_result))
+        if history[-1]['reason'] is None:
+            break
+        if model_name != tiers[-1]:
+            print(f"  > [video {video_id}] Escalating from {model_name} ({history[-1]['reason']}).")
+    return annotate_mentions(transcript, dict(analysis_result, tiers=history), video_id)
+
+
+def annotate_mentions(
+    transcript: CompactTranscript,
+    analysis_result: Dict[str, List[str]],
+    video_id: Optional[str] = None,
+) -> Dict[str, List[str]]:
+    """出発地点・経由地・終着地点が最初に語られた動画内の時刻を 'mentions' として付け加える
+
+    見つかった地点だけを {'place', 'seconds', 'url'} のリストにする (url は該当時刻へのリンク)。
+    シートへの書き込みデータ (build_write_data) には影響せず、write_results で実行レポートの 'mention_rows' に残す。
+    """
+    places = [analysis_result.get('start', ''), *analysis_result.get('waypoints', []), analysis_result.get('end', '')]
+    mentions = []
+    for place in places:
+        if not place:
+            continue
+        seconds = transcript.find_time(place)
+        if seconds is None:
+            # 「国道4号線を走行」→「国道4号線」で検索し直す
+            stem = PLACE_ACTION_SUFFIX.sub('', place).strip()
+            seconds = transcript.find_time(stem) if stem and stem != place else None
+        if seconds is None:
+            continue
+        mentions.append({
+            'place': place,
+            'seconds': seconds,
+            'url': f"https://youtu.be/{video_id}?t={int(seconds)}" if video_id else None,
+        })
+    return dict(analysis_result, mentions=mentions)
+
+
+# --- 経由地の正規化 (地名辞書) ---
+
+# 書き込む文字列を辞書の名前に置き換える照合方法 (完全一致・国道・辞書の地名を含む)
+REWRITE_METHODS = ('exact', 'national_route', 'contains')
+
+def normalize_route(analysis_result: Dict[str, List[str]], video_id: Optional[str] = None) -> Dict[str, List[str]]:
+    """出発地点・経由地・終着地点を地名辞書の名前に揃え、同じ地点を指す経由地の重複を除く
+
+    文字列を辞書の名前に書き換えるのは、確実な照合 (REWRITE_METHODS) の場合だけ。先頭部分の補完や
+    あいまい一致では元の文字列を残す (地点の対応付けは 'places' に残す)。
+    辞書の地点に対応付いたものは 'places' に {'role', 'text', 'id', 'name', 'kind', 'lat', 'lon', 'score', 'method'}
+    として記録する (対応付かなかったものは id がNone で、文字列はそのまま残す)。
+    後段の処理 (重複判定・ルート図) は文字列ではなく id を使う。'places' は write_results で
+    実行レポートの 'place_rows' に残す (シートには名前だけを書き込む)。
+    """
+    index = get_gazetteer_index()
+    places = []
+    normalized = {}
+    seen = set()
+    with run_report.span('gazetteer', video_id) as span:
+        for role, texts in (('start', [analysis_result.get('start', '')]),
+                            ('waypoint', analysis_result.get('waypoints', [])),
+                            ('end', [analysis_result.get('end', '')])):
+            names = []
+            for text in texts:
+                if not text:
+                    continue
+                span.chars_in += len(text)
+                match = index.resolve(text)
+                place = match.place if match else None
+                if role == 'waypoint':
+                    # 同じ地点 (ID、対応付かなければ文字列) は最初の1つだけ残す
+                    key = place.id if place else text
+                    if key in seen:
+                        continue
+                    seen.add(key)
+                names.append(place.name if place and match.method in REWRITE_METHODS else text)
+                places.append({
+                    'role': role, 'text': text,
+                    'id': place.id if place else None, 'name': place.name if place else text,
+                    'kind': place.kind if place else None,
+                    'lat': place.lat if place else None, 'lon': place.lon if place else None,
+                    'score': match.score if match else 0.0, 'method': match.method if match else None,
+                })
+            normalized[role] = names
+
+    return dict(
+        analysis_result,
+        start=normalized['start'][0] if normalized['start'] else '',
+        waypoints=normalized['waypoint'],
+        end=normalized['end'][0] if normalized['end'] else '',
+        places=places,
+    )
+
+
+# --- 走行距離の推定 (高速道路網) ---
+
+_route_graph = None
+
+def get_route_graph():
+    """高速道路網のグラフを初回利用時に構築して返す (NumPyは距離の推定を使うときだけ読み込む)"""
+    global _route_graph
+    index = get_gazetteer_index()
+    with _client_lock:
+        if _route_graph is None:
+            from route_geometry import RouteGraph
+            started = time.perf_counter()
+            _route_graph = RouteGraph.load(ROUTE_GRAPH_PATH, index.places, detour_factor=ROUTE_DETOUR_FACTOR)
+            startup_timings['route_graph'] = time.perf_counter() - started
+    return _route_graph
+
+def route_points(places: List[Dict]) -> List[Tuple[Optional[str], Optional[float], Optional[float]]]:
+    """normalize_route の 'places' を、ルートの順に (ID, 緯度, 経度) の列にする"""
+    return [(place['id'], place['lat'], place['lon']) for place in places]
+
+def estimate_route_distance(analysis_result: Dict[str, List[str]], video_id: Optional[str] = None) -> Dict[str, List[str]]:
+    """正規化済みの結果 ('places' あり) に、総距離・区間距離・経路の座標を 'distance' として加える"""
+    with run_report.span('distance', video_id) as span:
+        span.chars_in = len(analysis_result['places'])
+        distance = get_route_graph().estimate([route_points(analysis_result['places'])], geometry=True)[0]
+    return dict(analysis_result, distance=distance)
+
+def distance_cells(distance: Optional[Dict]) -> List[Any]:
+    """走行距離の2列 (総距離km、区間距離km を ' / ' 区切り) の書き込みデータ。推定できなければ空欄"""
+    if not distance or distance['total_km'] is None:
+        return ["", ""]
+    return [distance['total_km'], " / ".join(f"{leg['km']:g}" for leg in distance['legs'])]
+
+def check_distance_columns(sheet) -> None:
+    """走行距離の列 (ROUTE_DISTANCE_COLUMNS) が他の用途に使われていないことを確かめ、空いていれば確保する
+
+    見出しが DISTANCE_COLUMN_HEADERS なら、以前の実行で確保した列とみなす。見出しもデータもなければ
+    見出しを書き込んで確保する。列の指定がX列より右の隣り合った2列でない場合、別の見出しがある場合、
+    見出しがないのにデータがある場合は ValueError を送出する (既存のデータを上書きしないため)。
+    """
+    if (len(DISTANCE_COLUMN_INDICES) != 2 or DISTANCE_COLUMN_INDICES[1] != DISTANCE_COLUMN_INDICES[0] + 1
+            or DISTANCE_COLUMN_INDICES[0] <= END_COLUMN_INDEX):
+        raise ValueError(
+            f"ROUTE_DISTANCE_COLUMNS must be two adjacent columns right of X (e.g. 'Y:Z'), got {ROUTE_DISTANCE_COLUMNS!r}"
+        )
+    first, last = DISTANCE_COLUMN_INDICES
+    label = f"{column_letter(first)}:{column_letter(last)}"
+    rows = read_row_block(sheet, first, last, first_row=1)
+    headers = [str(cell).strip() for cell in rows[0][1]] if rows else ["", ""]
+    if headers == DISTANCE_COLUMN_HEADERS:
+        return
+    if any(headers):
+        raise ValueError(
+            f"Distance columns {label} already have headers {headers}. "
+            f"Set ROUTE_DISTANCE_COLUMNS to unused columns."
+        )
+    used = [row for row, cells in rows[1:] if any(str(cell).strip() for cell in cells)]
+    if used:
+        raise ValueError(
+            f"Distance columns {label} have no headers but contain data ({format_rows(used[:5])}"
+            f"{', ...' if len(used) > 5 else ''}). Set ROUTE_DISTANCE_COLUMNS to unused columns, or set the headers "
+            f"to {DISTANCE_COLUMN_HEADERS} if the data is distances from an earlier run."
+        )
+
+    header_range = f"{column_letter(first)}1:{column_letter(last)}1"
+    call_with_backoff(
+        lambda: sheet.batch_update([{'range': header_range, 'values': [DISTANCE_COLUMN_HEADERS]}]),
+        sheets_limiter,
+        max_retries=API_MAX_RETRIES,
+    )
+    print(f"Claimed columns {label} for route distances.")
+
+def backfill_distances(sheet, writer: SheetWriter) -> int:
+    """分析済み (M列記入済み) で総距離の列が空の行の走行距離を、M列〜X列の経由地から推定して書き込む
+
+    トランスクリプト取得・Geminiは使わない。全行の経由地を正規化してから1回の estimate でまとめて
+    推定するため、シート全体の埋め直しにも使える。距離を書き込んだ行数を返す。
+    """
+    total_column_offset = DISTANCE_COLUMN_INDICES[0] - START_COLUMN_INDEX
+    with run_report.span('sheet_read') as span:
+        rows = read_row_block(sheet, START_COLUMN_INDEX, DISTANCE_COLUMN_INDICES[-1])
+        span.chars_out = sum(len(str(cell)) for _row, cells in rows for cell in cells)
+    targets = [(row, cells) for row, cells in rows if cells[0].strip() and not str(cells[total_column_offset]).strip()]
+    print(f"Found {len(targets)} analyzed rows without a distance (of {len(rows)} rows).")
+
+    routes = [
+        normalize_route({'start': cells[0], 'waypoints': [w for w in cells[1:11] if w], 'end': cells[11]})
+        for _row, cells in targets
+    ]
+    with run_report.span('distance') as span:
+        span.chars_in = len(routes)
+        distances = get_route_graph().estimate([route_points(route['places']) for route in routes])
+
+    written = 0
+    for (row, _cells), distance in zip(targets, distances):
+        run_report.record_distance(None, [row], distance)
+        # 位置の分かる地点が2つ未満の行は空欄のまま (書き込みを省く)
+        if distance['total_km'] is not None:
+            writer.add(row, distance_cells(distance))
+            written += 1
+    return written
+
+
+# --- 複数動画のまとめて分析 (バッチ) ---
+
+# バッチ用スキーマ: 動画ごとのルートを配列で返す
+BATCH_RESPONSE_SCHEMA = {
+    "type": "array",
+    "items": {
+        "type": "object",
+        "properties": {
+            "video_id": {"type": "string", "description": "トランスクリプトに付けた動画ID"},
+            "start": ROUTE_RESPONSE_SCHEMA["properties"]["start"],
+            "end": ROUTE_RESPONSE_SCHEMA["properties"]["end"],
+            "waypoints": ROUTE_RESPONSE_SCHEMA["properties"]["waypoints"]
+        }
+    }
+}
+
+BATCH_INSTRUCTION = f"""
+    {GEMINI_PERSONA}
+    複数本の試乗動画のトランスクリプトが与えられます。それぞれ独立に分析し、車両のレビュー目的で走行した具体的な**スタート地点、経由地、終着地点**を特定してください。
+    特に、**具体的な道路名、IC/JCT名、およびランドマーク**を抽出することに重点を置いてください。
+    結果は動画ごとに1要素とし、各要素の video_id には対応するトランスクリプトの video_id をそのまま入れてください。
+    """
+
+def build_batch_prompt(items: List[Tuple[str, str]]) -> str:
+    """複数動画 (動画ID, トランスクリプト) をまとめて分析するプロンプト (リクエストごとに変わる部分) を組み立てる"""
+    return "\n".join(
+        f"""
+    --- トランスクリプト (video_id: {video_id}) ---
+    {transcript}
+    """
+        for video_id, transcript in items
+    )
+
+# 用途ごとの固定の指示文とレスポンススキーマ (モデルはこの単位で1回だけ生成する)
+GEMINI_TASKS: Dict[str, Tuple[str, Dict]] = {
+    'route': (ROUTE_INSTRUCTION, ROUTE_RESPONSE_SCHEMA),
+    'candidate': (CANDIDATE_INSTRUCTION, ROUTE_CANDIDATE_SCHEMA),
+    'reduce': (REDUCE_INSTRUCTION, ROUTE_RESPONSE_SCHEMA),
+    'batch': (BATCH_INSTRUCTION, BATCH_RESPONSE_SCHEMA),
+}
+
+def pack_batches(items: List[Tuple[str, str]], max_tokens: int, max_videos: int) -> List[List[Tuple[str, str]]]:
+    """(動画ID, トランスクリプト) を、トークン上限と本数上限に収まるよう順番に詰める"""
+    batches = []
+    current: List[Tuple[str, str]] = []
+    current_tokens = 0
+
+    for video_id, transcript in items:
+        tokens = estimate_tokens(transcript)
+        if current and (current_tokens + tokens > max_tokens or len(current) >= max_videos):
+            batches.append(current)
+            current, current_tokens = [], 0
+        current.append((video_id, transcript))
+        current_tokens += tokens
+
+    if current:
+        batches.append(current)
+    return batches
+
+def analyze_routes_batch(items: List[Tuple[str, str]]) -> Dict[str, Dict[str, List[str]]]:
+    """複数動画を1回のリクエストで分析し、動画ID→分析結果を返す
+
+    レスポンスに含まれなかった動画、形式が不正だった動画は結果に含めない
+    (呼び出し側で1本ずつの分析にフォールバックする)。
+    """
+    model_name = GEMINI_MODEL_TIERS[0]
+    started = time.perf_counter()
+    if len(items) == 1:
+        video_id, transcript = items[0]
+        analysis_result = analyze_route_with_gemini(transcript, video_id, model_name)
+        return {video_id: dict(analysis_result, tiers=[tier_entry(model_name, time.perf_counter() - started, analysis_result)])}
+
+    try:
+        results, _usage = generate_json(
+            build_batch_prompt(items), 'batch', (), [video_id for video_id, _transcript in items], model_name
+        )
+    except Exception as e:
+        print(f"  > Error: Gemini batch call failed ({len(items)} videos). {e}")
+        return {}
+
+    requested = {video_id for video_id, _transcript in items}
+    analyzed = {}
+    for item in results if isinstance(results, list) else []:
+        if not isinstance(item, dict) or item.get('video_id') not in requested:
+            continue
+        if 'start' in item and 'end' in item and 'waypoints' in item:
+            analyzed[item['video_id']] = {'start': item['start'], 'end': item['end'], 'waypoints': item['waypoints']}
+
+    # 所要時間はバッチ内の動画で均等に割り振る
+    seconds = (time.perf_counter() - started) / len(items)
+    return {
+        video_id: dict(analysis_result, tiers=[tier_entry(model_name, seconds, analysis_result)])
+        for video_id, analysis_result in analyzed.items()
+    }
+
+
+def build_write_data(analysis_result: Dict[str, List[str]]) -> List[str]:
+    """分析結果をM列からX列までの書き込みデータ(12セル)に整形する"""
+    start_point = analysis_result.get('start', '')
+    end_point = analysis_result.get('end', '')
+    waypoints = analysis_result.get('waypoints', [])
+
+    write_data = [start_point]  # M列 (出発地点)
+
+    # N列(経由地1)からW列(経由地10)までを準備
+    for i in range(10):
+        if i < len(waypoints):
+            write_data.append(waypoints[i])
+        else:
+            write_data.append("") # 10個に満たない場合は空欄
+
+    write_data.append(end_point) # X列 (終着地点)
+    if ROUTE_DISTANCE == 'on':
+        write_data.extend(distance_cells(analysis_result.get('distance')))  # ROUTE_DISTANCE_COLUMNS (走行距離)
+    return write_data
+
+
+def collect_row_tasks(sheet_rows: List[Tuple[int, str, str]]) -> List[Tuple[int, str]]:
+    """未分析の行を (シート行番号, URL) のリストとして抽出する"""
+    row_tasks = []
+
+    for sheet_row_number, url, current_start in sheet_rows:
+        url = url.strip()
+        current_start = current_start.strip()
+
+        if not url:
+            print(f"Skipping row {sheet_row_number}: URL is empty.")
+            count_unsharded_skip('empty_url')
+            continue
+
+        if current_start:
+            print(f"Skipping row {sheet_row_number}: Already analyzed (Start point exists).")
+            count_unsharded_skip('already_analyzed')
+            continue
+
+        row_tasks.append((sheet_row_number, url))
+
+    return row_tasks
+
+
+def read_sheet_rows(sheet) -> List[Tuple[int, str, str]]:
+    """シートから (シート行番号, URL, 出発地点) のリストを読み込む"""
+    if SHEET_READ_MODE == 'full':
+        # 全データを取得し、ヘッダー行(1行目)をスキップ
+        return rows_from_all_values(sheet.get_all_values(), URL_COLUMN_INDEX, START_COLUMN_INDEX)
+
+    # E列とM列だけを取得する
+    return read_url_and_start_columns(sheet, URL_COLUMN_INDEX, START_COLUMN_INDEX)
+
+
+def log_analysis(sheet_row_number: int, analysis_result: Dict[str, List[str]]) -> None:
+    """分析結果の概要を出力する"""
+    start_point = analysis_result.get('start', '')
+    end_point = analysis_result.get('end', '')
+    waypoints = analysis_result.get('waypoints', [])
+    print(f"  > [row {sheet_row_number}] Analyzed: Start='{start_point}', End='{end_point}', Waypoints={len(waypoints)}")
+
+
+def shard_of(video_id: str, shard_count: int) -> int:
+    """動画IDの担当シャード番号 (実行やPythonのハッシュシードによらず決まる)"""
+    digest = hashlib.sha256(video_id.encode('utf-8')).digest()
+    return int.from_bytes(digest[:8], 'big') % shard_count
+
+def count_unsharded_skip(reason: str) -> None:
+    """動画IDで振り分ける前に飛ばした行は shard 0 だけが数える (全シャードの合計が重複しないように)"""
+    if SHARD_INDEX == 0:
+        run_report.count_skip(reason)
+
+_lease_store = None
+
+def get_lease_store():
+    """作業リースのストアを初回利用時に生成して返す (LEASE_BACKEND=off の場合はNone)"""
+    global _lease_store
+    with _client_lock:
+        if _lease_store is None and LEASE_BACKEND != 'off':
+            _lease_store = open_lease_store(LEASE_BACKEND, os.path.join(CACHE_DIR, 'leases.sqlite3'), LEASE_REDIS_URL)
+    return _lease_store
+
+def claim_video_tasks(video_tasks: List[Tuple[str, List[int]]]) -> List[Tuple[str, List[int]]]:
+    """分析を始める直前に動画のリースを取り、取れた動画だけを返す
+
+    他の実行がリース中の動画は飛ばす (期限切れのリースは取り直せる)。
+    成功した動画のリースは解放せず期限切れに任せる。書き込み前に解放すると、
+    シートを先に読んだ別の実行が同じ動画を分析し直してしまうため。
+    失敗した動画は release_video_tasks() で解放し、他の実行がすぐに取り直せるようにする。
+    """
+    store = get_lease_store()
+    if store is None or not video_tasks:
+        return video_tasks
+
+    claimed = set(store.claim([video_id for video_id, _rows in video_tasks], LEASE_OWNER, LEASE_TTL_SECONDS))
+    result = []
+    for video_id, sheet_row_numbers in video_tasks:
+        if video_id in claimed:
+            result.append((video_id, sheet_row_numbers))
+        else:
+            print(f"Skipping video {video_id} ({format_rows(sheet_row_numbers)}): claimed by another run.")
+            run_report.count_skip('claimed_elsewhere', len(sheet_row_numbers))
+    return result
+
+def release_video_tasks(video_ids: List[str]) -> None:
+    """分析に失敗した動画 (トランスクリプトなし・空の分析結果) のリースを手放す (失敗しても処理は止めない)"""
+    store = get_lease_store()
+    if store is None or not video_ids:
+        return
+    try:
+        store.release(video_ids, LEASE_OWNER)
+    except Exception as e:
+        print(f"  > Warning: Could not release leases for {len(video_ids)} videos. {e}")
+
+def plan_video_tasks(row_tasks: List[Tuple[int, str]]) -> List[Tuple[str, List[int]]]:
+    """未分析の行を正規化した動画IDごとにまとめ、(動画ID, シート行番号のリスト) のリストにする
+
+    短縮URLと通常のURL、別チャンネルへの重複掲載などで同じ動画が複数行にあっても、
+    取得と分析は1回で済み、結果は該当する全行へ書き込む。順序は各動画が最初に現れた行の順。
+    動画IDを取り出せない行、他のシャードが担当する動画、トランスクリプト取得の失敗記録があり
+    再確認の時刻前の動画はここで除外する (ネットワークにはアクセスしない)。
+    同じ動画の行は必ず同じシャードに入るため、シャード間で書き込み範囲は重ならない。
+    """
+    with run_report.span('video_id') as span:
+        span.chars_in = sum(len(url) for _row, url in row_tasks)
+        video_ids = parse_video_ids(url for _row, url in row_tasks)
+
+    rows_by_video: Dict[str, List[int]] = {}
+    for (sheet_row_number, url), video_id in zip(row_tasks, video_ids):
+        if not video_id:
+            print(f"Skipping row {sheet_row_number}: Invalid YouTube URL format. ({url})")
+            count_unsharded_skip('invalid_video_id')
+            continue
+        rows_by_video.setdefault(video_id, []).append(sheet_row_number)
+
+    if SHARD_COUNT > 1:
+        total_videos = len(rows_by_video)
+        rows_by_video = {
+            video_id: sheet_row_numbers
+            for video_id, sheet_row_numbers in rows_by_video.items()
+            if shard_of(video_id, SHARD_COUNT) == SHARD_INDEX
+        }
+        print(f"Shard {SHARD_INDEX}/{SHARD_COUNT}: {len(rows_by_video)} of {total_videos} pending videos.")
+
+    video_tasks = []
+    for video_id, sheet_row_numbers in rows_by_video.items():
+        failure = known_transcript_failure(video_id)
+        if failure is not None:
+            recheck = time.strftime('%Y-%m-%d %H:%M', time.localtime(failure['recheck_after']))
+            print(
+                f"Skipping video {video_id} ({format_rows(sheet_row_numbers)}): transcript unavailable "
+                f"({failure['failure']}, {failure['failures']} failures), next check after {recheck}."
+            )
+            run_report.count_skip('transcript_negative_cached', len(sheet_row_numbers))
+            continue
+        video_tasks.append((video_id, sheet_row_numbers))
+    return video_tasks
+
+
+def format_rows(sheet_row_numbers: List[int]) -> str:
+    """ログ用に行番号を並べる (例: 'row 5' / 'rows 5, 12')"""
+    label = 'row' if len(sheet_row_numbers) == 1 else 'rows'
+    return f"{label} {', '.join(str(row) for row in sheet_row_numbers)}"
+
+
+_journal: Optional[AnalysisJournal] = None
+
+def get_journal() -> Optional[AnalysisJournal]:
+    """分析結果のジャーナルを返す (ANALYSIS_JOURNAL=off の場合はNone)"""
+    global _journal
+    if ANALYSIS_JOURNAL == 'off':
+        return None
+    if _journal is None:
+        # シャードの番号と数をファイル名に含める。シャード数を変えると動画の担当が変わるため、
+        # 別の分け方で書かれたジャーナルは使わずに削除する (該当する行は分析し直す)
+        path = os.path.join(CACHE_DIR, f'analysis_journal.shard{SHARD_INDEX}of{SHARD_COUNT}.jsonl')
+        for stale_path in glob.glob(os.path.join(CACHE_DIR, 'analysis_journal.shard*.jsonl')):
+            if not stale_path.endswith(f'of{SHARD_COUNT}.jsonl'):
+                print(f"Discarding journal written with a different shard layout: {stale_path}")
+                os.remove(stale_path)
+        _journal = AnalysisJournal(path)
+    return _journal
+
+
+def writer_range(writer: SheetWriter) -> str:
+    """ライターの書き込み先の列範囲 (例: 'M:X'、離れた列もあれば 'M:X,AA:AB')。ジャーナルの各行に記録する"""
+    return ",".join(f"{start}:{end}" for start, end in [(writer.start_column, writer.end_column), *writer.extra_columns])
+
+
+def fit_journal_row(entry: Dict, writer: SheetWriter) -> Optional[List[Any]]:
+    """ジャーナルの1行を、今回のライターの列範囲に合わせた書き込みデータにする (合わせられなければNone)
+
+    ROUTE_DISTANCE の切り替え等で列範囲が変わっていても、M列から始まる記録なら
+    今回の幅に切り詰めるか空欄で埋める (範囲の幅と値の数が合わない行は、batch_update 全体を失敗させるため)。
+    範囲を記録していない古い行は、M列から始まるものとみなす。
+    """
+    recorded_start = (entry.get('range') or column_letter(START_COLUMN_INDEX)).split(':')[0]
+    if recorded_start != writer.start_column:
+        return None
+    width = len(build_write_data({}))
+    write_data = list(entry['write_data'][:width])
+    return write_data + [""] * (width - len(write_data))
+
+
+def replay_journal(row_tasks: List[Tuple[int, str]], writer: SheetWriter) -> Tuple[List[Tuple[int, str]], int]:
+    """前回の実行で分析済みだが未書き込みの行を、ジャーナルからライターへ渡す
+
+    分析結果は動画で決まるため、動画IDで照合する (行の並べ替えや差し替え、同じ動画の別の行にも対応)。
+    全セルが空の記録 (分析に失敗した動画)、他のシャードが担当する動画の記録、
+    今回の列範囲に合わせられない記録 (fit_journal_row) は使わず、その行は分析し直す。
+    (残りの行, ジャーナルから書き込んだ行数) を返す。
+    """
+    journal = get_journal()
+    if journal is None or not row_tasks:
+        return row_tasks, 0
+    write_data_by_video = {}
+    for _row, entry in sorted(journal.replay().items()):
+        if not any(entry['write_data']) or shard_of(entry['video_id'], SHARD_COUNT) != SHARD_INDEX:
+            continue
+        write_data = fit_journal_row(entry, writer)
+        if write_data is not None:
+            write_data_by_video[entry['video_id']] = write_data
+    if not write_data_by_video:
+        return row_tasks, 0
+
+    remaining = []
+    replayed = 0
+    for (sheet_row_number, url), video_id in zip(row_tasks, parse_video_ids(url for _row, url in row_tasks)):
+        if video_id is not None and video_id in write_data_by_video:
+            writer.add(sheet_row_number, write_data_by_video[video_id])
+            replayed += 1
+        else:
+            remaining.append((sheet_row_number, url))
+
+    if replayed:
+        print(f"Recovered {replayed} analyzed rows from the journal (no API calls needed).")
+    return remaining, replayed
+
+
+def write_results(
+    writer: SheetWriter,
+    video_id: str,
+    sheet_row_numbers: List[int],
+    analysis_result: Dict[str, List[str]],
+) -> int:
+    """1動画分の分析結果をジャーナルに記録し、該当する全行へ書き込む。書き込んだ行数を返す
+
+    全セルが空の結果 (Geminiの呼び出しに失敗した等) はジャーナルに記録せず、動画のリースも手放す
+    (次回の実行や他の実行で分析し直すため)。
+    """
+    if (GAZETTEER_NORMALIZE == 'on' or ROUTE_DISTANCE == 'on') and 'places' not in analysis_result:
+        normalized = normalize_route(analysis_result, video_id)
+        # GAZETTEER_NORMALIZE=off でも、距離の推定には地点の対応付けだけ使う
+        analysis_result = normalized if GAZETTEER_NORMALIZE == 'on' else dict(analysis_result, places=normalized['places'])
+    if ROUTE_DISTANCE == 'on' and 'distance' not in analysis_result:
+        analysis_result = estimate_route_distance(analysis_result, video_id)
+        run_report.record_distance(video_id, sheet_row_numbers, analysis_result['distance'])
+    write_data = build_write_data(analysis_result)
+    if analysis_result.get('places'):
+        run_report.record_places(video_id, sheet_row_numbers, analysis_result['places'])
+    if analysis_result.get('mentions'):
+        run_report.record_mentions(video_id, sheet_row_numbers, analysis_result['mentions'])
+    for mention in analysis_result.get('mentions', []):
+        print(f"  > [video {video_id}] {format_timestamp(mention['seconds'])} {mention['place']} {mention['url'] or ''}".rstrip())
+    if analysis_result.get('tiers'):
+        run_report.record_tiers(video_id, sheet_row_numbers, analysis_result['tiers'])
+    if any(write_data):
+        journal = get_journal()
+    else:
+        journal = None
+        release_video_tasks([video_id])
+    for sheet_row_number in sheet_row_numbers:
+        if journal is not None:
+            journal.append(sheet_row_number, video_id, write_data, writer_range(writer))
+        log_analysis(sheet_row_number, analysis_result)
+        writer.add(sheet_row_number, write_data)
+    return len(sheet_row_numbers)
+
+
+def process_video(video_id: str, sheet_row_numbers: List[int]) -> Optional[Dict[str, List[str]]]:
+    """1動画分の処理 (トランスクリプト取得→Gemini分析) を逐次実行する"""
+    print(f"\nProcessing video {video_id} ({format_rows(sheet_row_numbers)})")
+
+    # 1. トランスクリプトの取得
+    transcript = get_transcript(video_id)
+    if transcript is None:
+        print("  > Skipping: Could not retrieve transcript.")
+        run_report.count_skip('transcript_missing', len(sheet_row_numbers))
+        return None
+
+    # 2. Geminiによるルート分析 (ルートに無関係な部分は事前に落とす)
+    return analyze_route(prefilter_transcript(video_id, transcript), video_id)
+
+
+def run_sequential(video_tasks: List[Tuple[str, List[int]]], writer: SheetWriter) -> int:
+    """従来どおり1動画ずつ処理し、結果をライターへ渡す。分析した行数を返す"""
+    analyzed = 0
+    for video_id, sheet_row_numbers in video_tasks:
+        if not claim_video_tasks([(video_id, sheet_row_numbers)]):
+            continue
+        analysis_result = process_video(video_id, sheet_row_numbers)
+        if analysis_result is None:
+            release_video_tasks([video_id])
+            continue
+        analyzed += write_results(writer, video_id, sheet_row_numbers, analysis_result)
+    return analyzed
+
+
+async def process_video_async(
+    video_id: str,
+    sheet_row_numbers: List[int],
+    writer: SheetWriter,
+    transcript_semaphore: asyncio.Semaphore,
+    gemini_semaphore: asyncio.Semaphore,
+) -> int:
+    """1動画分の処理を非同期に実行する (ステージごとに同時実行数を制限)。書き込んだ行数を返す"""
+    # 1. トランスクリプトの取得 (ブロッキングI/Oはスレッドに逃がす)
+    async with transcript_semaphore:
+        if not await asyncio.to_thread(claim_video_tasks, [(video_id, sheet_row_numbers)]):
+            return 0
+        print(f"Processing video {video_id} ({format_rows(sheet_row_numbers)})")
+        transcript = await asyncio.to_thread(get_transcript, video_id)
+    if transcript is None:
+        print(f"  > [video {video_id}] Skipping: Could not retrieve transcript.")
+        run_report.count_skip('transcript_missing', len(sheet_row_numbers))
+        await asyncio.to_thread(release_video_tasks, [video_id])
+        return 0
+
+    # 2. Geminiによるルート分析 (事前絞り込みも全文を走査するため、イベントループではなくスレッドで実行する)
+    async with gemini_semaphore:
+        analysis_result = await asyncio.to_thread(
+            lambda: analyze_route(prefilter_transcript(video_id, transcript), video_id)
+        )
+
+    # 3. 結果をライターへ渡す (書き込みが発生し得るためスレッドで実行)
+    return await asyncio.to_thread(write_results, writer, video_id, sheet_row_numbers, analysis_result)
+
+
+async def run_pipeline_async(video_tasks: List[Tuple[str, List[int]]], writer: SheetWriter) -> int:
+    """トランスクリプト取得とGemini分析を並行実行する。分析した行数を返す"""
+    transcript_semaphore = asyncio.Semaphore(TRANSCRIPT_CONCURRENCY)
+    gemini_semaphore = asyncio.Semaphore(GEMINI_CONCURRENCY)
+
+    # 両ステージとライターが同時に埋まってもスレッド不足で詰まらないようにする
+    loop = asyncio.get_running_loop()
+    executor = ThreadPoolExecutor(max_workers=TRANSCRIPT_CONCURRENCY + GEMINI_CONCURRENCY + 1)
+    loop.set_default_executor(executor)
+
+    try:
+        results = await asyncio.gather(*[
+            process_video_async(video_id, sheet_row_numbers, writer, transcript_semaphore, gemini_semaphore)
+            for video_id, sheet_row_numbers in video_tasks
+        ])
+    finally:
+        executor.shutdown(wait=True)
+
+    return sum(results)
+
+
+def run_batched(video_tasks: List[Tuple[str, List[int]]], writer: SheetWriter) -> int:
+    """短いトランスクリプトを複数まとめてGeminiに送るモード。分析した行数を返す
+
+    動画を BATCH_PLANNING_ROWS 件ずつ区切り、トランスクリプト取得→バッチ分析→書き込みを繰り返す。
+    長いトランスクリプトとバッチ応答から漏れた動画は、1本ずつ分析する。
+    """
+    analyzed = 0
+
+    for offset in range(0, len(video_tasks), BATCH_PLANNING_ROWS):
+        rows_by_video = dict(claim_video_tasks(video_tasks[offset:offset + BATCH_PLANNING_ROWS]))
+
+        # 1. トランスクリプトを並行取得
+        video_ids = list(rows_by_video)
+        with ThreadPoolExecutor(max_workers=TRANSCRIPT_CONCURRENCY) as pool:
+            fetched = list(pool.map(get_transcript, video_ids))
+
+        transcripts = {}
+        for video_id, transcript in zip(video_ids, fetched):
+            if transcript is None:
+                print(f"  > [video {video_id}] Skipping: Could not retrieve transcript.")
+                run_report.count_skip('transcript_missing', len(rows_by_video[video_id]))
+                continue
+            transcripts[video_id] = prefilter_transcript(video_id, transcript)
+        release_video_tasks([video_id for video_id in video_ids if video_id not in transcripts])
+
+        # 2. ルールベースで確定できた動画はGeminiに送らない。残りの短いものはまとめて、長いものは個別に分析する
+        rules_results: Dict[str, Dict[str, List[str]]] = {}
+        rules_attempts: Dict[str, Tuple[Dict[str, List[str]], Dict]] = {}
+        short_items = []
+        long_video_ids = []
+        for video_id, transcript in transcripts.items():
+            if ROUTE_RULES == 'on':
+                rules_attempts[video_id] = analyze_route_rules(transcript, video_id)
+                rules_result, entry = rules_attempts[video_id]
+                if entry['reason'] is None and not rules_audit_sampled(video_id):
+                    rules_results[video_id] = annotate_mentions(transcript, dict(rules_result, tiers=[entry]), video_id)
+                    continue
+            if estimate_tokens(transcript.text) <= GEMINI_BATCH_SHORT_TOKENS:
+                short_items.append((video_id, transcript.text))
+            else:
+                long_video_ids.append(video_id)
+
+        batches = pack_batches(short_items, GEMINI_BATCH_MAX_TOKENS, GEMINI_BATCH_MAX_VIDEOS)
+        print(
+            f"Batch planning: {len(rules_results)} resolved by rules, {len(short_items)} short videos in {len(batches)} requests, "
+            f"{len(long_video_ids)} analyzed individually."
+        )
+
+        with ThreadPoolExecutor(max_workers=GEMINI_CONCURRENCY) as pool:
+            results: Dict[str, Dict[str, List[str]]] = {}
+            for batch_results in pool.map(analyze_routes_batch, batches):
+                for video_id, analysis_result in batch_results.items():
+                    results[video_id] = annotate_mentions(transcripts[video_id], analysis_result, video_id)
+
+            # バッチ応答から漏れた動画は1本ずつのリクエストにフォールバックする
+            missing = [video_id for video_id, _transcript in short_items if video_id not in results]
+            if missing:
+                print(f"  > Batch fallback: {len(missing)} videos missing from batch responses.")
+            individual = long_video_ids + missing
+            for video_id, analysis_result in zip(
+                individual, pool.map(lambda v: analyze_route(transcripts[v], v, rules=False), individual)
+            ):
+                results[video_id] = analysis_result
+
+            # 最初のティアで不十分だったバッチ結果は、次のティアから1本ずつ分析し直す
+            escalated = [
+                video_id for video_id, analysis_result in results.items()
+                if video_id not in individual and analysis_result['tiers'][-1]['reason'] is not None
+            ] if len(GEMINI_MODEL_TIERS) > 1 else []
+            if escalated:
+                print(f"  > Batch escalation: {len(escalated)} videos to {GEMINI_MODEL_TIERS[1]}.")
+            for video_id, analysis_result in zip(
+                escalated, pool.map(lambda v: analyze_route(transcripts[v], v, GEMINI_MODEL_TIERS[1:], rules=False), escalated)
+            ):
+                results[video_id] = dict(analysis_result, tiers=results[video_id]['tiers'] + analysis_result['tiers'])
+
+        # ルールベースで試した動画は、その記録を先頭に付ける (確定できていた動画はGeminiとの一致度を記録し、
+        # 書き込むのはルールベースの結果のまま)
+        for video_id, (rules_result, entry) in rules_attempts.items():
+            if video_id in results:
+                if entry['reason'] is None:
+                    record_rules_audit(video_id, rules_result, results[video_id])
+                    results[video_id] = annotate_mentions(transcripts[video_id], dict(rules_result, tiers=[entry]), video_id)
+                else:
+                    results[video_id] = dict(results[video_id], tiers=[entry] + results[video_id]['tiers'])
+        results.update(rules_results)
+
+        # 3. 結果を該当する全行へ展開して書き込む
+        for video_id, analysis_result in results.items():
+            analyzed += write_results(writer, video_id, rows_by_video[video_id], analysis_result)
+
+    return analyzed
+
+
+def export_metrics(run_counts: Dict[str, int]) -> None:
+    """実行結果のメトリクスを textfile / Pushgateway へ出力する (失敗しても処理は止めない)"""
+    if not METRICS_TEXTFILE and not METRICS_PUSHGATEWAY_URL:
+        return
+
+    body = render_metrics(build_metric_families(run_report, run_counts))
+    if METRICS_TEXTFILE:
+        try:
+            write_textfile(METRICS_TEXTFILE, body)
+            print(f"Metrics written to {METRICS_TEXTFILE}")
+        except OSError as e:
+            print(f"  > Error: Could not write metrics textfile. {e}")
+    if METRICS_PUSHGATEWAY_URL:
+        try:
+            # シャードごとに別グループとして送り、互いに上書きしないようにする
+            grouping = {'shard': str(SHARD_INDEX)} if SHARD_COUNT > 1 else None
+            status = push_to_gateway(METRICS_PUSHGATEWAY_URL, body, job=METRICS_JOB, grouping=grouping)
+            print(f"Metrics pushed to {METRICS_PUSHGATEWAY_URL} (HTTP {status})")
+        except Exception as e:
+            print(f"  > Error: Could not push metrics. {e}")
+
+
+# モジュール読み込み(依存ライブラリのimportを含む)にかかった時間
+startup_timings['module_import'] = time.perf_counter() - _IMPORT_STARTED
+
+
 def main():
     """メイン処理"""
     print("--- YouTube Route Analyzer Start ---")
+    writer = None
+    run_counts: Dict[str, int] = {}
+
+    try:
+        gc = get_gspread_client()
+    except Exception as e:
+        print(f"API Client Initialization Error: {e}")
+        exit(1)
 
     try:
         # gspreadクライアントでスプレッドシートを開く (open_by_key()を使用)
+        started = time.perf_counter()
         sheet = gc.open_by_key(SPREADSHEET_ID).sheet1
+
+        distance_range = None
+        if ROUTE_DISTANCE == 'on' or PIPELINE_MODE == 'distance_backfill':
+            # 他の用途に使われている列へ距離を上書きしないよう、書き込みを始める前に確かめる
+            try:
+                check_distance_columns(sheet)
+            except ValueError as e:
+                print(f"Configuration Error: {e}")
+                exit(1)
+            distance_range = (column_letter(DISTANCE_COLUMN_INDICES[0]), column_letter(DISTANCE_COLUMN_INDICES[-1]))
+        distance_adjacent = ROUTE_DISTANCE == 'on' and DISTANCE_COLUMN_INDICES[0] == END_COLUMN_INDEX + 1
+
+        if PIPELINE_MODE == 'distance_backfill':
+            # 走行距離の列だけを書き込む (トランスクリプト取得・Gemini分析は行わない)
+            writer = SheetWriter(
+                sheet,
+                flush_every=SHEET_FLUSH_EVERY,
+                flush_interval=SHEET_FLUSH_SECONDS,
+                write_limiter=sheets_limiter,
+                report=run_report,
+                max_retries=API_MAX_RETRIES,
+                start_column=distance_range[0],
+                end_column=distance_range[1],
+            )
+            run_counts['rows_distance'] = backfill_distances(sheet, writer)
+            writer.close()
+            print(f"Backfilled distances for {run_counts['rows_distance']} rows. {writer.stats()}")
+            return
         
-        # 全データを取得し、ヘッダー行(1行目)をスキップ
-        all_data = sheet.get_all_values()
-        data_rows = all_data[1:]
-        
-        print(f"Found {len(data_rows)} data rows to process.")
-        
-        updates = []
+        with run_report.span('sheet_read') as span:
+            sheet_rows = read_sheet_rows(sheet)
+            span.chars_out = sum(len(url) + len(current_start) for _row, url, current_start in sheet_rows)
+        startup_timings['sheet_read'] = time.perf_counter() - started
         
-        for row_index, row in enumerate(data_rows):
-            sheet_row_number = row_index + 2
-            
-            url = row[URL_COLUMN_INDEX].strip() if len(row) > URL_COLUMN_INDEX else ""
-            current_start = row[START_COLUMN_INDEX].strip() if len(row) > START_COLUMN_INDEX else ""
+        print(f"Found {len(sheet_rows)} data rows to process.")
 
-            if not url:
-                print(f"Skipping row {sheet_row_number}: URL is empty.")
-                continue
+        row_tasks = collect_row_tasks(sheet_rows)
+        run_counts['rows_read'] = len(sheet_rows)
+        run_counts['rows_to_analyze'] = len(row_tasks)
 
-            if current_start:
-                print(f"Skipping row {sheet_row_number}: Already analyzed (Start point exists).")
-                continue
+        # 分析結果はN件またはT秒ごとに逐次書き込む (途中で落ちても書き込み済みの結果は残る)
+        writer = SheetWriter(
+            sheet,
+            flush_every=SHEET_FLUSH_EVERY,
+            flush_interval=SHEET_FLUSH_SECONDS,
+            write_limiter=sheets_limiter,
+            report=run_report,
+            max_retries=API_MAX_RETRIES,
+            end_column=column_letter(DISTANCE_COLUMN_INDICES[-1] if distance_adjacent else END_COLUMN_INDEX),
+            # 走行距離の列がX列の隣でなければ、間の列に触れないよう別の範囲として書き込む
+            extra_columns=[distance_range] if ROUTE_DISTANCE == 'on' and not distance_adjacent else [],
+        )
 
-            print(f"\nProcessing row {sheet_row_number}: {url}")
-            
-            video_id = get_video_id(url)
-            if not video_id:
-                print("  > Error: Invalid YouTube URL format.")
-                continue
+        # 前回落ちた実行の分析結果は、APIを呼ばずにそのまま書き込む
+        row_tasks, run_counts['rows_replayed'] = replay_journal(row_tasks, writer)
 
-            # 1. トランスクリプトの取得
-            transcript = get_transcript(video_id)
-            if not transcript:
-                print("  > Skipping: Could not retrieve transcript.")
-                continue
+        video_tasks = plan_video_tasks(row_tasks)
+        run_counts['unique_videos'] = len(video_tasks)
+        # 同じ動画の重複行はトランスクリプト取得・分析を1回に減らせる
+        run_counts['duplicate_rows'] = sum(len(rows) - 1 for _video_id, rows in video_tasks)
+        if run_counts['duplicate_rows']:
+            print(
+                f"Deduplicated {run_counts['duplicate_rows']} rows sharing a video ID "
+                f"({len(video_tasks)} unique videos); transcript/analysis calls saved: {run_counts['duplicate_rows']}"
+            )
 
-            # 2. Geminiによるルート分析
-            analysis_result = analyze_route_with_gemini(transcript)
-            
-            # 3. 更新データの準備
-            start_point = analysis_result.get('start', '')
-            end_point = analysis_result.get('end', '')
-            waypoints = analysis_result.get('waypoints', [])
-            
-            write_data = [start_point]  # M列 (出発地点)
-            
-            # N列(経由地1)からW列(経由地10)までを準備
-            for i in range(10):
-                if i < len(waypoints):
-                    write_data.append(waypoints[i])
-                else:
-                    write_data.append("") # 10個に満たない場合は空欄
-            
-            write_data.append(end_point) # X列 (終着地点)
-            
-            # スプレッドシートへの一括書き込み用にデータを整形 (M列からX列まで)
-            range_name = f'M{sheet_row_number}:X{sheet_row_number}'
-            updates.append({
-                'range': range_name,
-                'values': [write_data]
-            })
-
-            print(f"  > Analyzed: Start='{start_point}', End='{end_point}', Waypoints={len(waypoints)}")
-
-        # 4. スプレッドシートへの一括更新
-        if updates:
-            print(f"\nApplying {len(updates)} updates to the spreadsheet...")
-            sheet.batch_update(updates)
-            print("Successfully updated the spreadsheet.")
+        if GEMINI_BATCH_MODE == "on":
+            print(f"Pipeline mode: batch (max {GEMINI_BATCH_MAX_VIDEOS} videos / {GEMINI_BATCH_MAX_TOKENS} tokens per request)")
+            analyzed = run_batched(video_tasks, writer)
+        elif PIPELINE_MODE == "async":
+            print(f"Pipeline mode: async (transcript={TRANSCRIPT_CONCURRENCY}, gemini={GEMINI_CONCURRENCY})")
+            analyzed = asyncio.run(run_pipeline_async(video_tasks, writer))
+        else:
+            analyzed = run_sequential(video_tasks, writer)
+        run_counts['rows_analyzed'] = analyzed
+        if ROUTE_RULES == 'on':
+            run_counts['rows_rules'] = run_report.tier_summary().get('rules', {}).get('final_rows', 0)
+            audit = run_report.agreement_summary().get('rules_vs_gemini', {}).get('overall')
+            print(
+                f"Rules extractor: {run_counts['rows_rules']}/{analyzed} rows resolved without Gemini "
+                f"({run_counts['rows_rules'] / analyzed if analyzed else 0:.1%}). "
+                f"Agreement with Gemini: {audit['mean'] if audit else 'n/a'} ({audit['count'] if audit else 0} audited videos)"
+            )
+
+        # 4. 残りの結果をスプレッドシートへ書き込む
+        if analyzed or run_counts['rows_replayed']:
+            print(f"\nApplying remaining {writer.pending_count} updates to the spreadsheet...")
+            writer.close()
+            print(f"Successfully updated the spreadsheet. {writer.stats()}")
         else:
             print("\nNo new rows needed analysis or update.")
+
+        # 全件がシートに書き込まれたので、ジャーナルは不要になる
+        if _journal is not None:
+            _journal.reset()
             
     except Exception as e:
         print(f"\nFATAL ERROR in main execution: {e}")
+        # 致命的なエラーでも、分析済みの結果はできる限り書き込んでおく
+        if writer is not None and writer.pending_count:
+            try:
+                writer.flush()
+            except Exception as flush_error:
+                print(f"  > Error: Could not save pending results. {flush_error}")
     finally:
-        # スクリプト実行後、サービスアカウントキーファイルを削除（セキュリティのため）
-        if os.path.exists('service_account_key.json'):
-            os.remove('service_account_key.json')
+        if _transcript_cache is not None:
+            print(f"Transcript cache: {_transcript_cache.stats()}")
+        if _gemini_cache is not None:
+            print(f"Gemini cache: {_gemini_cache.stats()}")
+        if _negative_cache is not None:
+            print(f"Transcript negative cache: {_negative_cache.stats()}")
+        for limiter in (youtube_limiter, gemini_limiter, sheets_limiter):
+            print(f"Rate limiter [{limiter.name}]: {limiter.stats()}")
+        print(f"Startup timing: {format_startup_timings()}")
+        print(f"Stage timing:\n{run_report.format_summary()}")
+        for tier, stats in run_report.tier_summary().items():
+            print(f"Model tier [{tier}]: {stats}")
+        if run_report.distance_summary():
+            print(f"Route distance: {run_report.distance_summary()}")
+        if RUN_REPORT_PATH:
+            try:
+                run_report.write(
+                    RUN_REPORT_PATH,
+                    mode='batch' if GEMINI_BATCH_MODE == 'on' else PIPELINE_MODE,
+                    shard={'index': SHARD_INDEX, 'count': SHARD_COUNT},
+                    rows=run_counts,
+                    startup_timings={name: round(seconds, 3) for name, seconds in startup_timings.items()},
+                    rate_limiters={limiter.name: limiter.stats() for limiter in (youtube_limiter, gemini_limiter, sheets_limiter)},
+                    sheet_writer=writer.stats() if writer is not None else None,
+                )
+                print(f"Run report written to {RUN_REPORT_PATH}")
+            except OSError as e:
+                print(f"  > Error: Could not write run report. {e}")
+        export_metrics(run_counts)
             
     print("--- YouTube Route Analyzer End ---")
 
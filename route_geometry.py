@@ -0,0 +1,176 @@
+import heapq
+import os
+from functools import lru_cache
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from gazetteer_index import Place
+
+EARTH_RADIUS_KM = 6371.0088
+
+# 距離を省略した区間 (隣り合うIC等) の、座標の大円距離に対する道のりの比
+EDGE_DETOUR_FACTOR = 1.1
+
+# ルート上の1地点 (地名辞書のID, 緯度, 経度)。対応付かなかった地点は ID・座標がNone
+RoutePoint = Tuple[Optional[str], Optional[float], Optional[float]]
+
+
+def haversine_km(lat1, lon1, lat2, lon2) -> np.ndarray:
+    """2点間の大円距離 (km)。配列を渡すとまとめて計算する (座標がNaNの組はNaN)"""
+    lat1, lon1, lat2, lon2 = (np.radians(np.asarray(values, dtype=float)) for values in (lat1, lon1, lat2, lon2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+
+def read_edges(path: str) -> Iterator[Tuple[str, str, Optional[float]]]:
+    """高速道路網の区間 (地点ID, 隣の地点ID, 距離km) を返す (# で始まる行は無視)"""
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            line = line.rstrip("\n")
+            if not line.strip() or line.startswith("#"):
+                continue
+            fields = line.split("\t")
+            km = float(fields[2]) if len(fields) > 2 and fields[2] else None
+            yield fields[0], fields[1], km
+
+
+class RouteGraph:
+    """高速道路網のグラフから、ルート (出発地点→経由地→終着地点) の総距離と区間距離を推定する (ネットワーク呼び出しなし)
+
+    隣接関係は CSR (indptr / 隣の地点 / 距離の配列) で持ち、最短経路は出発点ごとにダイクストラ法で
+    全地点への距離を一度だけ求めてキャッシュする。同じICから始まる区間は多いため、多数のルートを
+    まとめて推定するときは区間の終点を配列で引くだけになる。
+    両端がグラフ上にない区間 (ディーラー・一般道の地点等) や、グラフ上でつながっていない区間は、
+    座標の大円距離に detour_factor を掛けた値を使う。座標のない地点 (国道・辞書にない場所) は飛ばす。
+    """
+
+    def __init__(
+        self,
+        places: Dict[str, Place],
+        edges: Sequence[Tuple[str, str, Optional[float]]],
+        detour_factor: float = 1.3,
+        cache_size: int = 4096,
+    ):
+        self.places = places
+        self.detour_factor = detour_factor
+        self.nodes: List[str] = sorted({place_id for edge in edges for place_id in edge[:2] if place_id in places})
+        self._node_index = {place_id: index for index, place_id in enumerate(self.nodes)}
+
+        adjacency: List[Dict[int, float]] = [{} for _ in self.nodes]
+        for a, b, km in edges:
+            if a not in self._node_index or b not in self._node_index:
+                continue
+            if km is None:
+                km = float(haversine_km(places[a].lat, places[a].lon, places[b].lat, places[b].lon)) * EDGE_DETOUR_FACTOR
+            i, j = self._node_index[a], self._node_index[b]
+            # 同じ区間が重複していれば短い方を使う
+            adjacency[i][j] = adjacency[j][i] = min(km, adjacency[i].get(j, km))
+
+        self.indptr = np.zeros(len(self.nodes) + 1, dtype=np.int64)
+        self.indptr[1:] = np.cumsum([len(neighbors) for neighbors in adjacency])
+        self.neighbors = np.array([j for neighbors in adjacency for j in neighbors], dtype=np.int64)
+        self.weights = np.array([km for neighbors in adjacency for km in neighbors.values()], dtype=float)
+        # ダイクストラ法の内側のループはPythonのリストの方が速い
+        self._adjacency = [list(zip(self.neighbors[start:end].tolist(), self.weights[start:end].tolist()))
+                           for start, end in zip(self.indptr[:-1].tolist(), self.indptr[1:].tolist())]
+
+        self._shortest_from = lru_cache(maxsize=cache_size)(self._dijkstra)
+
+    @classmethod
+    def load(cls, path: str, places: Dict[str, Place], **kwargs) -> "RouteGraph":
+        """区間ファイルからグラフを作る (ファイルがなければ全区間を大円距離で推定する)"""
+        return cls(places, list(read_edges(path)) if os.path.exists(path) else [], **kwargs)
+
+    def _dijkstra(self, source: int) -> Tuple[np.ndarray, np.ndarray]:
+        """source から全地点への距離 (到達できなければinf) と、最短経路の1つ前の地点 (なければ-1)"""
+        distances = [float("inf")] * len(self.nodes)
+        previous = [-1] * len(self.nodes)
+        distances[source] = 0.0
+        queue = [(0.0, source)]
+        while queue:
+            distance, node = heapq.heappop(queue)
+            if distance > distances[node]:
+                continue
+            for neighbor, km in self._adjacency[node]:
+                candidate = distance + km
+                if candidate < distances[neighbor]:
+                    distances[neighbor] = candidate
+                    previous[neighbor] = node
+                    heapq.heappush(queue, (candidate, neighbor))
+        return np.array(distances), np.array(previous, dtype=np.int64)
+
+    def path(self, source_id: str, target_id: str) -> List[str]:
+        """2地点間の最短経路上の地点IDの列 (グラフ上でつながっていなければ空)"""
+        if source_id not in self._node_index or target_id not in self._node_index:
+            return []
+        source, node = self._node_index[source_id], self._node_index[target_id]
+        _distances, previous = self._shortest_from(source)
+        path = [node]
+        while node != source:
+            node = int(previous[node])
+            if node < 0:
+                return []
+            path.append(node)
+        return [self.nodes[index] for index in reversed(path)]
+
+    def _located(self, point: RoutePoint) -> bool:
+        place_id, lat, lon = point
+        return place_id in self._node_index or (lat is not None and lon is not None)
+
+    def estimate(self, routes: Sequence[Sequence[RoutePoint]], geometry: bool = False) -> List[Dict]:
+        """ルートごとに {'total_km', 'legs': [{'from', 'to', 'km', 'method'}], 'skipped'} を返す
+
+        区間は位置の分かる地点どうしを順に結ぶ ('method' は 'graph' / 'haversine')。位置の分かる地点が
+        2つ未満なら total_km はNone。geometry=True なら、経路上の座標の列 'geometry' ([[緯度, 経度], ...]) も付ける。
+        全ルートの区間を1本の配列にまとめ、グラフ上の距離は出発点ごと、大円距離は一括で計算する。
+        """
+        located = [[point for point in route if self._located(point)] for route in routes]
+        legs = [(route_index, a, b) for route_index, points in enumerate(located) for a, b in zip(points, points[1:])]
+
+        source = np.array([self._node_index.get(a[0], -1) for _route, a, _b in legs], dtype=np.int64)
+        target = np.array([self._node_index.get(b[0], -1) for _route, _a, b in legs], dtype=np.int64)
+        coordinates = np.array(
+            [[np.nan if value is None else value for value in (a[1], a[2], b[1], b[2])] for _route, a, b in legs],
+            dtype=float,
+        ).reshape(-1, 4)
+
+        graph_km = np.full(len(legs), np.inf)
+        on_graph = (source >= 0) & (target >= 0)
+        for node in np.unique(source[on_graph]).tolist():
+            selected = on_graph & (source == node)
+            graph_km[selected] = self._shortest_from(node)[0][target[selected]]
+        fallback_km = haversine_km(*coordinates.T) * self.detour_factor
+        by_graph = np.isfinite(graph_km)
+        km = np.where(by_graph, graph_km, fallback_km)
+
+        results = [{'total_km': None, 'legs': [], 'skipped': len(route) - len(points)} for route, points in zip(routes, located)]
+        for (route_index, a, b), leg_km, leg_by_graph in zip(legs, np.round(km, 1).tolist(), by_graph.tolist()):
+            if leg_km != leg_km:  # NaN: 片方がグラフ上にあるが座標がない
+                continue
+            results[route_index]['legs'].append(
+                {'from': a[0], 'to': b[0], 'km': leg_km, 'method': 'graph' if leg_by_graph else 'haversine'}
+            )
+        for result in results:
+            if result['legs']:
+                result['total_km'] = round(sum(leg['km'] for leg in result['legs']), 1)
+
+        if geometry:
+            for result, points in zip(results, located):
+                result['geometry'] = self._geometry(points)
+        return results
+
+    def _geometry(self, points: Sequence[RoutePoint]) -> List[List[float]]:
+        """位置の分かる地点を結ぶ経路上の座標の列 (グラフ上の区間は途中の地点も含める)"""
+        coordinates: List[List[float]] = []
+        for index, (place_id, lat, lon) in enumerate(points):
+            ids = [place_id]
+            if index and place_id in self._node_index and points[index - 1][0] in self._node_index:
+                ids = self.path(points[index - 1][0], place_id)[1:] or ids
+            for node_id in ids:
+                place = self.places.get(node_id) if node_id else None
+                if place is not None and place.lat is not None:
+                    coordinates.append([place.lat, place.lon])
+                elif node_id == place_id and lat is not None and lon is not None:
+                    coordinates.append([lat, lon])
+        return coordinates
@@ -0,0 +1,181 @@
+import re
+import unicodedata
+from collections import deque
+from typing import Dict, Iterator, List, Tuple
+
+from transcript_chunker import CompactTranscript, estimate_tokens
+
+# 走行ルートの手がかりになる語彙 (道路・施設・出発/到着の表現)
+# 1文字の語や日常会話にも出る語 (山・市・店・ライン・走って等) は、ほぼ全セグメントに当たって
+# 絞り込みが効かなくなるため入れない。地名の接尾辞は ROUTE_PATTERNS で前の漢字と合わせて判定する。
+# 英字の略号 (IC/SA/PA) と「高速」「スタート」も、ELECTRIC・PASSAT・高速域・エンジンスタート等に
+# 部分一致するため、ここには入れず ROUTE_PATTERNS で前後を確かめてから一致させる
+ROUTE_VOCABULARY = [
+    # 道路
+    "国道", "県道", "都道", "府道", "道道", "号線", "バイパス", "道路", "自動車道",
+    "首都高", "環状", "スカイライン", "街道", "林道", "ワインディング",
+    # インターチェンジ・ジャンクション・休憩施設
+    "インター", "JCT", "ジャンクション", "サービスエリア", "パーキングエリア",
+    "料金所", "道の駅",
+    # 地形・ランドマーク
+    "トンネル", "ダム", "海岸", "高原", "温泉", "公園",
+    # 施設
+    "ディーラー", "本社", "サーキット",
+    # 出発・到着の表現
+    "出発", "到着", "ゴール", "通過", "経由", "方面",
+]
+
+_KANJI = "\u4e00-\u9fff々ヶノ"
+# 地名の接尾辞は、2文字以上の漢字 (店は片仮名も) に続き、語がそこで終わる場合だけ一致させる
+# (三鷹市・大手町・芦ノ湖・富士山・三鷹店 には一致し、市場・区間・沢山・お店 には一致しない)
+ROUTE_PATTERNS = [
+    f"[{_KANJI}]{{2,}}(?:都|県|市|区|町|村)(?![{_KANJI}])",
+    f"[{_KANJI}]{{2,}}(?:山|峠|湖|橋|港|岬|駅)(?![{_KANJI}])",
+    f"[{_KANJI}ァ-ヴー]{{2,}}店(?![{_KANJI}])",
+    # 「〜の方へ向かう」等の方向の表現も、地名が前にある場合だけ
+    f"[{_KANJI}]{{2,}}の方[へに]",
+    # IC/SA/PA は地名に続くか、前後が英字でない単独の略号の場合だけ (ELECTRIC・CLASSIC・PASSAT・PAYMENT には一致しない)
+    f"(?:[{_KANJI}ァ-ヴー]|(?<![A-Za-z]))(?:IC|SA|PA)(?![A-Za-z])",
+    # 「東名高速」のように道路名に続くか、「高速に乗る」等の乗り降りの表現の場合だけ (高速域・高速走行には一致しない)
+    f"[{_KANJI}]{{2,}}高速(?![{_KANJI}ァ-ヴー])",
+    "高速(?:道路)?(?:に乗|に入|を降|を下|を走|を使)",
+    # 「〇〇からスタート」「スタート地点」の場合だけ (エンジンスタート・スタートボタンには一致しない)
+    f"[{_KANJI}ァ-ヴー]{{2,}}(?:から|を)スタート(?![ァ-ヴー])",
+    "スタート地点?(?:は|に|の)",
+]
+
+
+class AhoCorasick:
+    """複数パターンを1回の走査で検出する Aho-Corasick オートマトン"""
+
+    def __init__(self, patterns: List[str]):
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._output: List[List[str]] = [[]]
+
+        for pattern in patterns:
+            self._add(pattern)
+        self._build_failure_links()
+
+    def _add(self, pattern: str) -> None:
+        state = 0
+        for ch in pattern:
+            next_state = self._goto[state].get(ch)
+            if next_state is None:
+                next_state = len(self._goto)
+                self._goto[state][ch] = next_state
+                self._goto.append({})
+                self._fail.append(0)
+                self._output.append([])
+            state = next_state
+        self._output[state].append(pattern)
+
+    def _build_failure_links(self) -> None:
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for ch, next_state in self._goto[state].items():
+                queue.append(next_state)
+                fallback = self._fail[state]
+                while fallback and ch not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+                self._fail[next_state] = self._goto[fallback].get(ch, 0)
+                self._output[next_state] = self._output[next_state] + self._output[self._fail[next_state]]
+
+    def iter_matches(self, text: str) -> Iterator[Tuple[int, str]]:
+        """(一致した末尾の位置, パターン) を順に返す"""
+        state = 0
+        for position, ch in enumerate(text):
+            while state and ch not in self._goto[state]:
+                state = self._fail[state]
+            state = self._goto[state].get(ch, 0)
+            for pattern in self._output[state]:
+                yield position, pattern
+
+    def contains_any(self, text: str) -> bool:
+        """いずれかのパターンを含むかどうか"""
+        return next(self.iter_matches(text), None) is not None
+
+
+_route_automaton = None
+_route_pattern = None
+
+def get_route_automaton() -> AhoCorasick:
+    """ルート語彙のオートマトンを初回利用時に構築して返す"""
+    global _route_automaton
+    if _route_automaton is None:
+        _route_automaton = AhoCorasick(ROUTE_VOCABULARY)
+    return _route_automaton
+
+def get_route_pattern() -> "re.Pattern[str]":
+    """地名の接尾辞パターンをまとめた正規表現を初回利用時にコンパイルして返す"""
+    global _route_pattern
+    if _route_pattern is None:
+        _route_pattern = re.compile("|".join(ROUTE_PATTERNS))
+    return _route_pattern
+
+
+def is_route_text(text: str) -> bool:
+    """ルート語彙または地名の接尾辞パターンを含むかどうか (全角英数字(ＩＣ等)も検出できるようNFKC正規化してから照合する)"""
+    text = unicodedata.normalize("NFKC", text)
+    return get_route_automaton().contains_any(text) or get_route_pattern().search(text) is not None
+
+
+def _kept_indices(texts: List[str], window: int, keep_edges: int) -> Tuple[List[int], int]:
+    """ルート語彙を含むセグメントの前後 window 件と先頭・末尾 keep_edges 件の番号と、語彙を含むセグメント数"""
+    keep = [False] * len(texts)
+    hits = 0
+
+    for index, text in enumerate(texts):
+        if is_route_text(text):
+            hits += 1
+            for neighbor in range(max(0, index - window), min(len(texts), index + window + 1)):
+                keep[neighbor] = True
+
+    for index in list(range(min(keep_edges, len(texts)))) + list(range(max(0, len(texts) - keep_edges), len(texts))):
+        keep[index] = True
+
+    # 語彙が1つも見つからない場合は、取りこぼしを避けるため全セグメントを残す
+    return [index for index, flag in enumerate(keep) if flag or not hits], hits
+
+
+def _filter_stats(texts: List[str], kept_texts: List[str], hits: int) -> Dict[str, float]:
+    tokens_before = sum(estimate_tokens(text) for text in texts)
+    tokens_after = sum(estimate_tokens(text) for text in kept_texts)
+    return {
+        'segments_before': len(texts),
+        'segments_after': len(kept_texts),
+        'hits': hits,
+        'tokens_before': tokens_before,
+        'tokens_after': tokens_after,
+        'reduction': 1 - tokens_after / tokens_before if tokens_before else 0.0,
+    }
+
+
+def filter_segments(
+    segments: List[Dict],
+    window: int = 2,
+    keep_edges: int = 3,
+) -> Tuple[List[Dict], Dict[str, float]]:
+    """ルート語彙を含むセグメントの前後 window 件だけを残す
+
+    出発・到着は冒頭と末尾で語られることが多いため、先頭と末尾の keep_edges 件は常に残す。
+    語彙が1つも見つからない場合は、取りこぼしを避けるため元のセグメントをそのまま返す。
+    戻り値は (残したセグメント, 統計)。
+    """
+    texts = [item['text'] for item in segments]
+    indices, hits = _kept_indices(texts, window, keep_edges)
+    kept = [segments[index] for index in indices]
+    return kept, _filter_stats(texts, [item['text'] for item in kept], hits)
+
+
+def filter_transcript(
+    transcript: CompactTranscript,
+    window: int = 2,
+    keep_edges: int = 3,
+) -> Tuple[CompactTranscript, Dict[str, float]]:
+    """filter_segments と同じ絞り込みを CompactTranscript に対して行う (セグメントの辞書を作らない)"""
+    texts = [transcript.segment_text(index) for index in range(len(transcript))]
+    indices, hits = _kept_indices(texts, window, keep_edges)
+    kept = transcript if len(indices) == len(texts) else transcript.select(indices)
+    return kept, _filter_stats(texts, [texts[index] for index in indices], hits)
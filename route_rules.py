@@ -0,0 +1,201 @@
+import re
+import unicodedata
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from route_prefilter import AhoCorasick
+
+# 地名を構成する文字 (漢字・カタカナ・英数字)。ひらがなは助詞とみなし、地名の区切りにする
+_NAME = r"[一-鿿々〆ヵヶァ-ヺー・A-Za-z0-9]"
+# 字幕の区切り (空白) の代わりに置く文字。_NAME に含まれないため、地名が区切りをまたいで前のセグメントの語を取り込まない
+SEGMENT_BREAK = "\n"
+
+# 施設の種類を表す接尾辞 (長いものを先に並べる)
+PLACE_SUFFIXES = (
+    "スマートIC", "サービスエリア", "パーキングエリア", "ジャンクション", "インター", "IC", "JCT", "SA", "PA",
+    "料金所", "サーキット", "本社", "店", "駅", "峠", "湖", "ダム", "港", "岬", "高原", "温泉", "公園",
+)
+_SUFFIX = "|".join(re.escape(suffix) for suffix in PLACE_SUFFIXES)
+_PLACE = rf"(?P<place>道の駅{_NAME}{{1,12}}|{_NAME}{{1,16}}?(?:{_SUFFIX}))"
+# 道路の接尾辞 (「中央道」「東名高速」等)
+ROAD_SUFFIXES = ("自動車道", "有料道路", "バイパス", "スカイライン", "街道", "高速道路", "高速", "道")
+_NUMBERED_ROAD = r"(?:国道|県道|都道|府道)\d{1,3}号線?"
+_ROAD = rf"(?P<place>{_NUMBERED_ROAD}|{_NAME}{{1,12}}?(?:{'|'.join(ROAD_SUFFIXES)}))"
+# 出発・到着の表現は手がかりが強いため、接尾辞のない名前 (「ハンガーエイト」等) も地点とみなす
+_ANY_PLACE = rf"(?P<place>道の駅{_NAME}{{1,12}}|{_NAME}{{2,16}})"
+
+# 試乗動画の定型表現 (役割, パターン)。normalize_transcript を済ませたテキストに適用する
+ROUTE_TEMPLATES = [
+    ("start", _ANY_PLACE + r"(?:を|から)(?:スタート|出発)"),
+    ("start", r"(?:スタート|出発)(?:地点|地)?は" + _ANY_PLACE),
+    ("end", _ANY_PLACE + r"に(?:到着|着き|着い|着く)"),
+    ("end", _ANY_PLACE + r"(?:が|で)ゴール"),
+    ("end", r"(?:ゴール|到着)(?:地点|地)?は" + _ANY_PLACE),
+    ("waypoint", _PLACE + r"から(?:高速に)?乗(?:って|り|ります|る|った)"),
+    ("waypoint", _PLACE + r"(?:を|で)(?:降り|下り|通過|経由|過ぎ|休憩)"),
+    ("waypoint", _PLACE + r"に(?:寄|立ち寄)"),
+    ("waypoint", _ROAD + r"を(?:走|通|抜け|進)"),
+    ("waypoint", _ROAD + r"に(?:乗|入)"),
+]
+_COMPILED_TEMPLATES = [(role, re.compile(pattern)) for role, pattern in ROUTE_TEMPLATES]
+
+# 地名の前に付きがちな語 (「今日東京スバル三鷹店を…」→「東京スバル三鷹店」)
+_LEADING_WORDS = re.compile(r"^(?:今日|本日|今回|まず|最初|次|途中|最後|ここ|そして)+")
+
+# 出発・到着の表現に続くが地名ではない語 (「エンジンをスタート」「撮影をスタート」等)
+NOT_PLACE_NAMES = frozenset((
+    "エンジン", "ナビ", "カーナビ", "撮影", "録画", "動画", "配信", "試乗", "試乗会", "計測", "タイマー",
+    "ストップウォッチ", "レビュー", "チェック", "テスト", "アイドリング", "クルーズコントロール", "ACC",
+    "ドライブ", "走行", "収録", "ライブ", "カメラ", "メーター",
+))
+
+# 地名の後ろに付きがちな動作の表現 (「国道4号線を走行」→「国道4号線」)
+PLACE_ACTION_SUFFIX = re.compile(r"(?:を|に|へ|で|から|まで|の)?(?:走行|通過|到着|出発|経由|入口|出口|方面|スタート|ゴール).*$")
+
+# ディーラー店名の判定に使うメーカー名 (「東京スバル三鷹店」のように 〇〇店 と組み合わせる)
+DEALER_BRANDS = (
+    "スバル", "トヨタ", "トヨペット", "カローラ", "ネッツ", "レクサス", "日産", "ホンダ", "マツダ", "スズキ",
+    "ダイハツ", "三菱", "BMW", "メルセデス", "アウディ", "ポルシェ", "フォルクスワーゲン", "ボルボ",
+)
+
+# 地名辞書にない場所の確からしさ (施設・道路の接尾辞で終わる場合 / 出発・到着の表現だけが手がかりの場合)
+SUFFIX_ONLY_SCORE = 0.7
+NAME_ONLY_SCORE = 0.5
+
+
+def normalize_text(text: str) -> str:
+    """全角英数字 (ＩＣ等) を半角にし、字幕の区切りの空白を除く (地名どうしの比較用)"""
+    return re.sub(r"\s+", "", unicodedata.normalize("NFKC", text))
+
+
+def normalize_transcript(text: str) -> str:
+    """全角英数字を半角にし、字幕の区切りの空白を SEGMENT_BREAK にそろえる (定型表現の適用用)"""
+    return re.sub(r"\s+", SEGMENT_BREAK, unicodedata.normalize("NFKC", text))
+
+
+class Gazetteer:
+    """IC/JCT/SA/PA・ディーラー・施設などの既知の地名 (名前→種別) と、辞書にないディーラー店名の判定
+
+    名前の一覧は地名辞書の索引 (gazetteer_index.GazetteerIndex.names) から作る。
+    """
+
+    def __init__(self, entries: Dict[str, str]):
+        self.entries = {normalize_text(name): kind for name, kind in entries.items()}
+        self._automaton = AhoCorasick(list(self.entries)) if self.entries else None
+
+    def kind(self, name: str) -> Optional[str]:
+        """既知の地名なら種別を返す (辞書にない場合、メーカー名を含む 〇〇店 は 'dealer')"""
+        kind = self.entries.get(name)
+        if kind is None and name.endswith("店") and any(brand in name for brand in DEALER_BRANDS):
+            kind = "dealer"
+        return kind
+
+    def iter_mentions(self, text: str) -> Iterator[Tuple[int, str]]:
+        """text 中の既知の地名を (開始位置, 名前) で返す"""
+        if self._automaton is None:
+            return
+        for end, name in self._automaton.iter_matches(text):
+            yield end - len(name) + 1, name
+
+
+def _place_score(name: str, gazetteer: Gazetteer) -> float:
+    if gazetteer.kind(name) or re.fullmatch(_NUMBERED_ROAD, name):
+        return 1.0
+    if name.endswith(PLACE_SUFFIXES + ROAD_SUFFIXES):
+        return SUFFIX_ONLY_SCORE
+    return NAME_ONLY_SCORE
+
+
+def endpoints_verified(result: Dict[str, List[str]], gazetteer: Gazetteer) -> bool:
+    """出発地点・終着地点 (空でないもの) が辞書の地名・ディーラー店名・番号付きの道路のどれかで裏付けられているか
+
+    施設の接尾辞だけ (SUFFIX_ONLY_SCORE) や出発・到着の表現だけ (NAME_ONLY_SCORE) が手がかりの名前は、
+    前の語を取り込んだ誤った名前 (「休憩鈴鹿サーキット」等) でも同じ点数になるため、裏付けとみなさない。
+    """
+    return all(_place_score(name, gazetteer) >= 1.0 for name in (result["start"], result["end"]) if name)
+
+
+def extract_route(
+    text: str,
+    gazetteer: Gazetteer,
+    min_waypoints: int = 2,
+    max_waypoints: int = 10,
+) -> Tuple[Dict[str, List[str]], float]:
+    """定型表現と地名辞書からルートを抽出し、(結果, 確信度 0〜1) を返す
+
+    出発地点は最初の出発表現、終着地点は最後の到着表現から取る。経由地は定型表現で
+    見つかった場所と、辞書にある地名の言及を出現順に並べる (最大 max_waypoints 件)。
+    確信度は出発・終着・経由地それぞれの確からしさ (辞書にある地名は1、接尾辞だけなら
+    SUFFIX_ONLY_SCORE、名前だけなら NAME_ONLY_SCORE、見つからなければ0。
+    経由地は min_waypoints 件に満たない分を割り引く) の平均。
+    """
+    text = normalize_transcript(text)
+    starts: List[Tuple[int, str]] = []
+    ends: List[Tuple[int, str]] = []
+    mentions: List[Tuple[int, str]] = []
+
+    for role, pattern in _COMPILED_TEMPLATES:
+        for match in pattern.finditer(text):
+            name = _LEADING_WORDS.sub("", match["place"])
+            if not name or name in NOT_PLACE_NAMES:
+                continue
+            position = match.start("place")
+            if role == "start":
+                starts.append((position, name))
+            elif role == "end":
+                ends.append((position, name))
+            else:
+                mentions.append((position, name))
+    mentions.extend(gazetteer.iter_mentions(text))
+
+    start = min(starts)[1] if starts else ""
+    end = max(ends)[1] if ends else ""
+    waypoints: List[str] = []
+    for _position, name in sorted(mentions):
+        # 辞書の地名が定型表現で見つかった地名や出発・終着地点の一部 (「海老名SA」と「東名海老名SA」、
+        # 別名「東京スバル三鷹」と「東京スバル三鷹店」等) なら重複とみなす
+        if any(name in seen or seen in name for seen in [place for place in (start, end) if place] + waypoints):
+            continue
+        waypoints.append(name)
+        if len(waypoints) >= max_waypoints:
+            break
+
+    start_score = _place_score(start, gazetteer) if start else 0.0
+    end_score = _place_score(end, gazetteer) if end else 0.0
+    waypoint_score = 0.0
+    if waypoints:
+        waypoint_score = sum(_place_score(name, gazetteer) for name in waypoints) / len(waypoints)
+        waypoint_score *= min(1.0, len(waypoints) / max(1, min_waypoints))
+    confidence = round((start_score + end_score + waypoint_score) / 3, 3)
+
+    return {"start": start, "end": end, "waypoints": waypoints}, confidence
+
+
+def normalize_place(name: str) -> str:
+    """比較用に地名を正規化する (全角/空白の違いと「〜を通過」等の動作の表現を除く)"""
+    return PLACE_ACTION_SUFFIX.sub("", normalize_text(name))
+
+
+def places_agree(a: str, b: str) -> bool:
+    """2つの地名が同じ場所を指すとみなせるか (正規化後に一方が他方を含む)"""
+    a, b = normalize_place(a), normalize_place(b)
+    return bool(a and b) and (a in b or b in a)
+
+
+def route_agreement(rules_result: Dict[str, List[str]], gemini_result: Dict[str, List[str]]) -> Dict[str, float]:
+    """ルールベースの結果とGeminiの結果の一致度 (start / end は0か1、waypoints はDice係数、overall は平均)"""
+    start = float(places_agree(rules_result.get("start", ""), gemini_result.get("start", "")))
+    end = float(places_agree(rules_result.get("end", ""), gemini_result.get("end", "")))
+
+    ours = [w for w in rules_result.get("waypoints", []) if w]
+    theirs = [w for w in gemini_result.get("waypoints", []) if w]
+    unmatched = list(theirs)
+    matched = 0
+    for name in ours:
+        for index, other in enumerate(unmatched):
+            if places_agree(name, other):
+                matched += 1
+                del unmatched[index]
+                break
+    waypoints = 2 * matched / (len(ours) + len(theirs)) if ours or theirs else 1.0
+
+    return {"start": start, "end": end, "waypoints": round(waypoints, 3), "overall": round((start + end + waypoints) / 3, 3)}
@@ -0,0 +1,282 @@
+import json
+import math
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional, Sequence, Union
+
+VideoIds = Union[None, str, Sequence[str]]
+
+
+def percentile(ordered: List[float], q: float) -> float:
+    """ソート済みリストのパーセンタイル (最近傍法)"""
+    if not ordered:
+        return 0.0
+    index = min(len(ordered) - 1, max(0, math.ceil(q / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+class Span:
+    """1回の計測区間。with ブロック内で入出力の文字数・トークン数を記入する"""
+
+    __slots__ = ('chars_in', 'chars_out', 'prompt_tokens', 'output_tokens', 'cached_tokens')
+
+    def __init__(self):
+        self.chars_in = 0
+        self.chars_out = 0
+        self.prompt_tokens = 0
+        self.output_tokens = 0
+        self.cached_tokens = 0  # prompt_tokens のうちAPI側のキャッシュから読まれた分 (usage_metadata の報告値)
+
+
+class RunReport:
+    """ステージごとの所要時間・入出力量・Geminiトークン数を集計する (スレッドセーフ)
+
+    span() で囲んだ区間を記録し、to_dict() / write() で合計・パーセンタイル・
+    時間のかかった動画上位N件を含むJSONレポートにする。
+    """
+
+    def __init__(self, slowest_n: int = 10):
+        self.slowest_n = slowest_n
+        self.started_at = time.time()
+        self._started = time.perf_counter()
+        self._durations: Dict[str, List[float]] = {}
+        self._totals: Dict[str, Dict[str, int]] = {}
+        self._videos: Dict[str, Dict[str, float]] = {}
+        self._skips: Dict[str, int] = {}
+        self._tier_rows: List[Dict] = []
+        self._agreements: Dict[str, Dict[str, List[float]]] = {}
+        self._distance_rows: List[Dict] = []
+        self._mention_rows: List[Dict] = []
+        self._place_rows: List[Dict] = []
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def span(self, stage: str, video_id: VideoIds = None) -> Iterator[Span]:
+        """stage の区間を計測する。例外で抜けた場合も errors として記録する
+
+        video_id に複数の動画IDを渡すと (バッチ呼び出し)、所要時間を均等に割り振る。
+        """
+        span = Span()
+        started = time.perf_counter()
+        failed = False
+        try:
+            yield span
+        except BaseException:
+            failed = True
+            raise
+        finally:
+            self.record(stage, time.perf_counter() - started, span, video_id, failed)
+
+    def record(self, stage: str, seconds: float, span: Span, video_id: VideoIds = None, failed: bool = False) -> None:
+        if video_id is None:
+            video_ids: Sequence[str] = ()
+        elif isinstance(video_id, str):
+            video_ids = (video_id,)
+        else:
+            video_ids = video_id
+
+        with self._lock:
+            self._durations.setdefault(stage, []).append(seconds)
+            totals = self._totals.setdefault(stage, {
+                'chars_in': 0, 'chars_out': 0, 'prompt_tokens': 0, 'output_tokens': 0, 'cached_tokens': 0, 'errors': 0,
+            })
+            totals['chars_in'] += span.chars_in
+            totals['chars_out'] += span.chars_out
+            totals['prompt_tokens'] += span.prompt_tokens
+            totals['output_tokens'] += span.output_tokens
+            totals['cached_tokens'] += span.cached_tokens
+            totals['errors'] += int(failed)
+
+            for vid in video_ids:
+                stages = self._videos.setdefault(vid, {})
+                stages[stage] = stages.get(stage, 0.0) + seconds / len(video_ids)
+
+    def elapsed_seconds(self) -> float:
+        return time.perf_counter() - self._started
+
+    def count_skip(self, reason: str, rows: int = 1) -> None:
+        """分析せずに飛ばした行を理由ごとに数える"""
+        with self._lock:
+            self._skips[reason] = self._skips.get(reason, 0) + rows
+
+    def skip_counts(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(self._skips)
+
+    def record_tiers(self, video_id: str, rows: List[int], tiers: List[Dict]) -> None:
+        """1動画分のモデルティアの記録 ({'tier', 'seconds', 'reason'} の列) を該当行とともに残す"""
+        with self._lock:
+            self._tier_rows.append({'video_id': video_id, 'rows': list(rows), 'tiers': list(tiers)})
+
+    def tier_rows(self) -> List[Dict]:
+        with self._lock:
+            return list(self._tier_rows)
+
+    def tier_summary(self) -> Dict[str, Dict]:
+        """ティアごとの呼び出し数・採用数・次へ上げた数 (理由別)・所要時間のp50/p90 (ミリ秒)
+
+        件数は動画単位。行数は rows に数える (同じ動画を参照する行をまとめて1回分析するため)。
+        """
+        durations: Dict[str, List[float]] = {}
+        summary: Dict[str, Dict] = {}
+        for entry in self.tier_rows():
+            for attempt in entry['tiers']:
+                stats = summary.setdefault(attempt['tier'], {
+                    'videos': 0, 'rows': 0, 'accepted': 0, 'final': 0, 'final_rows': 0, 'escalated': {},
+                })
+                stats['videos'] += 1
+                stats['rows'] += len(entry['rows'])
+                durations.setdefault(attempt['tier'], []).append(attempt['seconds'])
+                if attempt['reason'] is None:
+                    stats['accepted'] += 1
+                elif attempt is not entry['tiers'][-1]:
+                    stats['escalated'][attempt['reason']] = stats['escalated'].get(attempt['reason'], 0) + 1
+            # 最後に試したティアの結果がシートへ書き込まれる
+            if entry['tiers']:
+                summary[entry['tiers'][-1]['tier']]['final'] += 1
+                summary[entry['tiers'][-1]['tier']]['final_rows'] += len(entry['rows'])
+
+        for tier, values in durations.items():
+            ordered = sorted(values)
+            summary[tier].update(
+                total_s=round(sum(ordered), 3),
+                p50_ms=round(percentile(ordered, 50) * 1000, 1),
+                p90_ms=round(percentile(ordered, 90) * 1000, 1),
+            )
+        return summary
+
+    def record_agreement(self, name: str, scores: Dict[str, float]) -> None:
+        """2つの分析方法の一致度 (項目→0〜1) を1件分記録する"""
+        with self._lock:
+            fields = self._agreements.setdefault(name, {})
+            for field, score in scores.items():
+                fields.setdefault(field, []).append(score)
+
+    def agreement_summary(self) -> Dict[str, Dict[str, Dict]]:
+        """一致度の名前→項目ごとの件数と平均"""
+        with self._lock:
+            return {
+                name: {field: {'count': len(values), 'mean': round(sum(values) / len(values), 3)} for field, values in fields.items()}
+                for name, fields in self._agreements.items()
+            }
+
+    def record_distance(self, video_id: Optional[str], rows: List[int], distance: Dict) -> None:
+        """1ルート分の走行距離の推定 ({'total_km', 'legs', 'skipped'} と、あれば 'geometry') を該当行とともに残す"""
+        with self._lock:
+            self._distance_rows.append({'video_id': video_id, 'rows': list(rows), **distance})
+
+    def distance_rows(self) -> List[Dict]:
+        with self._lock:
+            return list(self._distance_rows)
+
+    def distance_summary(self) -> Dict:
+        """推定したルート数・距離を出せたルート数・総距離のp50/p90 (km)・区間数 (推定方法別)"""
+        entries = self.distance_rows()
+        if not entries:
+            return {}
+        totals = sorted(entry['total_km'] for entry in entries if entry['total_km'] is not None)
+        legs: Dict[str, int] = {}
+        for entry in entries:
+            for leg in entry['legs']:
+                legs[leg['method']] = legs.get(leg['method'], 0) + 1
+        return {
+            'routes': len(entries),
+            'rows': sum(len(entry['rows']) for entry in entries),
+            'estimated': len(totals),
+            'p50_km': percentile(totals, 50),
+            'p90_km': percentile(totals, 90),
+            'legs': legs,
+            'skipped_places': sum(entry['skipped'] for entry in entries),
+        }
+
+    def record_places(self, video_id: str, rows: List[int], places: List[Dict]) -> None:
+        """1動画分の地名辞書への対応付け ({'role', 'text', 'id', 'name', 'kind', 'lat', 'lon', 'score', 'method'} の列) を該当行とともに残す"""
+        with self._lock:
+            self._place_rows.append({'video_id': video_id, 'rows': list(rows), 'places': list(places)})
+
+    def place_rows(self) -> List[Dict]:
+        with self._lock:
+            return list(self._place_rows)
+
+    def record_mentions(self, video_id: str, rows: List[int], mentions: List[Dict]) -> None:
+        """1動画分の地点の言及 ({'place', 'seconds', 'url'} の列) を該当行とともに残す"""
+        with self._lock:
+            self._mention_rows.append({'video_id': video_id, 'rows': list(rows), 'mentions': list(mentions)})
+
+    def mention_rows(self) -> List[Dict]:
+        with self._lock:
+            return list(self._mention_rows)
+
+    def stage_durations(self) -> Dict[str, List[float]]:
+        """ステージごとの所要時間 (秒) の一覧 (コピー)"""
+        with self._lock:
+            return {stage: list(values) for stage, values in self._durations.items()}
+
+    def stage_summary(self) -> Dict[str, Dict]:
+        """ステージごとの件数・合計・p50/p90/p99/最大 (ミリ秒) と入出力量"""
+        with self._lock:
+            durations = {stage: sorted(values) for stage, values in self._durations.items()}
+            totals = {stage: dict(values) for stage, values in self._totals.items()}
+
+        summary = {}
+        for stage, ordered in durations.items():
+            summary[stage] = {
+                'count': len(ordered),
+                'total_s': round(sum(ordered), 3),
+                'p50_ms': round(percentile(ordered, 50) * 1000, 1),
+                'p90_ms': round(percentile(ordered, 90) * 1000, 1),
+                'p99_ms': round(percentile(ordered, 99) * 1000, 1),
+                'max_ms': round(ordered[-1] * 1000, 1),
+                **totals[stage],
+            }
+        return summary
+
+    def slowest_videos(self) -> List[Dict]:
+        """計測区間の合計が長い動画の上位 slowest_n 件"""
+        with self._lock:
+            videos = [
+                {'video_id': vid, 'total_s': round(sum(stages.values()), 3),
+                 'stages': {stage: round(seconds, 3) for stage, seconds in stages.items()}}
+                for vid, stages in self._videos.items()
+            ]
+        videos.sort(key=lambda item: item['total_s'], reverse=True)
+        return videos[:self.slowest_n]
+
+    def to_dict(self, **extra) -> Dict:
+        """レポート全体を辞書にする (extra は最上位にそのまま追加する)"""
+        return {
+            'started_at': time.strftime('%Y-%m-%dT%H:%M:%S%z', time.localtime(self.started_at)),
+            'elapsed_s': round(self.elapsed_seconds(), 3),
+            'stages': self.stage_summary(),
+            'slowest_videos': self.slowest_videos(),
+            'skipped': self.skip_counts(),
+            'tiers': self.tier_summary(),
+            'tier_rows': self.tier_rows(),
+            'agreement': self.agreement_summary(),
+            'distance': self.distance_summary(),
+            'distance_rows': self.distance_rows(),
+            'place_rows': self.place_rows(),
+            'mention_rows': self.mention_rows(),
+            **extra,
+        }
+
+    def write(self, path: str, **extra) -> None:
+        """レポートをJSONファイルに書き出す"""
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(self.to_dict(**extra), f, ensure_ascii=False, indent=2)
+
+    def format_summary(self) -> str:
+        """ステージごとの概要を複数行の文字列にする (ログ出力用)"""
+        lines = []
+        for stage, stats in self.stage_summary().items():
+            line = (
+                f"  {stage:<12} count={stats['count']:>6}  total={stats['total_s']:9.3f}s  "
+                f"p50={stats['p50_ms']:8.1f}ms  p99={stats['p99_ms']:8.1f}ms"
+            )
+            if stats['prompt_tokens'] or stats['output_tokens']:
+                line += f"  tokens(in/out)={stats['prompt_tokens']}/{stats['output_tokens']}"
+            if stats['cached_tokens']:
+                line += f"  cached={stats['cached_tokens']}"
+            lines.append(line)
+        return "\n".join(lines)
@@ -0,0 +1,272 @@
+import threading
+import time
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from rate_limit import AdaptiveRateLimiter, call_with_backoff
+from run_report import RunReport
+
+# 書き込み対象の列 (M列からX列まで)
+WRITE_START_COLUMN = "M"
+WRITE_END_COLUMN = "X"
+
+
+def coalesce_row_updates(
+    rows: Dict[int, List[str]],
+    start_column: str = WRITE_START_COLUMN,
+    end_column: str = WRITE_END_COLUMN,
+) -> List[Dict]:
+    """行番号→書き込みデータを、連続した行ごとにまとめたbatch_update用データに変換する
+
+    例: 5, 6, 7, 10行目 → 'M5:X7'(3行分) と 'M10:X10'(1行分)
+    """
+    updates = []
+    block_start = None
+    block_values: List[List[str]] = []
+    previous = None
+
+    for row_number in sorted(rows):
+        if previous is not None and row_number != previous + 1:
+            updates.append({
+                'range': f'{start_column}{block_start}:{end_column}{previous}',
+                'values': block_values,
+            })
+            block_values = []
+            block_start = None
+        if block_start is None:
+            block_start = row_number
+        block_values.append(rows[row_number])
+        previous = row_number
+
+    if block_start is not None:
+        updates.append({
+            'range': f'{start_column}{block_start}:{end_column}{previous}',
+            'values': block_values,
+        })
+
+    return updates
+
+
+class SheetWriter:
+    """分析結果を逐次スプレッドシートへ書き込むライター
+
+    flush_every 件たまるか、最初の未書き込み結果から flush_interval 秒経過した時点で
+    batch_update を実行する。時間の条件はバックグラウンドのスレッドが見張るため、次の結果が
+    届かない間 (遅い動画の分析中や実行の終盤) も flush_interval 秒を過ぎれば書き込まれる。
+    連続する行は1つの範囲にまとめ、書き込みAPIのクォータはレートリミッターで守る
+    (429は max_retries 回までバックオフして再試行)。
+    report を渡すと、batch_update 1回ごとに 'sheet_write' ステージとして記録する。
+    書き込む列は start_column〜end_column (既定はM列〜X列)。extra_columns に (開始列, 終了列) を並べると、
+    書き込みデータの続きをそれらの列にも同じ batch_update で書き込む (離れた列を間の列に触れずに書く)。
+    """
+
+    def __init__(
+        self,
+        sheet,
+        flush_every: int = 25,
+        flush_interval: float = 60.0,
+        write_limiter: Optional[AdaptiveRateLimiter] = None,
+        report: Optional[RunReport] = None,
+        start_column: str = WRITE_START_COLUMN,
+        end_column: str = WRITE_END_COLUMN,
+        max_retries: int = 5,
+        extra_columns: Sequence[Tuple[str, str]] = (),
+    ):
+        self.sheet = sheet
+        self.start_column = start_column
+        self.end_column = end_column
+        self.extra_columns = list(extra_columns)
+        self.flush_every = flush_every
+        self.flush_interval = flush_interval
+        self.write_limiter = write_limiter
+        self.report = report
+        self.max_retries = max_retries
+        self.rows_written = 0
+        self.requests_sent = 0
+        self._pending: Dict[int, List[str]] = {}
+        self._pending_since: Optional[float] = None
+        self._lock = threading.Lock()
+        self._wakeup = threading.Condition(self._lock)
+        self._timer: Optional[threading.Thread] = None
+        self._closing = False
+
+    def add(self, sheet_row_number: int, write_data: List[str]) -> None:
+        """1行分の書き込みデータを追加し、条件を満たせば書き込む"""
+        with self._lock:
+            if self._pending_since is None:
+                self._pending_since = time.monotonic()
+                self._start_timer_locked()
+                self._wakeup.notify()
+            self._pending[sheet_row_number] = write_data
+
+            due = (
+                len(self._pending) >= self.flush_every
+                or time.monotonic() - self._pending_since >= self.flush_interval
+            )
+            if due:
+                self._flush_locked(raise_errors=False)
+
+    def flush(self) -> None:
+        """未書き込みの結果をすべて書き込む (失敗時は例外を送出)"""
+        with self._lock:
+            self._flush_locked(raise_errors=True)
+
+    def close(self) -> None:
+        """終了時の最終書き込み (時間で書き込むスレッドも止める)"""
+        with self._lock:
+            self._closing = True
+            self._wakeup.notify()
+        if self._timer is not None:
+            self._timer.join()
+        self.flush()
+
+    def _start_timer_locked(self) -> None:
+        if self._timer is None and not self._closing and self.flush_interval > 0:
+            self._timer = threading.Thread(target=self._run_timer, name='sheet-writer-timer', daemon=True)
+            self._timer.start()
+
+    def _run_timer(self) -> None:
+        """最初の未書き込み結果から flush_interval 秒経ったら書き込む (失敗したら flush_interval 秒後に再試行)"""
+        with self._lock:
+            while not self._closing:
+                if self._pending_since is None:
+                    self._wakeup.wait()
+                    continue
+                remaining = self._pending_since + self.flush_interval - time.monotonic()
+                if remaining > 0:
+                    self._wakeup.wait(remaining)
+                    continue
+                self._flush_locked(raise_errors=False)
+                if self._pending:
+                    self._wakeup.wait(self.flush_interval)
+
+    @property
+    def pending_count(self) -> int:
+        return len(self._pending)
+
+    def _flush_locked(self, raise_errors: bool) -> None:
+        if not self._pending:
+            return
+
+        updates = self._build_updates()
+        try:
+            if self.report is not None:
+                with self.report.span('sheet_write') as span:
+                    span.chars_in = sum(len(str(cell)) for row in self._pending.values() for cell in row)
+                    call_with_backoff(lambda: self.sheet.batch_update(updates), self.write_limiter, max_retries=self.max_retries)
+            else:
+                call_with_backoff(lambda: self.sheet.batch_update(updates), self.write_limiter, max_retries=self.max_retries)
+        except Exception as e:
+            # 失敗した結果は保持したまま、次回のflushで再試行する
+            print(f"  > Error: Sheet write failed ({len(self._pending)} rows pending). {e}")
+            if raise_errors:
+                raise
+            return
+
+        print(f"  > Flushed {len(self._pending)} rows to the spreadsheet in {len(updates)} ranges.")
+        self.rows_written += len(self._pending)
+        self.requests_sent += 1
+        self._pending = {}
+        self._pending_since = None
+
+    def _build_updates(self) -> List[Dict]:
+        """未書き込みの行を列の範囲ごとに分け、batch_update用データにする"""
+        if not self.extra_columns:
+            return coalesce_row_updates(self._pending, self.start_column, self.end_column)
+
+        updates = []
+        offset = 0
+        for start_column, end_column in [(self.start_column, self.end_column), *self.extra_columns]:
+            width = column_index(end_column) - column_index(start_column) + 1
+            rows = {row: write_data[offset:offset + width] for row, write_data in self._pending.items()}
+            updates.extend(coalesce_row_updates(rows, start_column, end_column))
+            offset += width
+        return updates
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            'rows_written': self.rows_written,
+            'requests_sent': self.requests_sent,
+            'pending': len(self._pending),
+        }
+
+
+# --- 読み込み ---
+
+def column_letter(column_index: int) -> str:
+    """0始まりの列番号をA1表記の列名に変換する (0→A, 25→Z, 26→AA)"""
+    letters = ""
+    n = column_index + 1
+    while n:
+        n, remainder = divmod(n - 1, 26)
+        letters = chr(ord('A') + remainder) + letters
+    return letters
+
+
+def column_index(column: str) -> int:
+    """A1表記の列名を0始まりの列番号に変換する (A→0, Z→25, AA→26)"""
+    n = 0
+    for letter in column.upper():
+        n = n * 26 + ord(letter) - ord('A') + 1
+    return n - 1
+
+
+def rows_from_all_values(
+    all_values: List[List[str]],
+    url_column_index: int,
+    start_column_index: int,
+) -> List[Tuple[int, str, str]]:
+    """get_all_values()の結果を (シート行番号, URL, 出発地点) のリストに変換する (ヘッダー行は除く)"""
+    row_tasks = []
+    for row_index, row in enumerate(all_values[1:]):
+        url = row[url_column_index] if len(row) > url_column_index else ""
+        current_start = row[start_column_index] if len(row) > start_column_index else ""
+        row_tasks.append((row_index + 2, url, current_start))
+    return row_tasks
+
+
+def read_url_and_start_columns(
+    sheet,
+    url_column_index: int,
+    start_column_index: int,
+    first_row: int = 2,
+) -> List[Tuple[int, str, str]]:
+    """URL列と出発地点列だけを batch_get で取得し、(シート行番号, URL, 出発地点) のリストにする
+
+    get_all_values() と違い、必要な2列分しかダウンロードしない。
+    """
+    url_column = column_letter(url_column_index)
+    start_column = column_letter(start_column_index)
+
+    # COLUMNS指定で、列ごとに1本のリストとして受け取る (末尾の空セルは省略される)
+    url_range, start_range = sheet.batch_get(
+        [f'{url_column}{first_row}:{url_column}', f'{start_column}{first_row}:{start_column}'],
+        major_dimension='COLUMNS',
+    )
+    urls = url_range[0] if url_range else []
+    starts = start_range[0] if start_range else []
+
+    row_tasks = []
+    for offset in range(max(len(urls), len(starts))):
+        url = urls[offset] if offset < len(urls) else ""
+        current_start = starts[offset] if offset < len(starts) else ""
+        row_tasks.append((first_row + offset, url, current_start))
+    return row_tasks
+
+
+def read_row_block(
+    sheet,
+    first_column_index: int,
+    last_column_index: int,
+    first_row: int = 2,
+) -> List[Tuple[int, List[str]]]:
+    """連続した列の範囲を batch_get で取得し、(シート行番号, セルの一覧) のリストにする
+
+    セルの一覧は常に列数分の長さにそろえる (Sheets APIは行末の空セルを省略するため)。
+    """
+    width = last_column_index - first_column_index + 1
+    a1_range = f'{column_letter(first_column_index)}{first_row}:{column_letter(last_column_index)}'
+    (values,) = sheet.batch_get([a1_range])
+    return [
+        (first_row + offset, (list(row) + [""] * width)[:width])
+        for offset, row in enumerate(values)
+    ]
@@ -0,0 +1,127 @@
+from array import array
+from bisect import bisect_right
+from typing import Dict, List, Optional
+
+
+def estimate_tokens(text: str) -> int:
+    """トークン数の概算 (日本語は1文字≒1トークン、ASCIIは4文字≒1トークン)"""
+    ascii_chars = sum(1 for ch in text if ord(ch) < 128)
+    return (len(text) - ascii_chars) + ascii_chars // 4 + 1
+
+
+def join_segments(segments: List[Dict]) -> str:
+    """セグメント一覧を1つのトランスクリプト文字列に結合する"""
+    return " ".join([item['text'] for item in segments])
+
+
+class CompactTranscript:
+    """トランスクリプトを1本のテキストと並列配列で持つコンパクトな構造
+
+    text は join_segments() と同じ文字列 (セグメントを半角スペースで結合したもの)。
+    i番目のセグメントは text[offsets[i]:ends[i]] で、動画内の開始秒は starts[i]、長さは durations[i]。
+    セグメントごとの辞書を持たないため、時間範囲での切り出しや、テキスト中の位置から
+    動画内の時刻への変換を、トランスクリプトを作り直さずに行える。
+    """
+
+    __slots__ = ('text', 'offsets', 'ends', 'starts', 'durations')
+
+    def __init__(self, text: str, offsets: array, ends: array, starts: array, durations: array):
+        self.text = text
+        self.offsets = offsets
+        self.ends = ends
+        self.starts = starts
+        self.durations = durations
+
+    @classmethod
+    def from_segments(cls, segments: List[Dict]) -> 'CompactTranscript':
+        offsets, ends = array('q'), array('q')
+        starts, durations = array('d'), array('d')
+        position = 0
+        for item in segments:
+            offsets.append(position)
+            position += len(item['text'])
+            ends.append(position)
+            position += 1  # 区切りの半角スペース
+            starts.append(item.get('start', 0.0))
+            durations.append(item.get('duration', 0.0))
+        return cls(join_segments(segments), offsets, ends, starts, durations)
+
+    def __len__(self) -> int:
+        return len(self.offsets)
+
+    def select(self, indices: List[int]) -> 'CompactTranscript':
+        """indices (昇順) のセグメントだけを残したトランスクリプト (各セグメントの時刻はそのまま)"""
+        offsets, ends = array('q'), array('q')
+        starts, durations = array('d'), array('d')
+        texts = []
+        position = 0
+        for index in indices:
+            text = self.segment_text(index)
+            texts.append(text)
+            offsets.append(position)
+            position += len(text)
+            ends.append(position)
+            position += 1  # 区切りの半角スペース
+            starts.append(self.starts[index])
+            durations.append(self.durations[index])
+        return CompactTranscript(" ".join(texts), offsets, ends, starts, durations)
+
+    def segment_text(self, index: int) -> str:
+        return self.text[self.offsets[index]:self.ends[index]]
+
+    def span_text(self, first: int, last: int) -> str:
+        """first番目からlast番目まで (両端を含む) のセグメントを結合した文字列"""
+        return self.text[self.offsets[first]:self.ends[last]]
+
+    def time_at(self, offset: int) -> float:
+        """text中の文字位置を、その文字を含むセグメントの開始秒に変換する"""
+        index = max(0, bisect_right(self.offsets, offset) - 1)
+        return self.starts[index] if len(self) else 0.0
+
+    def find_time(self, phrase: str) -> Optional[float]:
+        """phrase が最初に現れるセグメントの開始秒 (見つからなければNone)"""
+        offset = self.text.find(phrase) if phrase else -1
+        return self.time_at(offset) if offset >= 0 else None
+
+
+def chunk_transcript(
+    transcript: CompactTranscript,
+    max_tokens: int,
+    overlap_tokens: int = 0,
+) -> List[Dict]:
+    """トランスクリプトを、トークン数の上限を目安に重なりのあるウィンドウへ分割する
+
+    各ウィンドウは {'text', 'start', 'end'} (start/endは動画内の秒数)。
+    セグメントの途中では切らないため、1セグメントが上限を超える場合はそのまま1ウィンドウになる。
+    """
+    token_counts = [estimate_tokens(transcript.segment_text(index)) for index in range(len(transcript))]
+    windows = []
+    first = 0
+
+    while first < len(transcript):
+        # 上限に達するまでセグメントを詰める (最低1セグメント)
+        last = first
+        total = token_counts[first]
+        while last + 1 < len(transcript) and total + token_counts[last + 1] <= max_tokens:
+            last += 1
+            total += token_counts[last]
+
+        # ウィンドウの文字列は結合済みのテキストから切り出す (セグメントを結合し直さない)
+        windows.append({
+            'text': transcript.span_text(first, last),
+            'start': transcript.starts[first],
+            'end': transcript.starts[last] + transcript.durations[last],
+        })
+
+        if last + 1 >= len(transcript):
+            break
+
+        # 次のウィンドウは、末尾 overlap_tokens 分を含む位置から始める (必ず前進させる)
+        next_first = last + 1
+        overlap = 0
+        while next_first - 1 > first and overlap + token_counts[next_first - 1] <= overlap_tokens:
+            next_first -= 1
+            overlap += token_counts[next_first]
+        first = next_first
+
+    return windows
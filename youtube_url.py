@@ -0,0 +1,28 @@
+import re
+from typing import Iterable, List, Optional
+
+# 対応するURLの形 (ホスト名等は大文字小文字を区別しない。IDの文字種は大小両方を含むため影響しない)
+#   https://www.youtube.com/watch?v=ID&t=30s / m.youtube.com / music.youtube.com
+#   https://www.youtube.com/watch?feature=share&v=ID
+#   https://www.youtube.com/shorts/ID, /embed/ID, /live/ID, /v/ID, /e/ID
+#   https://www.youtube-nocookie.com/embed/ID
+#   https://youtu.be/ID?si=...#t=10
+# 動画IDは英数字と - _ の11文字 (12文字目も同じ文字種なら不正なIDとみなす)
+_VIDEO_URL = re.compile(
+    r"\s*(?:https?://)?(?:www\.|m\.|music\.)?"
+    r"(?:youtu\.be/|youtube(?:-nocookie)?\.com/(?:watch/?\?(?:[^#&\s]*&)*v=|(?:shorts|embed|live|v|e)/))"
+    r"([\w-]{11})(?![\w-])",
+    re.IGNORECASE | re.ASCII,
+)
+
+
+def parse_video_id(url: str) -> Optional[str]:
+    """YouTube URLから11文字の動画IDを取り出す。YouTubeの動画URLでなければNone"""
+    match = _VIDEO_URL.match(url)
+    return match[1] if match else None
+
+
+def parse_video_ids(urls: Iterable[str]) -> List[Optional[str]]:
+    """URLの列をまとめて動画IDの列に変換する (各要素は parse_video_id と同じ)"""
+    match = _VIDEO_URL.match
+    return [m[1] if m else None for m in map(match, urls)]